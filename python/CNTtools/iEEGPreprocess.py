@@ -1,10 +1,85 @@
 import numpy as np
 import pandas as pd
-import sys, os, json, pickle
+import sys, os, json, pickle, functools, itertools, shutil, tempfile, weakref
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
 from beartype import beartype
 from typing import Union, Iterable
 from numbers import Number
 from CNTtools import settings, tools
+from CNTtools.tools.cross_correlation import MAX_LAG
+
+# sample matrices saved as separate .npy files by iEEGData.save(fmt="npy")
+NPY_ARRAYS = ["data", "raw", "_base_data"]
+NPY_SIDECAR = "meta.pkl"
+
+
+def _is_npy_folder(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, NPY_SIDECAR))
+
+
+def _step(method):
+    """
+    Record a data-changing iEEGData method, with its arguments, as a replayable step of the history.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        out = method(self, *args, **kwargs)
+        if not self._replaying:
+            self._steps.append((method.__name__, args, kwargs))
+        return out
+
+    return wrapper
+
+
+def _npy_source(data, folder, name):
+    """
+    Path of a .npy file holding data, the file it is memory-mapped from if any, otherwise a copy saved in folder.
+    """
+    fname = getattr(data, "filename", None)
+    if isinstance(data, np.memmap) and fname and str(fname).endswith(".npy"):
+        if np.load(fname, mmap_mode="r").shape == data.shape:
+            return str(fname)
+    path = os.path.join(folder, name)
+    np.save(path, data)
+    return path
+
+
+def _save_replace(path, data):
+    """
+    Save data as .npy to path through a temporary file in the same folder, renamed into place, so arrays
+    still memory-mapped from a previous file at path, such as the clip's current data, are left intact.
+    """
+    fd, tmp = tempfile.mkstemp(suffix=".npy", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "wb") as file:
+            np.save(file, data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _map_clip(task):
+    """
+    Run a pipeline and feature functions on a clip, in a worker process of iEEGPreprocess.map.
+    Sample arrays are passed as .npy paths, opened memory-mapped, and the output is written to out_path,
+    so no sample array is pickled. Errors are returned as the clip status instead of raised.
+    """
+    key, source, fs, ch_names, filename, pipeline, features, out_path = task
+    try:
+        if isinstance(source, str):
+            source = np.load(source, mmap_mode="r")
+        result = pipeline.run(source, fs, ch_names, filename)
+        values = {name: func(result[0], fs) for name, func in features.items()}
+        if out_path is not None:
+            _save_replace(out_path, result[0])
+            result = (out_path,) + result[1:]
+        return key, result, values, "ok"
+    except Exception as e:
+        return key, None, {}, "{}: {}".format(type(e).__name__, e)
 
 
 class iEEGPreprocess:
@@ -21,6 +96,8 @@ class iEEGPreprocess:
         self.meta = pd.DataFrame(columns=["filename", "start", "stop", "dura", "fs"])
         # or = iEEGMeta()
         self.num_data = self.meta.shape[0]
+        # montages and electrode locations shared by clips of the same patient
+        self.montages = tools.MontageCache()
 
     ######################
     ## User Login Block ##
@@ -132,6 +209,9 @@ class iEEGPreprocess:
     def _add_data_instance(self, data):
         self.datasets[self.num_data] = data
         data.index = self.num_data
+        if not hasattr(self, "montages"):
+            self.montages = tools.MontageCache()
+        data.montage_cache = self.montages
 
         add_data = {
             "filename": data.filename,
@@ -164,6 +244,8 @@ class iEEGPreprocess:
         -----------
         dir : str
             The directory path or file path from which to load data.
+            Data saved with fmt='npy' is a folder, which can be loaded directly or from its parent directory.
+            Its sample matrices are memory-mapped, and only read from disk when accessed.
         replace : boolean
             Whether to replace current datasets and metadata. Default is False.
         default_folder: boolean
@@ -174,7 +256,7 @@ class iEEGPreprocess:
         AssertionError : "CNTtools:invalidFilenPath"
             Raised when the specified 'dir' does not exist.
         AssertionError : "CNTtools:invalidFileFormat"
-            Raised when the specified file is not in Pickle (.pkl) format.
+            Raised when the specified file is not in Pickle (.pkl) format, nor a folder saved with fmt='npy'.
         AssertionError : "CNTtools:invalidFileContents"
             Raised when the specified file does not contain iEEGData or iEEGPreprocess instance.
 
@@ -187,22 +269,29 @@ class iEEGPreprocess:
         >>>
         >>> # Load data from a saved data file, and replace current datasets
         >>> session.load_data("/path/to/saved_data.pkl", replace = True)
+        >>>
+        >>> # Lazily load data saved with fmt = 'npy'
+        >>> session.load_data("/path/to/data_directory/HUP172_phaseII_402580_402600")
         """
         if default_folder:
             dir = os.path.join(self.user_data_dir, dir)
         assert os.path.exists(dir), "CNTtools:invalidFilePath"
-        if os.path.isdir(dir):
-            filelist = os.listdir(dir)
-        elif os.path.isfile(dir):
-            dir,file = os.path.split(dir)
+        if _is_npy_folder(dir) or os.path.isfile(dir):
+            dir,file = os.path.split(os.path.normpath(dir))
             filelist = [file]
+        elif os.path.isdir(dir):
+            filelist = os.listdir(dir)
         assert any(
-            file.endswith(".pkl") for file in filelist
+            file.endswith(".pkl") or _is_npy_folder(os.path.join(dir, file))
+            for file in filelist
         ), "CNTtools:invalidFileFormat"
         for f in filelist:
             f = os.path.join(dir, f)
-            if f.endswith(".pkl"):
-                data = self._pickle_open(f)
+            if f.endswith(".pkl") or _is_npy_folder(f):
+                if f.endswith(".pkl"):
+                    data = self._pickle_open(f)
+                else:
+                    data = iEEGData._npy_open(f)
                 assert isinstance(data, iEEGData) or isinstance(
                     data, iEEGPreprocess
                 ), "CNTtools:invalidFileContents"
@@ -232,6 +321,7 @@ class iEEGPreprocess:
         select_elecs: list[Union[str, int]] = None,
         ignore_elecs: list[Union[str, int]] = None,
         username: str = None,
+        cache: bool = False,
     ):
         """
         Download iEEG data from ieeg.org with the specified parameters.
@@ -256,6 +346,11 @@ class iEEGPreprocess:
         username : str, optional
             The username for logging in to ieeg.org.
 
+        cache : bool, optional
+            Whether to serve the segment from the local cache in settings.CACHE_DIR, pulling only
+            uncached parts from ieeg.org. Whole blocks of settings.CACHE_BLOCK seconds are pulled and
+            kept, up to settings.CACHE_SIZE bytes. Default is False.
+
         Returns:
         --------
         data : iEEGData
@@ -273,10 +368,110 @@ class iEEGPreprocess:
             )  # ensure login, will raise error if user not config
         # initialize an data instance, with inputs
         data = iEEGData(filename, start, stop, select_elecs, ignore_elecs)
-        data._download(self.user)
+        data._download(self.user, cache=cache)
         self._add_data_instance(data)
         return data
 
+    def clear_montages(self, filename: str = None):
+        """
+        Clear cached montages and electrode locations, of a single patient/file if specified, otherwise all.
+        Needed when electrode locations of a patient change.
+        """
+        self.montages.clear(filename)
+
+    def map(
+        self,
+        pipeline: tools.Pipeline,
+        n_jobs: int = 1,
+        features: dict = None,
+        mmap_dir: str = None,
+        verbose: bool = True,
+    ):
+        """
+        Run a preprocessing pipeline, and feature functions of its output, on all data clips with a process pool.
+
+        Sample arrays are exchanged with workers through .npy files opened memory-mapped, never pickled:
+        clips loaded with fmt='npy' are read from their own files, others are saved to a temporary folder.
+        A clip that fails is left unchanged, and clips without data are skipped. Results are collected into
+        self.meta, with columns 'status' ('ok', 'not downloaded' or the error), 'nchs' and one column per feature.
+
+        Args:
+            pipeline (tools.Pipeline): Preprocessing pipeline, applied to each clip as with iEEGData.apply.
+            n_jobs (int, optional): Number of worker processes, -1 for all cores. Default is 1 (no pool).
+            features (dict, optional): Feature name to a picklable function of (data, fs), e.g. a module-level
+                function or functools.partial, evaluated on the processed data. Default is None.
+            mmap_dir (str, optional): Folder the processed data are saved in and memory-mapped from.
+                Default is None (processed data held in memory).
+            verbose (bool, optional): Print the progress and status of each clip. Default is True.
+
+        Example:
+        >>> pipe = tools.Pipeline().clean_labels().reject_nonieeg().reject_artifact().filter().reref("car")
+        >>> session.map(pipe, n_jobs=-1, features={"ll": line_length_feature})
+        >>> session.meta[session.meta.status != "ok"]
+        """
+        # one snapshot for all clips, recorded in their history
+        pipeline = pipeline.copy()
+        features = {} if features is None else dict(features)
+        n_jobs = os.cpu_count() if n_jobs < 0 else n_jobs
+        assert n_jobs > 0, "CNTtools:invalidNJobs"
+        tmp_dir = tempfile.mkdtemp() if n_jobs > 1 else None
+        out_dir = mmap_dir if mmap_dir is not None else tmp_dir
+        if out_dir is not None and not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        for name in ["status", "nchs"] + list(features):
+            if name not in self.meta.columns:
+                self.meta[name] = pd.Series(
+                    [None] * len(self.meta), index=self.meta.index, dtype=object
+                )
+
+        tasks, skipped = [], []
+        for key, data in self.datasets.items():
+            source = data.data
+            if source is None:
+                skipped.append((key, None, {}, "not downloaded"))
+                continue
+            if tmp_dir is not None:
+                source = _npy_source(source, tmp_dir, "{}_in.npy".format(key))
+            out_path = None
+            if out_dir is not None:
+                out_path = os.path.join(
+                    out_dir, "{}_{}_{}_{}.npy".format(key, data.filename, data.start, data.stop)
+                )
+            tasks.append(
+                (key, source, data.fs, data.ch_names, data.filename, pipeline, features, out_path)
+            )
+
+        try:
+            with ProcessPoolExecutor(n_jobs) if n_jobs > 1 else nullcontext() as pool:
+                if pool is None:
+                    results = map(_map_clip, tasks)
+                else:
+                    futures = [pool.submit(_map_clip, task) for task in tasks]
+                    results = (future.result() for future in as_completed(futures))
+                results = itertools.chain(skipped, results)
+                total = len(skipped) + len(tasks)
+                for done, (key, result, values, status) in enumerate(results, 1):
+                    data = self.datasets[key]
+                    if result is not None:
+                        if isinstance(result[0], str):
+                            mode = "c" if mmap_dir is not None else None
+                            result = (np.load(result[0], mmap_mode=mode),) + result[1:]
+                        data._apply_result(result)
+                        data._steps.append(("apply", (pipeline,), {}))
+                        self.meta.at[key, "nchs"] = data.nchs
+                    self.meta.at[key, "status"] = status
+                    for name, value in values.items():
+                        self.meta.at[key, name] = value
+                    if verbose:
+                        print(
+                            "[{}/{}] {} {}-{}: {}".format(
+                                done, total, data.filename, data.start, data.stop, status
+                            )
+                        )
+        finally:
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
     def list_data(self):
         """
         List all datasets as a table with necessary information, including filename from ieeg.org and start/stop time
@@ -294,15 +489,22 @@ class iEEGPreprocess:
             del self.datasets[ind]
         self.num_data = self.meta.shape[0]
 
-    def save(self, filename: str, default_folder: bool = True):
+    def save(self, filename: str, default_folder: bool = True, fmt: str = "pkl"):
         """
         Save the iEEGPreprocess instance in pickle format. Defaultly save to data/user.
 
         Args:
             filename (str): filename to save file. Can be either a path, or a name without path specified.
+            fmt (str, optional): 'pkl' pickles the whole session. 'npy' saves a folder containing each data
+                instance saved with iEEGData.save(fmt='npy'), which load_data opens lazily. Default is 'pkl'.
         """
+        assert fmt in ["pkl", "npy"], "CNTtools:invalidFileFormat"
         if default_folder:
             filename = os.path.join(self.user_data_dir, filename)
+        if fmt == "npy":
+            for data in self.datasets.values():
+                data.save(filename, fmt="npy")
+            return
         if ".pkl" not in filename:
             filename += ".pkl"
         self._pickle_save(filename)
@@ -379,10 +581,15 @@ class iEEGData:
         self.index = None
         self.power = {}
         self.conn = {}
+        self.conn_lag = {}
+        self.conn_dir = None  # folder of memory-mapped dynamic connectivity, None to keep it in memory
+        self.nan_method = None  # missing-sample handling of connectivity, set by fill_nan
+        self._nan_cache = None
         self.history = []
-        self.record()
+        self.montage_cache = None  # set to the session cache when added to a session
+        self._set_base()
 
-    def _download(self, user):
+    def _download(self, user, cache: bool = False):
         self.data, self.fs, self.ch_names = tools.get_ieeg_data(
             user["usr"],
             user["pwd"],
@@ -391,14 +598,16 @@ class iEEGData:
             self.stop,
             self.select_elecs,
             self.ignore_elecs,
+            cache_dir=settings.CACHE_DIR if cache else None,
         )
         self.nchs = len(self.ch_names)
         self.raw = self.data  # store a raw version of data and channel labels
         self.raw_chs = self.ch_names
         self.username = user["usr"]
         self.user_data_dir = os.path.join(settings.DATA_DIR, self.username[:3])
-        self.record()
+        self._set_base()
 
+    @_step
     def clean_labels(self):
         """
         Convert channel names to standardized format.
@@ -421,6 +630,17 @@ class iEEGData:
         self.bad, self.reject_details = tools.identify_bad_chs(self.data, self.fs)
         self.history.append("find_bad_chs")
 
+    def find_bad_epochs(self, win_size: Number = 10):
+        """
+        Find a windows X channels boolean mask of bad channels in each time window of win_size seconds,
+        and a clip-level summary, see tools.identify_bad_chs_windowed.
+        """
+        self.bad_epochs, self.epoch_details = tools.identify_bad_chs_windowed(
+            self.data, self.fs, win_size=win_size
+        )
+        self.history.append("find_bad_epochs")
+
+    @_step
     def reject_nonieeg(self):
         """
         Find and remove non-iEEG channels.
@@ -432,6 +652,7 @@ class iEEGData:
         self.nchs = len(self.ch_names)
         self.history.append("reject_nonieeg")
 
+    @_step
     def reject_artifact(self):
         """
         Find and remove bad channels.
@@ -443,6 +664,7 @@ class iEEGData:
         self.nchs = len(self.ch_names)
         self.history.append("reject_artifact")
 
+    @_step
     def bandpass_filter(self, low_freq: Number = 1, high_freq: Number = 120):
         """
         Filter iEEG signal with bandpass filter.
@@ -455,6 +677,7 @@ class iEEGData:
         self.data = tools.bandpass_filter(self.data, self.fs, low_freq, high_freq)
         self.history.append("bandpass_filter")
 
+    @_step
     def notch_filter(self, notch_freq: Number = 60):
         """
         Filter iEEG signal with notch filter.
@@ -466,41 +689,70 @@ class iEEGData:
         self.data = tools.notch_filter(self.data, self.fs, notch_freq)
         self.history.append("notch_filter")
 
+    @_step
     def filter(
-        self, low_freq: Number = 1, high_freq: Number = 120, notch_freq: Number = 60
+        self,
+        low_freq: Number = 1,
+        high_freq: Number = 120,
+        notch_freq: Number = 60,
+        dtype: type = None,
     ):
         """
-        Filter iEEG signal with bandpass and notch filter.
+        Filter iEEG signal with bandpass and notch filter, applied together in a single pass.
+        The output matches bandpass filtering followed by notch filtering except within a few seconds
+        of each edge, where the edge transients differ, see tools.bandpass_notch_filter.
 
         Args:
             low_freq (Number, optional): Lower filtering frequency threshold. Defaults to 1.
             high_freq (Number, optional): Higher filtering frequency threshold. Defaults to 120.
             notch_freq (Number, optional): Notch filtering frequency. Defaults to 60.
+            dtype (type, optional): np.float32 for a single precision output, see tools.bandpass_notch_filter. Defaults to None (double precision).
         """
         self.record()
-        self.data = tools.bandpass_filter(self.data, self.fs, low_freq, high_freq)
-        self.data = tools.notch_filter(self.data, self.fs, notch_freq)
+        self.data = tools.bandpass_notch_filter(
+            self.data, self.fs, low_freq, high_freq, notch_freq, dtype=dtype
+        )
         self.history.append("filter")
 
+    def _montage(self, method: str, radius: Number = 20):
+        """
+        Compiled montage of the current channels, from the session cache if available.
+        """
+        locs = self.locs if method == "laplacian" else None
+        loc_file = getattr(self, "loc_file", None) if method == "laplacian" else None
+        cache = getattr(self, "montage_cache", None)
+        if cache is None:
+            cache = tools.MontageCache()
+        return cache.montage(self.filename, self.ch_names, method, locs, radius, loc_file)
+
+    def _apply_montage(self, method: str, radius: Number = 20):
+        """
+        Re-reference data with a montage, dropping channels without a valid reference.
+        """
+        montage = self._montage(method, radius)
+        self.record()
+        self.data, self.ref_chnames = montage.apply(self.data), montage.labels
+        inds = np.where(self.ref_chnames == "-")[0]
+        if len(inds) > 0:
+            self.data = np.delete(self.data, inds, axis=1)
+            self.ch_names = np.delete(self.ch_names, inds)
+            self.ref_chnames = np.delete(self.ref_chnames, inds)
+        self.nchs = len(self.ch_names)
+
+    @_step
     def car(self):
         """
         Perform Common Average Reference (CAR) on the input iEEG data.
         """
-        self.record()
-        self.data, self.ref_chnames = tools.car(self.data, self.ch_names)
+        self._apply_montage("car")
         self.history.append("car")
 
+    @_step
     def bipolar(self):
         """
         Perform Bipolar Re-referencing (BR) on the input iEEG data.
         """
-        self.record()
-        self.data, self.ref_chnames = tools.bipolar(self.data, self.ch_names)
-        inds = np.where(self.ref_chnames == "-")[0]
-        self.data = np.delete(self.data, inds, axis=1)
-        self.ch_names = np.delete(self.ch_names, inds)
-        self.nchs = len(self.ch_names)
-        self.ref_chnames = np.delete(self.ref_chnames, inds)
+        self._apply_montage("bipolar")
         self.history.append("bipolar")
 
     def load_locs(self, loc_file: str = ''):
@@ -509,8 +761,15 @@ class iEEGData:
             assert os.path.exists(loc_file),'CNTtools:invalidLocFile\nPlease specify a electrode location file for laplacian re-referencing, with format | fileID/patientID | electrodeName | x | y | z | \nFor default loading, please save electrode location information with filename elec_locs.csv in test/data/elec_locs.csv.\n'
         else:
             assert os.path.exists(loc_file),'CNTtools:invalidLocFile'
-        self.locs = tools.get_elec_locs(self.filename, self.ch_names, loc_file)
+        cache = getattr(self, "montage_cache", None)
+        if cache is None:
+            self.locs = tools.get_elec_locs(self.filename, self.ch_names, loc_file)
+        else:
+            self.locs = cache.elec_locs(self.filename, self.ch_names, loc_file)
+        # laplacian neighbors are queried from the file's location store
+        self.loc_file = loc_file
 
+    @_step
     def laplacian(self, locs: str = '', radius: Number = 20):
         """
         Perform Laplacian (LAR) on the input iEEG data.
@@ -529,18 +788,10 @@ class iEEGData:
             raise Exception(
                 "Please load electrodes locs first.\nLocs can be loaded through: data.load_locs(filename).\n"
             )
-
-        self.record()
-        self.data, self.ref_chnames = tools.laplacian(
-            self.data, self.ch_names, self.locs, radius
-        )
-        inds = np.where(self.ref_chnames == "-")[0]
-        self.data = np.delete(self.data, inds, axis=1)
-        self.ch_names = np.delete(self.ch_names, inds)
-        self.nchs = len(self.ch_names)
-        self.ref_chnames = np.delete(self.ref_chnames, inds)
+        self._apply_montage("laplacian", radius)
         self.history.append("laplacian")
 
+    @_step
     def reref(self, ref: str, locs: str = '', radius: Number = 20):
         """
         Perform re-referencing on the input iEEG data.
@@ -549,6 +800,8 @@ class iEEGData:
         * Bipolar Re-referencing (BR)
         * Laplacian Re-referencing (LAR): Note, requires location of electrodes and radius threshold
 
+        Montages are compiled once per patient and channel set, and reused across clips of a session.
+
         Args:
             ref (str): re-referencing method. Available options: 'car', 'bipolar', 'laplacian'.
             locs (str, optional): The path to the file containing electrode locations. If not provided,
@@ -557,67 +810,101 @@ class iEEGData:
                 Default is 20.
         """
         assert ref in ["car", "bipolar", "laplacian"], "CNTtools:invalidRerefMethod"
-        if ref == "car":
-            self.record()
-            self.data, self.ref_chnames = tools.car(self.data, self.ch_names)
-        elif ref == "bipolar":
-            self.record()
-            self.data, self.ref_chnames = tools.bipolar(self.data, self.ch_names)
-            inds = np.where(self.ref_chnames == "-")[0]
-            self.data = np.delete(self.data, inds, axis=1)
-            self.ch_names = np.delete(self.ch_names, inds)
-            self.ref_chnames = np.delete(self.ref_chnames, inds)
-        elif ref == "laplacian":
+        if ref == "laplacian":
             self.load_locs(locs)
             if not hasattr(self, "locs"):
                 raise Exception(
                     "Please load electrodes locs first.\nLocs can be loaded through: data.load_locs(filename).\n"
                 )
-            self.record()
-            self.data, self.ref_chnames = tools.laplacian(
-                self.data, self.ch_names, self.locs, radius
-            )
-            inds = np.where(self.ref_chnames == "-")[0]
-            self.data = np.delete(self.data, inds, axis=1)
-            self.ch_names = np.delete(self.ch_names, inds)
-            self.ref_chnames = np.delete(self.ref_chnames, inds)
-        self.nchs = len(self.ch_names)
+        self._apply_montage(ref, radius)
         self.history.append("reref-" + ref)
 
-    def pre_whiten(self):
+    @_step
+    def pre_whiten(self, order: int = 1):
         """
         Perform pre-whitening on iEEG data.
+
+        Args:
+            order (int, optional): Order of the autoregressive model, see tools.pre_whiten. Defaults to 1.
         """
         self.record()
-        self.data = tools.pre_whiten(self.data)
+        self.data = tools.pre_whiten(self.data, order)
         self.history.append("pre_whiten")
 
-    def bandpower(self, band, window: Number = None, relative: bool = False):
+    def apply(self, pipeline: tools.Pipeline):
+        """
+        Run a preprocessing pipeline, fused and chunked over time, see tools.Pipeline.
+
+        Args:
+            pipeline (tools.Pipeline): The pipeline, which can be shared by all clips of a session.
+
+        Example:
+        >>> pipe = tools.Pipeline().clean_labels().reject_nonieeg().filter().reref("car")
+        >>> data.apply(pipe)
+        """
+        self._apply_result(pipeline.run(self.data, self.fs, self.ch_names, self.filename))
+        # recorded as a copy, so steps later added to the pipeline are not replayed
+        if not self._replaying:
+            self._steps.append(("apply", (pipeline.copy(),), {}))
+
+    def _apply_result(self, result):
+        """
+        Set the output of Pipeline.run, computed here or by a worker of iEEGPreprocess.map.
+        """
+        self.record()
+        self.data, self.ch_names, ref_chnames, info = result
+        if len(ref_chnames) > 0:
+            self.ref_chnames = ref_chnames
+        if "nonieeg" in info:
+            self.nonieeg = info["nonieeg"]
+        if "bad" in info:
+            self.bad, self.reject_details = info["bad"], info["reject_details"]
+        self.nchs = len(self.ch_names)
+        self.history.append("pipeline")
+
+    def bandpower(
+        self,
+        band,
+        window: Number = None,
+        relative: bool = False,
+        win_size: Number = None,
+        step: Number = None,
+    ):
         """
         Compute the average power of the signal x in a specific frequency band.
+        The spectrum is computed once and shared by all bands, see tools.bandpower_windows.
 
         Parameters
         ----------
         band : list
             Lower and upper frequencies of the band of interest.
         window : Number
-            Length of each window in seconds.
-            If None, window_sec = (1 / min(band)) * 2
+            Length of each Welch segment in seconds.
+            If None, the scipy.signal.welch default of 256 samples.
         relative : boolean
             If True, return the relative power (= divided by the total power of the signal).
             If False (default), return the absolute power.
+        win_size : Number
+            If given, compute band power trajectories in time windows of win_size seconds.
+        step : Number
+            Step between consecutive windows in seconds. Default is win_size.
+
+        The absolute and relative power of all bands are also stored in self.power['abs'] and
+        self.power['rel'], windows X channels X bands, with the start time of each window in seconds
+        in self.power['times'].
         """
-        # update according to matlab!!!
         band = np.asarray(band)
-        assert band.shape[1] == 2, "CNTtools:invalidBandRange"
-        nband = band.shape[0]
-        self.power["freq"] = []
-        self.power["power"] = []
-        for i in range(nband):
-            self.power["freq"].append(band[i, :])
-            self.power["power"].append(
-                tools.bandpower(self.data, self.fs, band[i, :], window, relative)
-            )
+        assert band.ndim == 2 and band.shape[1] == 2, "CNTtools:invalidBandRange"
+        power, rel_power, times = tools.bandpower_windows(
+            self.data, self.fs, band, win_size, step, segment=window
+        )
+        out = rel_power if relative else power
+        if win_size is None:
+            out = out[0]
+        self.power["freq"] = list(band)
+        self.power["power"] = [out[..., i] for i in range(band.shape[0])]
+        self.power["abs"], self.power["rel"] = power, rel_power
+        self.power["times"] = times
         self.history.append("bandpower")
         return self.power
 
@@ -633,49 +920,98 @@ class iEEGData:
         self.ll = tools.line_length(self.data)
         return self.ll
 
-    def pearson(self, win=True, win_size=2):
+    def fill_nan(self, method: str = "mean"):
+        """
+        Set how connectivity handles missing (NaN) samples, see tools.fill_nan.
+
+        The filled data and the mask of missing samples ('nan_mask') are computed once per state of the
+        data and shared, read-only, by all connectivity methods; the data itself is not changed.
+        Without fill_nan, each connectivity method handles missing samples itself.
+
+        Args:
+            method (str, optional): 'mean', 'linear', or 'mask', which fills as 'mean' and ignores the
+                time windows where a channel has missing samples. Defaults to 'mean'.
+        """
+        self.nan_method = method
+        self._nan_cache = None
+        self._nan_stage()
+        self.history.append("fill_nan-" + method)
+
+    @property
+    def nan_mask(self):
+        """
+        Boolean mask of the missing samples of the current data, samples X channels, once fill_nan is set.
+        """
+        if self.nan_method is None:
+            return None
+        return self._nan_stage()[1]
+
+    def _nan_stage(self):
+        """
+        Filled data and mask of missing samples, recomputed only when the data has changed.
+        """
+        cache = self._nan_cache
+        if cache is None or cache[0]() is not self.data:
+            filled, mask = tools.fill_nan(self.data, self.nan_method)
+            cache = self._nan_cache = (weakref.ref(self.data), filled, mask)
+        return cache[1], cache[2]
+
+    def pearson(self, win=True, win_size=2, dynamic=False, step=None):
         """
         Calculate the Pearson correlation coefficients between channels in the iEEG data.
 
         Parameters:
         - win (bool, optional): If True, calculate windowed correlations; if False, calculate overall correlations. Default is True.
         - win_size (Number, optional): Size of the time window in seconds for windowed correlation calculation. Default is 2 seconds.
+        - dynamic (bool, optional): If True, keep the correlations of every time window as a tools.DynamicConn instead of their average,
+          memory-mapped in conn_dir if set. Default is False.
+        - step (Number, optional): Step between consecutive time windows in seconds. Default is win_size (no overlap).
 
         The result is stored in the 'pearson' key of the 'conn' attribute of the EEG object.
         """
-        self.conn["pearson"] = tools.pearson(
-            self.data, self.fs, win=win, win_size=win_size
-        )
+        self.connectivity(["pearson"], win, win_size, dynamic=dynamic, step=step)
 
-    def squared_pearson(self, win=True, win_size=2):
+    def squared_pearson(self, win=True, win_size=2, dynamic=False, step=None):
         """
         Calculate the Squared Pearson correlation coefficients between channels in the iEEG data.
 
         Parameters:
         - win (bool, optional): If True, calculate windowed correlations; if False, calculate overall correlations. Default is True.
         - win_size (Number, optional): Size of the time window in seconds for windowed correlation calculation. Default is 2 seconds.
+        - dynamic (bool, optional): If True, keep the correlations of every time window as a tools.DynamicConn instead of their average,
+          memory-mapped in conn_dir if set. Default is False.
+        - step (Number, optional): Step between consecutive time windows in seconds. Default is win_size (no overlap).
 
         The result is stored in the 'sqaured_pearson' key of the 'conn' attribute of the EEG object.
         """
-        self.conn["squared_pearson"] = tools.squared_pearson(
-            self.data, self.fs, win=win, win_size=win_size
-        )
+        self.connectivity(["squared_pearson"], win, win_size, dynamic=dynamic, step=step)
 
-    def cross_corr(self, win=True, win_size=2):
+    def cross_corr(self, win=True, win_size=2, dynamic=False, step=None, max_lag=MAX_LAG):
         """
         Calculate the cross correlation between channels in the iEEG data.
 
         Parameters:
         - win (bool, optional): If True, calculate windowed correlations; if False, calculate overall correlations. Default is True.
         - win_size (Number, optional): Size of the time window in seconds for windowed correlation calculation. Default is 2 seconds.
+        - dynamic (bool, optional): If True, keep the peak correlations and lags of every time window as tools.DynamicConn instead of their average,
+          memory-mapped in conn_dir if set. Default is False.
+        - step (Number, optional): Step between consecutive time windows in seconds. Default is win_size (no overlap).
+        - max_lag (Number, optional): Maximum lag in milliseconds. Default is 200 ms.
+
+        The result is stored in the 'cross_corr' key of the 'conn' attribute of the EEG object,
+        and the lags (in seconds) of peak correlation in the 'cross_corr' key of the 'conn_lag' attribute.
 
-        The result is stored in the 'cross_corr' key of the 'conn' attribute of the EEG object.
+        Returns:
+        - Tuple[np.ndarray, np.ndarray]: Peak cross correlation and lag matrices, or their DynamicConn if dynamic.
         """
-        self.conn["cross_corr"], _ = tools.cross_correlation(
-            self.data, self.fs, win=win, win_size=win_size
+        self.connectivity(
+            ["cross_corr"], win, win_size, dynamic=dynamic, step=step, max_lag=max_lag
         )
+        return self.conn["cross_corr"], self.conn_lag["cross_corr"]
 
-    def coherence(self, win=True, win_size=2, segment=1, overlap=0.5):
+    def coherence(
+        self, win=True, win_size=2, segment=1, overlap=0.5, dynamic=False, step=None
+    ):
         """
         Calculate the coherence between channels in the Electroencephalogram (EEG) data.
 
@@ -684,45 +1020,57 @@ class iEEGData:
         - win_size (Number, optional): Size of the time window in seconds for windowed coherence calculation. Default is 2 seconds.
         - segment (Number, optional): Duration of each segment in seconds for multi-taper spectral estimation. Default is 1 second.
         - overlap (Number, optional): Overlap between segments for multi-taper spectral estimation, in seconds. Default is 0.5 seconds.
+        - dynamic (bool, optional): If True, keep the coherence of every time window as a tools.DynamicConn instead of their average,
+          memory-mapped in conn_dir if set. Default is False.
+        - step (Number, optional): Step between consecutive time windows in seconds. Default is win_size (no overlap).
 
         The result is stored in the 'coh' key of the 'conn' attribute of the EEG object.
         """
-        self.conn["coh"] = tools.coherence(
-            self.data,
-            self.fs,
-            win=win,
-            win_size=win_size,
-            segment=segment,
-            overlap=overlap,
+        self.connectivity(
+            ["coh"], win, win_size, segment, overlap, dynamic=dynamic, step=step
         )
 
-    def plv(self, win=True, win_size=2):
+    def plv(self, win=True, win_size=2, dynamic=False, step=None):
         """
         Calculate the phase-locking value (PLV) between channels in the iEEG data.
 
         Parameters:
         - win (bool, optional): If True, calculate windowed correlations; if False, calculate overall correlations. Default is True.
         - win_size (Number, optional): Size of the time window in seconds for windowed correlation calculation. Default is 2 seconds.
+        - dynamic (bool, optional): If True, keep the values of every time window as a tools.DynamicConn instead of their average,
+          memory-mapped in conn_dir if set. Default is False.
+        - step (Number, optional): Step between consecutive time windows in seconds. Default is win_size (no overlap).
 
         The result is stored in the 'plv' key of the 'conn' attribute of the EEG object.
         """
-        self.conn["plv"] = tools.plv(self.data, self.fs, win=win, win_size=win_size)
+        self.connectivity(["plv"], win, win_size, dynamic=dynamic, step=step)
 
-    def relative_entropy(self, win=True, win_size=2):
+    def relative_entropy(self, win=True, win_size=2, dynamic=False, step=None):
         """
         Calculate the relative entropy between channels in the iEEG data.
 
         Parameters:
         - win (bool, optional): If True, calculate windowed correlations; if False, calculate overall correlations. Default is True.
         - win_size (Number, optional): Size of the time window in seconds for windowed correlation calculation. Default is 2 seconds.
+        - dynamic (bool, optional): If True, keep the relative entropies of every time window as a tools.DynamicConn instead of their average,
+          memory-mapped in conn_dir if set. Default is False.
+        - step (Number, optional): Step between consecutive time windows in seconds. Default is win_size (no overlap).
 
         The result is stored in the 'rela_entropy' key of the 'conn' attribute of the EEG object.
         """
-        self.conn["rela_entropy"] = tools.relative_entropy(
-            self.data, self.fs, win=win, win_size=win_size
-        )
+        self.connectivity(["rela_entropy"], win, win_size, dynamic=dynamic, step=step)
 
-    def connectivity(self, methods, win=True, win_size=2, segment=1, overlap=0.5):
+    def connectivity(
+        self,
+        methods,
+        win=True,
+        win_size=2,
+        segment=1,
+        overlap=0.5,
+        dynamic=False,
+        step=None,
+        max_lag=MAX_LAG,
+    ):
         """
         Calculate various connectivity measures between channels in the iEEG data.
 
@@ -733,37 +1081,50 @@ class iEEGData:
         - win_size (Number, optional): Size of the time window in seconds for windowed connectivity calculation. Default is 2 seconds.
         - segment (Number, optional): Duration of each segment in seconds for multi-taper spectral estimation. Default is 1 second.
         - overlap (Number, optional): Overlap between segments for multi-taper spectral estimation, in seconds. Default is 0.5 seconds.
+        - dynamic (bool, optional): If True, keep the connectivity of every time window as a tools.DynamicConn per method,
+          stored as float32 upper triangles and memory-mapped in conn_dir if set, see tools.dynamic_connectivity. Default is False.
+        - step (Number, optional): Step between consecutive time windows in seconds. Default is win_size (no overlap).
+        - max_lag (Number, optional): Maximum lag of cross_corr in milliseconds. Default is 200 ms.
 
         The calculated connectivity measures are stored in the 'conn' attribute of the EEG object.
+        Intermediate results shared by several methods are computed once, see tools.connectivity.
+        Missing samples are handled as set by fill_nan, otherwise by each method.
 
         """
-        if "pearson" in methods:
-            self.conn["pearson"] = tools.pearson(
-                self.data, self.fs, win=win, win_size=win_size
-            )
-        if "squared_pearson" in methods:
-            self.conn["squared_pearson"] = tools.squared_pearson(
-                self.data, self.fs, win=win, win_size=win_size
-            )
-        if "cross_corr" in methods:
-            self.conn["cross_corr"] = tools.cross_correlation(
-                self.data, self.fs, win=win, win_size=win_size
+        data, mask = self.data, None
+        if self.nan_method is not None:
+            data, mask = self._nan_stage()
+            if self.nan_method != "mask":
+                mask = None
+        if dynamic:
+            conn, conn_lag = tools.dynamic_connectivity(
+                data,
+                self.fs,
+                methods,
+                win_size=win_size if win else None,
+                segment=segment,
+                overlap=overlap,
+                step=step,
+                folder=self.conn_dir,
+                prefix="{}_{}_{}_".format(self.filename, self.start, self.stop),
+                mask=mask,
+                max_lag=max_lag,
             )
-        if "coh" in methods:
-            self.conn["coh"] = tools.coherence(
-                self.data,
+        else:
+            conn, conn_lag = tools.connectivity(
+                data,
                 self.fs,
+                methods,
                 win=win,
                 win_size=win_size,
                 segment=segment,
                 overlap=overlap,
+                step=step,
+                mask=mask,
+                max_lag=max_lag,
             )
-        if "plv" in methods:
-            self.conn["plv"] = tools.plv(self.data, self.fs, win=win, win_size=win_size)
-        if "rela_entropy" in methods:
-            self.conn["rela_entropy"] = tools.relative_entropy(
-                self.data, self.fs, win=win, win_size=win_size
-            )
+        self.conn.update(conn)
+        self.conn_lag.update(conn_lag)
 
     def plot(self, time_range_data=None, t_axis=None, select=None):
         """
@@ -831,11 +1192,12 @@ class iEEGData:
                 if method is "pearson":
                     cmap = plt.cm.get_cmap("RdBu")
                     cmap = cmap.reversed()
-        # get data
-        if np.ndim(self.conn[method]) == 3:
-            data = self.conn[method][:, :, ind]
-        else:
-            data = self.conn[method]
+        # get data, averaged over time windows if dynamic
+        data = self.conn[method]
+        if isinstance(data, tools.DynamicConn):
+            data = data.mean()
+        if np.ndim(data) == 3:
+            data = data[:, :, ind]
         # figure
         nchan = data.shape[1]
         tmpfigsize = [nchan / 4, nchan * 0.8 / 4]
@@ -879,26 +1241,106 @@ class iEEGData:
         plt.show()
         return fig
 
+    # undo without snapshots replays steps from the base data; snapshots trade memory for faster undo
+    max_checkpoints = 0
+    _replaying = False
+
+    def _set_base(self):
+        """
+        Set the current state as the base of the history, from which processing steps are replayed.
+        """
+        self._base_data = self.data
+        self._base_chs = self.ch_names
+        self._base_refchs = self.ref_chnames
+        self._steps = []
+        self._checkpoints = {}
+        self._rev_cache = None
+
     def record(self):
         """
-        Record current status.
+        Record current status, before a processing step.
+        Only references are kept, as a checkpoint if max_checkpoints > 0, evicting the oldest checkpoints.
         """
-        self._rev_data = self.data
-        self._rev_chs = self.ch_names
-        self._rev_refchs = self.ref_chnames
+        if self._replaying or self.max_checkpoints <= 0:
+            return
+        self._checkpoints[len(self._steps)] = (self.data, self.ch_names, self.ref_chnames)
+        while len(self._checkpoints) > self.max_checkpoints:
+            del self._checkpoints[min(self._checkpoints)]
 
-    def reverse(self):
+    def _restore(self, n: int):
         """
-        Reverse by one processing step.
+        Restore the state after the first n processing steps, replaying them from the closest checkpoint.
         """
-        if self.history:
-            self.data = self._rev_data
-            self.ch_names = self._rev_chs
-            if self.ch_names is not None:
-                self.nchs = len(self.ch_names)
-            self.ref_chnames = self._rev_refchs
+        steps = self._steps
+        start = max([k for k in self._checkpoints if k <= n], default=0)
+        if start in self._checkpoints:
+            self.data, self.ch_names, self.ref_chnames = self._checkpoints[start]
+        else:
+            self.data, self.ch_names, self.ref_chnames = (
+                self._base_data,
+                self._base_chs,
+                self._base_refchs,
+            )
+        self._steps = steps[:n]
+        self._checkpoints = {k: v for k, v in self._checkpoints.items() if k <= n}
+
+        history = self.history
+        self.history = []
+        self._replaying = True
+        try:
+            for name, args, kwargs in steps[start:n]:
+                getattr(self, name)(*args, **kwargs)
+        finally:
+            self._replaying = False
+            self.history = history
+        if self.ch_names is not None:
+            self.nchs = len(self.ch_names)
+
+    @property
+    def _rev_data(self):
+        """
+        Data before the last processing step, replayed once per last step and then cached.
+        """
+        if not self._steps:
+            return self.data
+        # the step tuple itself identifies the history, as steps are replaced after a reverse
+        last = (len(self._steps), self._steps[-1])
+        cache = self._rev_cache
+        if cache is None or cache[0] != last[0] or cache[1] is not last[1]:
+            state = iEEGData.__new__(iEEGData)
+            state.__dict__.update(self.__dict__)
+            state._restore(len(self._steps) - 1)
+            cache = self._rev_cache = (*last, state.data)
+        return cache[2]
+
+    def reverse(self, steps: int = 1):
+        """
+        Reverse by a number of processing steps, 1 by default.
+        """
+        if self._steps:
+            self._restore(max(0, len(self._steps) - steps))
             self.history.append("reverse")
 
+    def __getstate__(self):
+        # the session montage cache and checkpoints are not saved with the data
+        state = self.__dict__.copy()
+        state.pop("montage_cache", None)
+        state["_checkpoints"] = {}
+        state["_nan_cache"] = None
+        state["_rev_cache"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault("conn_dir", None)
+        self.__dict__.setdefault("nan_method", None)
+        self.__dict__.setdefault("_nan_cache", None)
+        self.__dict__.setdefault("_rev_cache", None)
+        if "_steps" not in state:
+            # saved before replayable history, the current state becomes the base
+            self.__dict__.pop("_rev_data", None)
+            self._set_base()
+
     def _pickle_save(self, filename):
         with open(filename, "wb") as file:
             pickle.dump(self, file)
@@ -908,13 +1350,68 @@ class iEEGData:
             data = pickle.load(file)
         return data
 
-    def save(self, file: str = None, default_folder: bool = True):
+    def _npy_save(self, folder):
+        """
+        Save sample matrices as .npy files and the remaining attributes in a pickled sidecar.
+        Matrices shared between attributes (e.g. data and raw before processing) are saved once.
+        """
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        state = self.__getstate__()
+        arrays = {}
+        for name in NPY_ARRAYS:
+            arr = state.get(name)
+            if not isinstance(arr, np.ndarray):
+                continue
+            shared = [k for k in arrays if getattr(self, k) is arr]
+            if shared:
+                arrays[name] = arrays[shared[0]]
+            else:
+                arrays[name] = name + ".npy"
+                np.save(os.path.join(folder, arrays[name]), arr)
+            state[name] = None
+        state["_npy_arrays"] = arrays
+        with open(os.path.join(folder, NPY_SIDECAR), "wb") as file:
+            pickle.dump(state, file)
+
+    @staticmethod
+    def _npy_open(folder):
+        """
+        Open data saved by _npy_save. Sample matrices are memory-mapped copy-on-write, so only the
+        channels and time ranges touched are read from disk, and the files are never modified.
+        """
+        with open(os.path.join(folder, NPY_SIDECAR), "rb") as file:
+            state = pickle.load(file)
+        arrays = state.pop("_npy_arrays")
+        opened = {}
+        for name, fname in arrays.items():
+            if fname not in opened:
+                opened[fname] = np.load(os.path.join(folder, fname), mmap_mode="c")
+            state[name] = opened[fname]
+        data = iEEGData.__new__(iEEGData)
+        data.__setstate__(state)
+        return data
+
+    def save(self, file: str = None, default_folder: bool = True, fmt: str = "pkl"):
         """
-        Save data instance in pickle format. Defaultly save to data/user/filename_start_stop.
+        Save data instance. Defaultly save to data/user/filename_start_stop.
 
         Args:
             file (str, optional): filename to save file. Can be either a path, or a fullpath with filename.
-        """
+            fmt (str, optional): 'pkl' pickles the whole instance. 'npy' saves a folder with sample matrices
+                as .npy files and other attributes in a sidecar, which loads lazily through memory mapping.
+                With 'npy', file is the folder to save into. Default is 'pkl'.
+        """
+        assert fmt in ["pkl", "npy"], "CNTtools:invalidFileFormat"
+        if fmt == "npy":
+            if file is None:
+                file = self.user_data_dir
+            self._npy_save(
+                os.path.join(
+                    file, self.filename + "_" + str(self.start) + "_" + str(self.stop)
+                )
+            )
+            return
         filename = self.filename + "_" + str(self.start) + "_" + str(self.stop) + ".pkl"
         if file is None:
             # filename not provided, default filename & folder
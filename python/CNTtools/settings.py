@@ -12,9 +12,16 @@ TEST_DIR = os.path.join(ROOT_DIR, "test")
 DATA_DIR = os.path.join(ROOT_DIR, "data")
 USER_DIR = os.path.join(ROOT_DIR, "users")
 TESTDATA_DIR = os.path.join(TEST_DIR, "data")
+CACHE_DIR = os.path.join(DATA_DIR, "cache")
 
-DIRS = [DATA_DIR, USER_DIR]
+DIRS = [DATA_DIR, USER_DIR, CACHE_DIR]
 
 for d in DIRS:
     if not os.path.exists(d):
         os.mkdir(d)
+
+#####################
+#   SEGMENT CACHE   #
+#####################
+CACHE_BLOCK = 60  # duration (s) of each cached block, aligned to multiples from t = 0
+CACHE_SIZE = 20 * 1024**3  # maximum total size (bytes) of cached blocks
@@ -1,7 +1,7 @@
 # %%Imports
 import os
 import numpy as np
-from CNTtools.tools import bandpower
+from CNTtools.tools import bandpower, bandpower_windows, sliding_windows
 # %%
 
 def test_bandpowerabs():
@@ -66,3 +66,35 @@ def test_bandpowerrela():
     assert len(bp) == data.shape[1], 'Band power size mismatch'
     assert np.all(bp >= 0), 'Relative band power should be greater than or equal to zero'
     assert np.all(bp <= 1), 'Relative band power should be less than or equal to one'
+
+
+def test_bandpowerwindows():
+    fs = 250
+    time = np.arange(0, 20, 1 / fs)
+    # alpha in the first half, beta in the second
+    data = np.where(time < 10, np.sin(2 * np.pi * 10 * time), np.sin(2 * np.pi * 20 * time))
+    data = np.column_stack([data, np.random.randn(len(time))])
+    bands = [[8, 12], [15, 25]]
+
+    power, rel_power, times = bandpower_windows(data, fs, bands, win_size=2, step=1)
+    assert power.shape == rel_power.shape == (19, 2, 2)
+    assert np.array_equal(times, np.arange(19))
+    assert np.all(rel_power[:9, 0, 0] > 0.9) and np.all(rel_power[10:, 0, 1] > 0.9)
+    assert np.all(rel_power[:9, 0, 1] < 0.1) and np.all(rel_power[10:, 0, 0] < 0.1)
+
+    # same as bandpower on each window and band
+    for w in [0, 7, 18]:
+        for b, band in enumerate(bands):
+            segment = data[w * fs : w * fs + 2 * fs]
+            assert np.allclose(power[w, :, b], bandpower(segment, fs, band))
+            assert np.allclose(rel_power[w, :, b], bandpower(segment, fs, band, relative=True))
+
+    power, _, times = bandpower_windows(data, fs, bands)
+    assert power.shape == (1, 2, 2) and np.array_equal(times, [0])
+
+    # windows of the connectivity measures, rounded to the nearest sample
+    fs = 100.3
+    windows, times = sliding_windows(data, fs, 2, step=1)
+    power, _, ptimes = bandpower_windows(data, fs, bands, win_size=2, step=1)
+    assert len(power) == len(windows) and np.array_equal(ptimes, times)
+    assert np.allclose(power[3, :, 0], bandpower(windows[3], fs, bands[0]))
@@ -3,7 +3,7 @@ import numpy as np
 import pytest
 import os
 import sys
-from CNTtools.tools import clean_labels
+from CNTtools.tools import clean_labels, parse_labels, split_label
 from CNTtools.settings import TESTDATA_DIR
 
 data = pd.read_csv(os.path.join(TESTDATA_DIR, "cleanLabel_testInput.csv"))
@@ -19,4 +19,13 @@ def test_channel(input, expected):
         clean_channel = clean_labels(input)
         assert expected == clean_channel
     except AttributeError as e:
-        assert False
\ No newline at end of file
+        assert False
+
+def test_parselabels():
+    parsed = parse_labels(["LA 01", "EKG", "RDH12", "O1", "LA1B"])
+    assert list(parsed["label"]) == ["LA1", "EKG", "RDH12", "O1", "LA1B"]
+    assert list(parsed["elec"]) == ["LA", "EKG", "RDH", "O", "LA"]
+    assert list(parsed["number"]) == [1, -1, 12, 1, -1]
+    assert list(parsed["non_ieeg"]) == [False, True, False, True, False]
+    assert split_label("LA1") == ("LA", 1)
+    assert split_label("EKG") == ("EKG", None)
@@ -0,0 +1,40 @@
+# Imports
+import numpy as np
+from scipy.signal import coherence as coh
+from CNTtools.tools import coherence
+# %%
+
+
+def _coherence_pairs(values, fs, freqs, nperseg, noverlap):
+    nchs = values.shape[1]
+    out = np.zeros((nchs, nchs, freqs.shape[0]))
+    for i in range(nchs):
+        for j in range(nchs):
+            f, cxy = coh(values[:, i], values[:, j], fs=fs, nperseg=nperseg, noverlap=noverlap)
+            for k in range(freqs.shape[0]):
+                out[i, j, k] = np.mean(cxy[(f >= freqs[k, 0]) & (f <= freqs[k, 1])])
+    return out
+
+
+def test_coherence():
+    fs = 128
+    freqs = np.array([[1, 4], [4, 8], [8, 12], [30, 64]])
+    t = np.arange(8 * fs) / fs
+    values = np.random.randn(8 * fs, 4)
+    values[:, 1] += 3 * np.sin(2 * np.pi * 10 * t)
+    values[:, 2] += 3 * np.sin(2 * np.pi * 10 * t + 1)
+
+    out = coherence(values.copy(), fs, freqs=freqs)
+    assert out.shape == (4, 4, 4)
+    assert np.allclose(out, _coherence_pairs(values, fs, freqs, fs, fs // 2))
+    assert out[1, 2, 2] > out[0, 3, 2]
+
+    out = coherence(values.copy(), fs, win=True, win_size=2, freqs=freqs)
+    expected = np.mean(
+        [
+            _coherence_pairs(values[w * 2 * fs : (w + 1) * 2 * fs], fs, freqs, fs, fs // 2)
+            for w in range(4)
+        ],
+        axis=0,
+    )
+    assert np.allclose(out, expected)
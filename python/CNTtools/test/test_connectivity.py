@@ -0,0 +1,94 @@
+# Imports
+import pickle
+import numpy as np
+from CNTtools import tools
+from CNTtools.tools import connectivity, cross_correlation, dynamic_connectivity
+# %%
+
+
+def test_connectivity():
+    fs = 128
+    freqs = np.array([[1, 4], [4, 8], [8, 12], [30, 60]])
+    values = np.random.randn(8 * fs, 4)
+    values[:, 1] += values[:, 0]
+    values[10:20, 2] = np.nan
+    methods = ["pearson", "squared_pearson", "cross_corr", "coh", "plv", "rela_entropy"]
+
+    for win in [False, True]:
+        orig = values.copy()
+        conn, conn_lag = connectivity(values, fs, methods, win=win, freqs=freqs)
+        assert np.array_equal(values, orig, equal_nan=True)
+        assert set(conn) == set(methods)
+        assert set(conn_lag) == {"cross_corr"}
+
+        expected = {
+            "pearson": tools.pearson(values.copy(), fs, win, 2),
+            "squared_pearson": tools.squared_pearson(values.copy(), fs, win),
+            "coh": tools.coherence(values.copy(), fs, win, freqs=freqs),
+            "plv": tools.plv(values.copy(), fs, win, freqs=freqs),
+            "rela_entropy": tools.relative_entropy(values.copy(), fs, win, freqs=freqs),
+        }
+        for m in expected:
+            assert np.allclose(conn[m], expected[m], equal_nan=True)
+        mb, lb = tools.cross_correlation(values.copy(), fs, win)
+        assert np.allclose(conn["cross_corr"], mb, equal_nan=True)
+        assert np.allclose(conn_lag["cross_corr"], lb, equal_nan=True)
+
+    conn, conn_lag = connectivity(values, fs, ["plv"], freqs=freqs)
+    assert list(conn) == ["plv"] and conn_lag == {}
+
+
+def test_connectivity_timeseries():
+    fs = 128
+    freqs = np.array([[1, 4], [8, 12]])
+    values = np.random.randn(10 * fs, 3)
+    methods = ["pearson", "cross_corr", "coh", "plv", "rela_entropy"]
+    conn, conn_lag, times = connectivity(
+        values, fs, methods, win_size=2, step=1, freqs=freqs, timeseries=True
+    )
+    assert np.array_equal(times, np.arange(9))
+    assert conn["pearson"].shape == conn_lag["cross_corr"].shape == (9, 3, 3)
+    for m in ["coh", "plv", "rela_entropy"]:
+        assert conn[m].shape == (9, 3, 3, 2)
+    avg, _ = connectivity(values, fs, methods, win_size=2, step=1, freqs=freqs)
+    for m in methods:
+        assert np.allclose(np.nanmean(conn[m], axis=0), avg[m], equal_nan=True)
+
+
+def test_dynamic_connectivity(tmp_path):
+    fs = 128
+    freqs = np.array([[1, 4], [8, 12]])
+    values = np.random.randn(10 * fs, 4)
+    values[10:20, 2] = np.nan
+    methods = ["pearson", "squared_pearson", "cross_corr", "coh", "plv", "rela_entropy"]
+    ref, ref_lag, times = connectivity(
+        values, fs, methods, win_size=2, step=1, freqs=freqs, timeseries=True
+    )
+    conn, conn_lag = dynamic_connectivity(
+        values, fs, methods, win_size=2, step=1, freqs=freqs, folder=str(tmp_path), chunk_size=4
+    )
+    assert (tmp_path / "plv.npy").exists() and (tmp_path / "cross_corr_lag.npy").exists()
+    for m in methods:
+        assert conn[m].values.dtype == np.float32
+        assert conn[m].values.shape[1] == 10  # upper triangle of 4 channels
+        assert conn[m].shape == ref[m].shape
+        assert np.allclose(conn[m][:], ref[m], atol=1e-6, equal_nan=True)
+        assert np.allclose(conn[m].mean(), np.nanmean(ref[m], axis=0), atol=1e-6)
+    assert np.allclose(conn_lag["cross_corr"][:], ref_lag["cross_corr"])
+
+    # lags limited to max_lag as in cross_correlation
+    lag = dynamic_connectivity(values, fs, ["cross_corr"], win_size=2, step=1, max_lag=50)[1]
+    xc_lag = cross_correlation(values, fs, True, 2, max_lag=50, step=1, timeseries=True)[1]
+    assert np.allclose(lag["cross_corr"][:], xc_lag)
+    assert np.nanmax(np.abs(xc_lag)) <= 0.05
+
+    # lazy accessors by window, time and band
+    assert np.array_equal(conn["plv"].times, times)
+    assert np.allclose(conn["plv"][3], ref["plv"][3], atol=1e-6)
+    assert np.allclose(conn["plv"].between(2, 5, band=1), ref["plv"][2:5, ..., 1], atol=1e-6)
+    assert conn["pearson"].between(6.5).shape == (2, 4, 4)
+
+    # memory-mapped series are reopened from their file
+    plv = pickle.loads(pickle.dumps(conn["plv"]))
+    assert isinstance(plv.values, np.memmap)
+    assert np.array_equal(plv[:], conn["plv"][:], equal_nan=True)
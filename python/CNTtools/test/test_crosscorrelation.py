@@ -0,0 +1,38 @@
+# Imports
+import numpy as np
+from scipy.signal import correlate
+from CNTtools.tools import cross_correlation
+# %%
+
+
+def _xcorr_pairs(values, ml):
+    n, nchan = values.shape
+    lags = np.arange(-n + 1, n)
+    keep = np.abs(lags) <= ml
+    mb = np.ones((nchan, nchan))
+    lb = np.zeros((nchan, nchan))
+    for i in range(nchan):
+        for j in range(i, nchan):
+            r = correlate(values[:, i], values[:, j])[keep]
+            r = r / np.sqrt(np.sum(values[:, i] ** 2) * np.sum(values[:, j] ** 2))
+            mb[i, j] = mb[j, i] = np.max(r)
+            lb[i, j] = lb[j, i] = lags[keep][np.argmax(r)]
+    return mb, lb
+
+
+def test_crosscorrelation():
+    fs = 200
+    values = np.random.randn(6 * fs, 4)
+    values[10:, 1] = values[:-10, 0] + 0.1 * np.random.randn(6 * fs - 10)
+
+    mb, lb = cross_correlation(values, fs, max_lag=100)
+    exp_mb, exp_lb = _xcorr_pairs(values, 20)
+    assert np.allclose(mb, exp_mb)
+    assert np.allclose(lb, exp_lb / fs)
+    assert np.isclose(lb[0, 1], -10 / fs)
+    assert np.allclose(np.diag(mb), 1)
+
+    mb, lb = cross_correlation(values, fs, win=True, win_size=2, max_lag=100, batch_size=3)
+    exp = [_xcorr_pairs(values[w * 2 * fs : (w + 1) * 2 * fs], 20) for w in range(3)]
+    assert np.allclose(mb, np.mean([e[0] for e in exp], axis=0))
+    assert np.allclose(lb, np.mean([e[1] for e in exp], axis=0) / fs)
@@ -0,0 +1,51 @@
+# Imports
+import os
+import numpy as np
+import pandas as pd
+from CNTtools import settings
+from CNTtools.tools import compile_montage, get_elec_locs, load_elec_locs
+from CNTtools.tools.get_elec_locs import _stores
+# %%
+
+
+def test_eleclocs():
+    filename = os.path.join(settings.TESTDATA_DIR, "elec_locs.csv")
+    rows = pd.read_csv(filename, header=None).dropna()
+    rows = rows[rows[0] == "HUP082"]
+
+    labels = list(rows[1][:3]) + ["XX1"]
+    locs = get_elec_locs("HUP082_phaseII", labels, filename)
+    assert locs.shape == (4, 3)
+    assert np.allclose(locs[:3], rows.iloc[:3, 2:].to_numpy(dtype=float))
+    assert np.all(np.isnan(locs[3]))
+    assert np.all(np.isnan(get_elec_locs("XXX000", labels, filename)))
+
+    # parsed once, and labels matched after cleaning
+    store = load_elec_locs(filename)
+    assert load_elec_locs(filename) is store
+    assert np.allclose(store.lookup("HUP082", "LST 1"), locs[:1])
+    tree = store.tree("HUP082")
+    assert tree.n == len(rows)
+    assert store.tree("HUP082_phaseII") is tree
+
+    # laplacian neighbors from the patient's tree match those found from the channel locations
+    labels = list(rows[1][:10]) + ["XX1"]
+    close = store.neighbors("HUP082_phaseII", labels, 20)
+    locs = store.lookup("HUP082_phaseII", labels)
+    expected = compile_montage("laplacian", labels, locs, 20)
+    assert np.array_equal(close.toarray(), expected.neighbors.T.toarray())
+    montage = compile_montage("laplacian", labels, radius=20, neighbors=close)
+    assert np.array_equal(montage.matrix.toarray(), expected.matrix.toarray())
+
+
+def test_eleclocs_reload(tmp_path):
+    # a single store is kept per file, reloaded when the file changes
+    filename = str(tmp_path / "elec_locs.csv")
+    pd.DataFrame([["HUP000", "LA1", 0, 0, 0]]).to_csv(filename, header=False, index=False)
+    store = load_elec_locs(filename)
+    pd.DataFrame([["HUP000", "LA1", 1, 0, 0]]).to_csv(filename, header=False, index=False)
+    os.utime(filename, (0, os.path.getmtime(filename) + 1))
+    nstores = len(_stores)
+    assert load_elec_locs(filename) is not store
+    assert np.allclose(load_elec_locs(filename).lookup("HUP000", "LA1"), [[1, 0, 0]])
+    assert len(_stores) == nstores
@@ -0,0 +1,60 @@
+# Imports
+import numpy as np
+from CNTtools import tools
+from CNTtools.iEEGPreprocess import iEEGData
+from CNTtools.tools import fill_nan
+# %%
+
+
+def test_fillnan():
+    values = np.random.randn(100, 4)
+    values[[0, 1, 50, 51, 99], 1] = np.nan
+    values[:, 3] = np.nan
+    orig = values.copy()
+
+    filled, mask = fill_nan(values)
+    assert np.array_equal(values, orig, equal_nan=True)
+    assert np.array_equal(mask, np.isnan(orig))
+    assert np.allclose(filled[mask[:, 1], 1], np.nanmean(orig[:, 1]))
+    assert np.array_equal(filled[:, [0, 2]], orig[:, [0, 2]])
+    assert np.all(np.isnan(filled[:, 3]))
+
+    filled = fill_nan(values, "linear", mask)[0]
+    x = np.arange(100)
+    ok = ~mask[:, 1]
+    assert np.allclose(filled[:, 1], np.interp(x, x[ok], orig[ok, 1]))
+
+    # clean data is returned as a read-only view
+    clean = values[:, [0, 2]].copy()
+    filled, mask = fill_nan(clean)
+    assert not mask.any() and np.shares_memory(filled, clean)
+    assert not filled.flags.writeable
+
+
+def test_fillnan_connectivity():
+    fs = 128
+    freqs = np.array([[1, 4], [8, 12]])
+    values = np.random.randn(8 * fs, 3)
+    values[300:310, 2] = np.nan
+    orig = values.copy()
+
+    # tools no longer fill the caller's array in place
+    tools.plv(values, fs, True, freqs=freqs)
+    tools.coherence(values, fs, True, freqs=freqs)
+    tools.relative_entropy(values, fs, True, freqs=freqs)
+    assert np.array_equal(values, orig, equal_nan=True)
+
+    # masked channels are dropped from the windows with missing samples
+    mask = np.isnan(values)
+    conn, _, times = tools.connectivity(
+        fill_nan(values)[0], fs, ["pearson", "plv"], freqs=freqs, timeseries=True, mask=mask
+    )
+    assert np.all(np.isnan(conn["pearson"][1, 2])) and np.all(np.isnan(conn["plv"][1, :, 2]))
+    assert not np.isnan(conn["pearson"][[0, 2, 3]]).any()
+
+    data = iEEGData("HUP000", 0, 8, data=values, fs=fs, ch_names=np.array(["A1", "A2", "A3"]))
+    data.fill_nan("mask")
+    assert np.array_equal(data.nan_mask, mask)
+    data.pearson()
+    assert np.allclose(data.conn["pearson"], np.nanmean(conn["pearson"], axis=0))
+    assert np.array_equal(data.data, orig, equal_nan=True)
@@ -0,0 +1,41 @@
+# Imports
+import os
+import numpy as np
+from CNTtools import settings
+from CNTtools.tools import design_sos, bandpass_notch_filter, bandpass_filter, notch_filter
+from CNTtools.tools.filter_bank import _butter_sos
+from scipy.io import loadmat
+# %%
+
+
+def test_designsos():
+    _butter_sos.cache_clear()
+    sos = design_sos(512, [1, 120], 2, "bandpass")
+    assert np.array_equal(design_sos(512.0, (1.0, 120.0), 2, "bandpass"), sos)
+    assert _butter_sos.cache_info().hits == 1
+    sos[:] = 0
+    assert np.any(design_sos(512, [1, 120], 2, "bandpass") != 0)
+    assert design_sos(512, [59, 61], 4, "bandstop").shape == (4, 6)
+
+
+def test_bandpassnotchfilter():
+    data = loadmat(os.path.join(settings.TESTDATA_DIR,'sampleData.mat'),squeeze_me = True)
+    old_values = data['old_values']
+    fs = data['fs']
+    values = bandpass_notch_filter(old_values, fs)
+    assert values.shape == old_values.shape
+    values = bandpass_notch_filter(old_values, fs, 5, 50, None)
+    assert np.allclose(values, bandpass_filter(old_values, fs, 5, 50))
+
+    # cascade differs from sequential filtering only by edge transients
+    fs = 500
+    old_values = np.cumsum(np.random.randn(120 * fs, 3), axis=0)
+    expected = notch_filter(bandpass_filter(old_values, fs), fs)
+    values = bandpass_notch_filter(old_values, fs)
+    scale = np.max(np.abs(expected))
+    mid = slice(30 * fs, 90 * fs)
+    assert np.allclose(values[mid], expected[mid], rtol=0, atol=1e-6 * scale)
+    # single precision output of double precision filtering, within float32 rounding (~6e-8 of the peak)
+    values = bandpass_notch_filter(old_values, fs, dtype=np.float32)
+    assert values.dtype == np.float32
+    assert np.allclose(values[mid], expected[mid], rtol=0, atol=1e-6 * scale)
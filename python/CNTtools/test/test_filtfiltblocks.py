@@ -0,0 +1,46 @@
+# Imports
+import os
+import numpy as np
+from CNTtools import settings
+from CNTtools.tools import filtfilt_blocks, bandpass_filter, notch_filter
+from scipy.io import loadmat
+from scipy.signal import butter, sosfiltfilt
+# %%
+
+
+def test_filtfiltblocks(tmp_path):
+    fs = 500
+    values = np.cumsum(np.random.randn(60 * fs, 4), axis=0)
+    sos = butter(2, [1, 120], btype="bandpass", fs=fs, output="sos")
+    expected = sosfiltfilt(sos, values, axis=0)
+    scale = np.max(np.abs(expected))
+
+    # array source
+    out = filtfilt_blocks(sos, values, block_size=3000)
+    assert np.allclose(out, expected, rtol=0, atol=1e-6 * scale)
+
+    # generator source, uneven blocks
+    source = (values[i : i + 1234] for i in range(0, values.shape[0], 1234))
+    out = np.concatenate(list(filtfilt_blocks(sos, source, block_size=2000)))
+    assert np.allclose(out, expected, rtol=0, atol=1e-6 * scale)
+
+    # memmap source and sink
+    np.save(tmp_path / "src.npy", values)
+    src = np.load(tmp_path / "src.npy", mmap_mode="r")
+    sink = np.lib.format.open_memmap(
+        str(tmp_path / "out.npy"), mode="w+", shape=values.shape
+    )
+    filtfilt_blocks(sos, src, out=sink, block_size=5000)
+    assert np.allclose(sink, expected, rtol=0, atol=1e-6 * scale)
+
+
+def test_filtfiltblocks_tools():
+    data = loadmat(os.path.join(settings.TESTDATA_DIR,'sampleData.mat'),squeeze_me = True)
+    old_values = data['old_values']
+    fs = data['fs']
+    expected = bandpass_filter(old_values, fs)
+    values = bandpass_filter(old_values, fs, block_size=4096)
+    assert np.allclose(values, expected, rtol=0, atol=1e-6 * np.nanmax(np.abs(expected)))
+    expected = notch_filter(old_values, fs)
+    values = notch_filter(old_values, fs, block_size=4096)
+    assert np.allclose(values, expected, rtol=0, atol=1e-6 * np.nanmax(np.abs(expected)))
@@ -1,7 +1,8 @@
 # Imports
 import os
+import numpy as np
 from CNTtools import settings
-from CNTtools.tools import identify_bad_chs
+from CNTtools.tools import identify_bad_chs, identify_bad_chs_windowed
 from scipy.io import loadmat
 # %%
 
@@ -9,4 +10,55 @@ def test_identifybadchs():
     data = loadmat(os.path.join(settings.TESTDATA_DIR,'sampleData.mat'),squeeze_me = True)
     old_values = data['old_values']
     fs = data['fs']
-    identify_bad_chs(old_values,fs)
\ No newline at end of file
+    identify_bad_chs(old_values,fs)
+
+def test_identifybadchs_criteria():
+    fs = 500
+    n = 5000
+    t = np.arange(n) / fs
+    values = np.random.randn(n, 10) * 10
+    values[: n // 2 + 5, 0] = np.nan
+    values[: n // 2 + 5, 1] = 0
+    values[::50, 2] = 1e4
+    values[100, 3] = 500
+    values[:, 4] += 100 * np.sin(2 * np.pi * 60 * t)
+    values[:, 5] *= 50
+    values[:10, 6] = np.nan
+
+    for batch_size in [None, 3]:
+        bad, details = identify_bad_chs(values, fs, batch_size=batch_size)
+        assert np.array_equal(np.nonzero(bad)[0], np.arange(6))
+        assert details["nans"] == [0]
+        assert details["zeros"] == [1]
+        assert details["high_voltage"] == [2]
+        assert details["var"] == [3]
+        assert details["noisy"] == [4]
+        assert details["higher_std"] == [5]
+
+
+def test_identifybadchs_windowed():
+    fs = 500
+    values = np.random.randn(10 * fs + 100, 4) * 10
+    values[2 * fs : 4 * fs, 1] = 0  # transient disconnection
+    values[:, 3] = np.nan
+
+    mask, summary = identify_bad_chs_windowed(values, fs, win_size=2)
+    assert mask.shape == (5, 4)
+    assert np.array_equal(mask[:, 1], [False, True, False, False, False])
+    assert np.all(mask[:, 3]) and not np.any(mask[:, [0, 2]])
+    assert np.array_equal(summary["zeros"], [0, 1, 0, 0])
+    assert np.array_equal(summary["nans"], [0, 0, 0, 5])
+    assert np.array_equal(summary["bad"], [False, False, False, True])
+
+    # same result from a stream of blocks
+    blocks = (values[i : i + 777] for i in range(0, values.shape[0], 777))
+    mask_stream, summary_stream = identify_bad_chs_windowed(blocks, fs, win_size=2)
+    assert np.array_equal(mask, mask_stream)
+    assert np.allclose(summary["fraction"], summary_stream["fraction"])
+
+    # running std baseline, flagging a window where all channels jump together
+    values = np.random.randn(20 * fs, 4) * 10
+    values[10 * fs : 12 * fs] *= 20
+    mask, summary = identify_bad_chs_windowed(values, fs, win_size=2)
+    assert np.array_equal(np.nonzero(mask.any(axis=1))[0], [5])
+    assert np.array_equal(summary["higher_std"], [1, 1, 1, 1])
@@ -0,0 +1,81 @@
+# Imports
+import numpy as np
+from CNTtools.iEEGPreprocess import iEEGPreprocess, iEEGData
+from CNTtools.tools import compile_montage, bipolar, car, laplacian, pseudo_laplacian
+from CNTtools.tools import MontageCache
+# %%
+
+
+def test_montage():
+    labels = np.array(["LA1", "LA2", "LA04", "LB1", "LB3", "FZ", "CZ", "EKG"])
+    data = np.random.randn(100, len(labels))
+    data[10:20, 4] = np.nan
+
+    montage = compile_montage("bipolar", labels)
+    out, out_labels = bipolar(data, labels)
+    assert montage.shape == (8, 8)
+    assert np.allclose(montage.apply(data), out, equal_nan=True)
+    assert list(out_labels) == ["LA1-LA2", "LA2-LA4", "-", "LB1-LB3", "-", "FZ-CZ", "-", "-"]
+    assert np.allclose(out[:, 1], data[:, 1] - data[:, 2])
+    assert np.all(np.isnan(out[:, 2]))
+
+    out, out_labels = pseudo_laplacian(data, labels)
+    assert np.allclose(out[:, 1], data[:, 1] - data[:, 0])  # raw label LA04 is not LA3
+    pseudo = pseudo_laplacian(data[:, :3], np.array(["LA1", "LA2", "LA3"]))[0]
+    assert np.allclose(pseudo[:, 1], data[:, 1] - (data[:, 0] + data[:, 2]) / 2)
+    assert np.allclose(out[:, 0], data[:, 0] - data[:, 1])
+    assert list(out_labels[-3:]) == ["-", "-", "-"]
+
+    out, out_labels = car(data, labels)
+    assert np.allclose(out, data - np.nanmean(data, 1)[:, np.newaxis], equal_nan=True)
+    assert out_labels[0] == "LA1-CAR"
+
+    locs = np.zeros((len(labels), 3))
+    locs[:, 0] = [0, 5, 10, 100, 105, 200, 300, np.nan]
+    out, out_labels = laplacian(data, labels, locs, 8)
+    assert np.allclose(out[:, 1], data[:, 1] - (data[:, 0] + data[:, 2]) / 2)
+    assert np.allclose(out[:, 3], data[:, 3] - np.nanmean(data[:, [4]], 1), equal_nan=True)
+    assert out_labels[5] == "-"  # no neighbors, falls back to pseudo-laplacian
+    assert np.all(np.isnan(out[:, 5]))
+
+    # applied to a stream of blocks
+    blocks = montage.apply(data[i : i + 30] for i in range(0, 100, 30))
+    assert np.allclose(np.concatenate(list(blocks)), montage.apply(data), equal_nan=True)
+
+
+def test_montagecache():
+    labels = ["LA1", "LA2", "LA3", "LB1", "LB2"]
+    data = np.random.randn(100, len(labels))
+
+    cache = MontageCache()
+    montage = cache.montage("HUP000", labels, "bipolar")
+    assert cache.montage("HUP000", np.array(labels), "bipolar") is montage
+    assert cache.montage("HUP000", labels, "car") is not montage
+    assert cache.montage("HUP001", labels, "bipolar") is not montage
+    assert len(cache) == 3
+    # laplacian montages are compiled again for other locations
+    locs = np.c_[np.arange(5.0), np.zeros((5, 2))]
+    lap = cache.montage("HUP000", labels, "laplacian", locs, 1.5)
+    assert cache.montage("HUP000", labels, "laplacian", locs.copy(), 1.5) is lap
+    assert cache.montage("HUP000", labels, "laplacian", 3 * locs, 1.5) is not lap
+    assert len(cache) == 5
+    cache.clear("HUP000")
+    assert len(cache) == 1
+    cache.clear()
+    assert len(cache) == 0
+
+    # clips of a session share compiled montages
+    session = iEEGPreprocess()
+    clips = [
+        iEEGData("HUP000", 0, 1, data=data.copy(), fs=100, ch_names=np.array(labels)),
+        iEEGData("HUP000", 1, 2, data=data.copy(), fs=100, ch_names=np.array(labels)),
+    ]
+    for clip in clips:
+        session._add_data_instance(clip)
+        clip.reref("bipolar")
+    assert len(session.montages) == 1
+    out, out_labels = bipolar(data, labels)
+    assert np.allclose(clips[1].data, out[:, out_labels != "-"])
+    assert list(clips[1].ch_names) == ["LA1", "LA2", "LB1"]
+    session.clear_montages()
+    assert len(session.montages) == 0
@@ -0,0 +1,37 @@
+# Imports
+import numpy as np
+from CNTtools.tools import pearson, MatrixAccumulator
+# %%
+
+
+def test_pearson():
+    fs = 50
+    values = np.random.randn(41 * fs, 4)
+    values[:, 1] += values[:, 0]
+    values[130:140, 2] = np.nan
+    values[:, 3] = 1  # constant channel
+    all_pc = np.stack(
+        [np.corrcoef(values[i : i + 2 * fs], rowvar=False) for i in range(0, 40 * fs, 2 * fs)]
+    )
+
+    pc, times = pearson(values, fs, True, 2, timeseries=True)
+    assert np.allclose(pc, all_pc, equal_nan=True)
+    assert np.array_equal(times, np.arange(0, 40, 2))
+    for chunk_size in [None, 3]:
+        pc, var = pearson(values, fs, True, 2, variance=True, chunk_size=chunk_size)
+        assert np.allclose(pc, np.nanmean(all_pc, axis=0), equal_nan=True)
+        assert np.allclose(var, np.nanvar(all_pc, axis=0), equal_nan=True)
+    assert np.allclose(pearson(values, fs, False, 2), np.corrcoef(values, rowvar=False), equal_nan=True)
+
+
+def test_accumulator():
+    mats = np.random.randn(50, 3, 3)
+    mats[:20, 0, 1] = np.nan
+    mats[:, 2, 2] = np.nan
+    acc = MatrixAccumulator(variance=True)
+    for batch in np.array_split(mats, 7):
+        acc.update(batch)
+    assert np.allclose(acc.mean, np.nanmean(mats, axis=0), equal_nan=True)
+    assert np.allclose(acc.var, np.nanvar(mats, axis=0), equal_nan=True)
+    assert acc.count[0, 1] == 30 and acc.count[2, 2] == 0
+    assert MatrixAccumulator().update(mats).var is None
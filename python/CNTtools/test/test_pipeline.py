@@ -3,9 +3,9 @@ import pandas as pd
 import numpy as np
 import pytest
 import os
-from CNTtools.iEEGPreprocess import iEEGPreprocess, settings
+from CNTtools.iEEGPreprocess import iEEGPreprocess, iEEGData, settings
 from CNTtools.test import test_auth
-from CNTtools import settings
+from CNTtools import settings, tools
 
 def test_pipeline():
     test_auth.test_auth()
@@ -79,4 +79,195 @@ def test_pipeline():
     data.reverse()
     assert data.data.shape[1] == len(selec)
     assert len(data.ch_names) == len(selec)
-    assert data.nchs == len(selec)
\ No newline at end of file
+    assert data.nchs == len(selec)
+
+def test_npy_storage(tmp_path):
+    values = np.random.randn(2000, 4)
+    chs = np.array(["LA1", "LA2", "LA3", "LA4"])
+    data = iEEGData("I001_P034_D01", 1000, 1004, data=values, fs=500, ch_names=chs)
+    data.raw = data.data
+    data.car()
+    data.save(str(tmp_path), fmt="npy")
+    folder = os.path.join(str(tmp_path), "I001_P034_D01_1000_1004")
+    assert set(os.listdir(folder)) == {"data.npy", "raw.npy", "meta.pkl"}
+
+    session = iEEGPreprocess()
+    session.load_data(str(tmp_path), default_folder=False)
+    assert session.num_data == 1
+    loaded = session.datasets[0]
+    assert isinstance(loaded.data, np.memmap)
+    assert np.allclose(loaded.data, data.data)
+    assert loaded._rev_data is loaded.raw
+    assert loaded.history == ["car"]
+    loaded.reverse()
+    assert np.array_equal(loaded.data, values)
+
+    session.save(str(tmp_path / "session"), default_folder=False, fmt="npy")
+    session.load_data(str(tmp_path / "session"), default_folder=False)
+    assert session.num_data == 2
+
+
+def test_history():
+    fs = 500
+    values = np.random.randn(10 * fs, 4)
+    chs = np.array(["LA1", "LA2", "LA3", "EKG1"])
+    for checkpoints in [0, 2]:
+        data = iEEGData("I001_P034_D01", 0, 10, data=values, fs=fs, ch_names=chs)
+        data.max_checkpoints = checkpoints
+        data.reject_nonieeg()
+        after_reject = data.data
+        data.filter(1, 100, 60)
+        filtered = data.data
+        data.car()
+        data.pre_whiten()
+        assert np.array_equal(values, data._base_data)
+        assert len(data._checkpoints) == checkpoints
+        assert data._rev_data.shape == data.data.shape
+        # replayed once per last step
+        assert data._rev_data is data._rev_data
+
+        # multi-level undo, replaying steps from the base data or a checkpoint
+        data.reverse(2)
+        assert np.allclose(data.data, filtered)
+        assert data.history[-1] == "reverse"
+        data.car()
+        assert np.allclose(data._rev_data, filtered)
+        data.reverse()
+        data.reverse()
+        assert np.array_equal(data.data, after_reject)
+        assert list(data.ch_names) == ["LA1", "LA2", "LA3"]
+        data.reverse(5)
+        assert data.data is values and data.nchs == 4
+        data.reverse()
+        assert data.data is values
+
+
+@pytest.mark.parametrize("ref", ["car", "bipolar"])
+def test_fused_pipeline(ref):
+    fs = 500
+    rng = np.random.default_rng(0)
+    values = rng.standard_normal((20 * fs, 6))
+    values[:, 2] *= 50  # high-variance channel, rejected as artifact
+    chs = np.array(["LA01", "LA02", "LA03", "LA04", "LA05", "EKG1"])
+    pipe = (
+        tools.Pipeline(block_size=fs)
+        .clean_labels()
+        .reject_nonieeg()
+        .reject_artifact()
+        .filter(1, 100, 60)
+        .reref(ref)
+    )
+
+    eager = iEEGData("I001_P034_D01", 0, 20, data=values, fs=fs, ch_names=chs)
+    eager.clean_labels()
+    eager.reject_nonieeg()
+    eager.reject_artifact()
+    eager.filter(1, 100, 60)
+    eager.reref(ref)
+
+    # the same pipeline, run on two clips, with the compiled montage reused
+    for _ in range(2):
+        data = iEEGData("I001_P034_D01", 0, 20, data=values, fs=fs, ch_names=chs)
+        data.apply(pipe)
+        assert np.allclose(data.data, eager.data, atol=1e-8)
+        assert list(data.ch_names) == list(eager.ch_names)
+        assert list(data.ref_chnames) == list(eager.ref_chnames)
+        assert np.array_equal(data.bad, eager.bad)
+        assert data.history == ["pipeline"]
+    assert len(pipe._montages) == 1
+    assert np.array_equal(values[:, 2], data._base_data[:, 2])
+
+    data.reverse()
+    assert data.data is values
+
+
+def test_pipeline_history_snapshot():
+    fs = 500
+    values = np.random.randn(10 * fs, 4)
+    chs = np.array(["LA1", "LA2", "LA3", "LA4"])
+    pipe = tools.Pipeline().filter(1, 100, 60)
+    data = iEEGData("I001_P034_D01", 0, 10, data=values, fs=fs, ch_names=chs)
+    data.apply(pipe)
+    applied = data.data
+    data.car()
+    # steps added to the pipeline afterwards are not replayed by undo
+    pipe.reref("bipolar").pre_whiten()
+    data.reverse()
+    assert np.allclose(data.data, applied)
+    assert data._steps[0][1][0].steps == [("filter", {"low_freq": 1, "high_freq": 100, "notch_freq": 60})]
+
+def test_fused_pipeline_whiten():
+    fs = 500
+    values = np.random.randn(10 * fs, 3)
+    chs = np.array(["LA1", "LA2", "LA3"])
+    pipe = tools.Pipeline(block_size=777).notch_filter(60).bandpass_filter(1, 100).pre_whiten().reref("car")
+    out, ch_names, ref_chnames, info = pipe.run(values, fs, chs)
+    filtered = tools.bandpass_filter(tools.notch_filter(values, fs), fs, 1, 100)
+    expected, labels = tools.car(tools.pre_whiten(filtered), chs)
+    assert np.allclose(out, expected, atol=1e-8, equal_nan=True)
+    assert list(ref_chnames) == list(labels)
+    assert info == {}
+
+
+def _mean_power(data, fs):
+    return np.nanmean(data**2, axis=0)
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_session_map(n_jobs, tmp_path):
+    fs = 500
+    session = iEEGPreprocess()
+    chs = np.array(["LA1", "LA2", "LA3", "EKG1"])
+    clips = [np.random.randn(10 * fs, 4) for _ in range(3)]
+    for i, values in enumerate(clips):
+        session._add_data_instance(iEEGData("I001_P034_D01", 10 * i, 10 * i + 10, data=values, fs=fs, ch_names=chs))
+    session._add_data_instance(iEEGData("I001_P034_D01", 30, 40, fs=fs, ch_names=chs))  # not downloaded
+    pipe = tools.Pipeline().reject_nonieeg().filter(1, 100, 60).reref("car")
+    session.map(pipe, n_jobs=n_jobs, features={"power": _mean_power}, mmap_dir=str(tmp_path), verbose=False)
+
+    assert list(session.meta["status"][:3]) == ["ok"] * 3
+    assert session.meta["status"][3] == "not downloaded"
+    assert list(session.meta["nchs"][:3]) == [3] * 3
+    for i, values in enumerate(clips):
+        data = session.datasets[i]
+        expected = iEEGData("I001_P034_D01", 0, 10, data=values, fs=fs, ch_names=chs)
+        expected.apply(pipe)
+        assert isinstance(data.data, np.memmap)
+        assert np.allclose(data.data, expected.data)
+        assert np.allclose(session.meta["power"][i], _mean_power(expected.data, fs))
+        assert data.history == ["pipeline"]
+        data.reverse()
+        assert data.data is values
+    assert session.datasets[3].data is None
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_session_map_twice(n_jobs, tmp_path):
+    # outputs are saved over the files the clips are memory-mapped from
+    fs = 500
+    session = iEEGPreprocess()
+    chs = np.array(["LA1", "LA2", "LA3", "EKG1"])
+    values = np.random.randn(10 * fs, 4)
+    session._add_data_instance(iEEGData("I001_P034_D01", 0, 10, data=values, fs=fs, ch_names=chs))
+    data = session.datasets[0]
+    data.max_checkpoints = 2
+    for pipe in [tools.Pipeline().clean_labels(), tools.Pipeline().reject_nonieeg()]:
+        session.map(pipe, n_jobs=n_jobs, mmap_dir=str(tmp_path), verbose=False)
+        assert session.meta["status"][0] == "ok"
+    assert np.array_equal(data.data, values[:, :3])
+    assert len(os.listdir(str(tmp_path))) == 1
+    data.reverse()
+    assert np.array_equal(data.data, values)
+
+
+def test_filter_edges():
+    # single cascaded pass, matching sequential bandpass and notch filtering away from the edges
+    fs = 500
+    values = np.cumsum(np.random.randn(30 * fs, 3), axis=0)
+    data = iEEGData("I001_P034_D01", 0, 30, data=values, fs=fs, ch_names=np.array(["LA1", "LA2", "LA3"]))
+    data.filter(1, 120, 60)
+    expected = tools.notch_filter(tools.bandpass_filter(values, fs, 1, 120), fs, 60)
+    scale = np.max(np.abs(expected))
+    for edge, atol in [(10, 1e-10), (5, 1e-6)]:
+        mid = slice(edge * fs, (30 - edge) * fs)
+        assert np.allclose(data.data[mid], expected[mid], rtol=0, atol=atol * scale)
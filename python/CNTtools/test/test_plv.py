@@ -0,0 +1,40 @@
+# Imports
+import numpy as np
+from scipy.signal import hilbert
+from CNTtools.tools import plv, bandpass_filter
+# %%
+
+
+def _plv_pairs(values, fs, freqs):
+    out = np.ones((values.shape[1], values.shape[1], freqs.shape[0]))
+    for f in range(freqs.shape[0]):
+        phase = np.angle(hilbert(bandpass_filter(values, fs, freqs[f, 0], freqs[f, 1]), axis=0))
+        for i in range(values.shape[1]):
+            for j in range(values.shape[1]):
+                out[i, j, f] = np.abs(np.mean(np.exp(1j * (phase[:, i] - phase[:, j]))))
+    return out
+
+
+def test_plv():
+    fs = 256
+    freqs = np.array([[4, 8], [8, 12], [30, 80]])
+    t = np.arange(10 * fs) / fs
+    values = np.random.randn(10 * fs, 5)
+    values[:, 1] += 5 * np.sin(2 * np.pi * 10 * t)
+    values[:, 2] += 5 * np.sin(2 * np.pi * 10 * t + 1)
+
+    out = plv(values.copy(), fs, freqs=freqs)
+    assert out.shape == (5, 5, 3)
+    assert np.allclose(out, _plv_pairs(values, fs, freqs))
+    assert out[1, 2, 1] > 0.9
+
+    out = plv(values.copy(), fs, win=True, win_size=2, freqs=freqs)
+    filtered = [bandpass_filter(values, fs, f[0], f[1]) for f in freqs]
+    expected = np.zeros((5, 5, 3))
+    for w in range(5):
+        for f in range(3):
+            phase = np.angle(hilbert(filtered[f][w * 2 * fs : (w + 1) * 2 * fs], axis=0))
+            z = np.exp(1j * phase)
+            expected[:, :, f] += np.abs(z.conj().T @ z) / (2 * fs) / 5
+    assert np.allclose(out, expected)
+    assert np.allclose(plv(values.copy(), fs, win=True, freqs=freqs, chunk_size=2), out)
@@ -3,10 +3,36 @@ import os
 from CNTtools import settings
 from CNTtools.tools import pre_whiten
 from scipy.io import loadmat
+from scipy.signal import lfilter
+import numpy as np
 # %%
 
 def test_prewhiten():
     data = loadmat(os.path.join(settings.TESTDATA_DIR,'sampleData.mat'),squeeze_me = True)
     old_values = data['old_values']
     values = pre_whiten(old_values)
-    assert values.shape == old_values.shape
\ No newline at end of file
+    assert values.shape == old_values.shape
+
+def test_prewhiten_ar():
+    rng = np.random.default_rng(0)
+    noise = rng.standard_normal((20000, 3))
+    values = lfilter([1], [1, -0.5, 0.3, -0.2], noise, axis=0) + 3
+    values[100:110, 1] = np.nan
+
+    # out of place by default, in place on request
+    copy = values.copy()
+    white = pre_whiten(values, order=3)
+    assert np.array_equal(values, copy, equal_nan=True)
+    assert pre_whiten(copy, order=3, inplace=True, block_size=1000) is copy
+    assert np.allclose(copy, white, equal_nan=True)
+
+    # residuals recover the innovations, rows without a prediction are NaN
+    assert np.all(np.isnan(white[:2])) and np.all(np.isnan(white[-1]))
+    for ch in [0, 2]:
+        assert np.corrcoef(-white[2:-1, ch], noise[3:, ch])[0, 1] > 0.999
+
+    # AR(1) least-squares fit
+    values = lfilter([1], [1, -0.8], noise, axis=0)
+    white = pre_whiten(values)
+    assert np.corrcoef(-white[:-1, 0], noise[1:, 0])[0, 1] > 0.999
+    assert np.array_equal(pre_whiten(np.ones((100, 2)))[:-1], np.zeros((99, 2)))
@@ -0,0 +1,35 @@
+import numpy as np
+from CNTtools.tools.get_ieeg_data import _pull_chunks
+
+
+class _ClipDataset:
+    """Minimal stand-in for ieeg Dataset returning sample index + channel id."""
+
+    def __init__(self, fs):
+        self.fs = fs
+
+    def get_data(self, start, duration, channel_ids):
+        n = int(round(duration * 1e-6 * self.fs))
+        t = np.arange(n) + int(round(start * 1e-6 * self.fs))
+        return np.add.outer(t, np.asarray(channel_ids) * 1e6).astype(float)
+
+
+def test_pullchunks():
+    fs = 200
+    ds = _ClipDataset(fs)
+    out, timing = _pull_chunks(ds, 0, 125 * 1e6, [0, 3, 5], fs, clip_size=10, n_workers=3)
+    assert out.shape == (125 * fs, 3)
+    assert len(timing) == 13
+    expected = np.add.outer(np.arange(125 * fs), np.array([0, 3, 5]) * 1e6)
+    assert np.array_equal(out, expected)
+
+    # clips that come back short keep the NaN prefill, flagged in the mask of written samples
+    class _ShortDataset(_ClipDataset):
+        def get_data(self, start, duration, channel_ids):
+            return super().get_data(start, duration, channel_ids)[:-10]
+
+    out, _, filled = _pull_chunks(
+        _ShortDataset(fs), 0, 25 * 1e6, [0], fs, clip_size=10, return_filled=True
+    )
+    assert np.array_equal(filled, ~np.isnan(out[:, 0]))
+    assert np.array_equal(np.flatnonzero(~filled), np.r_[1990:2000, 3990:4000, 4990:5000])
@@ -0,0 +1,49 @@
+# Imports
+import numpy as np
+from CNTtools.tools import relative_entropy, bandpass_filter
+# %%
+
+
+def _relative_entropy_pairs(values, fs, freqs, win=None):
+    nchs = values.shape[1]
+    out = np.zeros((nchs, nchs, freqs.shape[0]))
+    for f in range(freqs.shape[0]):
+        filtered = bandpass_filter(values, fs, freqs[f, 0], freqs[f, 1])
+        if win is not None:
+            filtered = filtered[win]
+        for i in range(nchs):
+            for j in range(nchs):
+                h1 = np.histogram(filtered[:, i], 10)[0] + 1e-10
+                h2 = np.histogram(filtered[:, j], 10)[0] + 1e-10
+                h1, h2 = h1 / np.sum(h1), h2 / np.sum(h2)
+                s1 = np.sum(h1 * np.log(h1 / h2))
+                s2 = np.sum(h2 * np.log(h2 / h1))
+                out[i, j, f] = max(s1, s2)
+    return out
+
+
+def test_relativeentropy():
+    fs = 128
+    freqs = np.array([[1, 4], [4, 8], [8, 12], [30, 64]])
+    values = np.random.randn(8 * fs, 4)
+    values[:, 1] = values[:, 0] + 0.1 * values[:, 1]
+    values[:, 3] = np.sign(values[:, 3])
+
+    out = relative_entropy(values.copy(), fs, freqs=freqs)
+    assert out.shape == (4, 4, 4)
+    assert np.allclose(out, _relative_entropy_pairs(values, fs, freqs))
+    assert np.all(np.diagonal(out) == 0)
+
+    out = relative_entropy(values.copy(), fs, win=True, win_size=2, freqs=freqs)
+    expected = np.mean(
+        [
+            _relative_entropy_pairs(values, fs, freqs, slice(w * 2 * fs, (w + 1) * 2 * fs))
+            for w in range(4)
+        ],
+        axis=0,
+    )
+    assert np.allclose(out, expected)
+
+    shared = relative_entropy(values.copy(), fs, freqs=freqs, binning="shared")
+    assert shared.shape == (4, 4, 4)
+    assert np.all(np.isfinite(shared))
@@ -0,0 +1,72 @@
+# Imports
+import numpy as np
+from CNTtools.tools import SegmentCache
+# %%
+
+
+def test_segmentcache(tmp_path):
+    fs = 100
+    chs = ["LA1", "LA2", "LA3"]
+    pulled = []
+
+    def pull(start, stop):
+        pulled.append((start, stop))
+        t = np.arange(int(round(start * 1e-6 * fs)), int(round(stop * 1e-6 * fs)))
+        return np.add.outer(t, np.arange(len(chs)) * 1e6).astype(float)
+
+    def expected(start, stop):
+        t = np.arange(start * fs, stop * fs)
+        return np.add.outer(t, np.arange(len(chs)) * 1e6)
+
+    cache = SegmentCache(str(tmp_path), block_size=10)
+    data = cache.fetch("I001", chs, fs, 15e6, 42e6, pull)
+    assert np.array_equal(data, expected(15, 42))
+    assert pulled == [(10e6, 50e6)]
+
+    # sub-range is served from disk
+    data = cache.fetch("I001", chs, fs, 20e6, 25e6, pull)
+    assert np.array_equal(data, expected(20, 25))
+    assert len(pulled) == 1
+
+    # overlapping range only pulls the missing gap
+    data = cache.fetch("I001", chs, fs, 35e6, 65e6, pull)
+    assert np.array_equal(data, expected(35, 65))
+    assert pulled[-1] == (50e6, 70e6)
+
+    # different channels are cached separately
+    cache.fetch("I001", chs[:2] + ["LA4"], fs, 15e6, 20e6, pull)
+    assert pulled[-1] == (10e6, 20e6)
+
+    # index persists, and least recently used blocks are evicted
+    block_bytes = 10 * fs * len(chs) * 8
+    cache = SegmentCache(str(tmp_path), block_size=10, max_size=2 * block_bytes)
+    assert cache.size == 7 * block_bytes
+    cache.fetch("I001", chs, fs, 40e6, 45e6, pull)
+    assert cache.size <= 2 * block_bytes
+    cache.clear()
+    assert cache.size == 0
+
+
+def test_segmentcache_incomplete(tmp_path):
+    # blocks with samples that were not pulled are served once but not cached
+    fs = 100
+    chs = ["LA1", "LA2"]
+    pulled = []
+
+    def pull(start, stop):
+        pulled.append((start, stop))
+        n = int(round((stop - start) * 1e-6 * fs))
+        data = np.ones((n, len(chs)))
+        filled = np.ones(n, dtype=bool)
+        if len(pulled) == 1:
+            data[-50:], filled[-50:] = np.nan, False
+        return data, filled
+
+    cache = SegmentCache(str(tmp_path), block_size=10)
+    data = cache.fetch("I001", chs, fs, 0, 20e6, pull)
+    assert np.all(np.isnan(data[-50:])) and not np.isnan(data[:-50]).any()
+    assert cache.size == 10 * fs * len(chs) * 8
+    data = cache.fetch("I001", chs, fs, 0, 20e6, pull)
+    assert np.all(data == 1)
+    assert pulled[-1] == (10e6, 20e6)
+
@@ -0,0 +1,55 @@
+# Imports
+import numpy as np
+import pytest
+from CNTtools.tools import sliding_windows, pearson, cross_correlation
+# %%
+
+
+def test_slidingwindows():
+    fs = 10
+    values = np.arange(105 * 3, dtype=float).reshape(105, 3)
+
+    windows, times = sliding_windows(values, fs, 2)
+    assert windows.shape == (5, 20, 3)
+    assert np.shares_memory(windows, values) and not windows.flags.writeable
+    assert np.array_equal(windows[1], values[20:40])
+    assert np.array_equal(times, [0, 2, 4, 6, 8])
+
+    # overlapping windows
+    windows, times = sliding_windows(values, fs, 2, step=0.5)
+    assert windows.shape == (18, 20, 3)
+    assert np.array_equal(windows[3], values[15:35])
+    assert times[3] == 1.5
+
+    # padding policies
+    windows, _ = sliding_windows(values, fs, 2, pad="nan")
+    assert windows.shape == (6, 20, 3)
+    assert np.array_equal(windows[5, :5], values[100:]) and np.all(np.isnan(windows[5, 5:]))
+    windows, _ = sliding_windows(values, fs, 2, pad="zero")
+    assert np.all(windows[5, 5:] == 0)
+    with pytest.raises(AssertionError):
+        sliding_windows(values, fs, 2, pad="wrap")
+
+    # a single window of the whole data
+    for win_size in [None, 20]:
+        windows, times = sliding_windows(values, fs, win_size)
+        assert windows.shape == (1, 105, 3) and np.array_equal(times, [0])
+        assert np.shares_memory(windows, values) and not windows.flags.writeable
+    assert values.flags.writeable
+
+    # any trailing dimensions, e.g. band-filtered data
+    windows, _ = sliding_windows(np.zeros((105, 3, 4)), fs, 2, step=1)
+    assert windows.shape == (9, 20, 3, 4)
+
+
+def test_timeseries():
+    fs = 100
+    values = np.random.randn(10 * fs, 3)
+    pc, times = pearson(values, fs, True, 2, step=1, timeseries=True)
+    assert pc.shape == (9, 3, 3) and len(times) == 9
+    assert np.allclose(pc[4], np.corrcoef(values[4 * fs : 6 * fs], rowvar=False))
+    assert np.allclose(np.nanmean(pc, axis=0), pearson(values, fs, True, 2, step=1))
+
+    mb, lb, times = cross_correlation(values, fs, True, 2, timeseries=True)
+    assert mb.shape == lb.shape == (5, 3, 3)
+    assert np.allclose(np.nanmean(mb, axis=0), cross_correlation(values, fs, True, 2)[0])
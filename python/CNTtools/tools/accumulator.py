@@ -0,0 +1,66 @@
+import numpy as np
+from beartype.typing import Optional
+
+
+class MatrixAccumulator:
+    """
+    Streaming, NaN-ignoring mean (and optionally variance) of a series of matrices.
+
+    Batches of matrices are merged into running sums with Chan's parallel update, so a summary of any
+    number of windows is kept in the memory of a few matrices. mean and var match np.nanmean and
+    np.nanvar over all matrices added.
+
+    Attributes:
+        count (np.ndarray): Number of non-NaN values of each entry.
+        mean (np.ndarray): Running mean, NaN for entries never observed.
+        var (np.ndarray): Running (population) variance, if variance is True.
+
+    Example:
+    >>> acc = MatrixAccumulator(variance=True)
+    >>> for clip in clips:
+    ...     acc.update(pearson(clip, fs, True, 2, timeseries=True)[0])
+    >>> acc.mean, acc.var
+    """
+
+    def __init__(self, variance: bool = False):
+        self.variance = variance
+        self.count = None
+        self._mean = None
+        self._m2 = None
+
+    def update(self, matrices: np.ndarray, axis: int = 0):
+        """
+        Add a batch of matrices, stacked along axis.
+        """
+        matrices = np.moveaxis(np.asarray(matrices, dtype=float), axis, 0)
+        valid = ~np.isnan(matrices)
+        n = valid.sum(axis=0)
+        total = np.where(valid, matrices, 0).sum(axis=0)
+        if self.count is None:
+            self.count = np.zeros(n.shape, dtype=np.int64)
+            self._mean = np.zeros(n.shape)
+            self._m2 = np.zeros(n.shape) if self.variance else None
+        with np.errstate(invalid="ignore", divide="ignore"):
+            batch_mean = np.where(n > 0, total / n, 0)
+            count = self.count + n
+            delta = batch_mean - self._mean
+            if self.variance:
+                m2 = np.where(valid, matrices - batch_mean, 0)
+                m2 = np.einsum("i...,i...->...", m2, m2)
+                self._m2 += m2 + np.where(count > 0, delta**2 * self.count * n / count, 0)
+            self._mean += np.where(count > 0, delta * n / count, 0)
+        self.count = count
+        return self
+
+    @property
+    def mean(self) -> Optional[np.ndarray]:
+        if self.count is None:
+            return None
+        return np.where(self.count > 0, self._mean, np.nan)
+
+    @property
+    def var(self) -> Optional[np.ndarray]:
+        if self.count is None or not self.variance:
+            return None
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > 0, self._m2 / self.count, np.nan)
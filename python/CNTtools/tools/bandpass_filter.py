@@ -1,7 +1,10 @@
 import numpy as np
-from scipy.signal import butter, sosfiltfilt
+from scipy.signal import sosfiltfilt
 from beartype import beartype
+from beartype.typing import Optional
 from numbers import Number
+from .filtfilt_blocks import filtfilt_blocks
+from .filter_bank import bandpass_sos
 
 
 @beartype
@@ -11,6 +14,8 @@ def bandpass_filter(
     low_freq: Number = 1,
     high_freq: Number = 120,
     order: int = 2,
+    block_size: Optional[int] = None,
+    out: Optional[np.ndarray] = None,
 ) -> np.ndarray:
     """
     Apply a 4th-order Butterworth bandpass filter to input data.
@@ -22,6 +27,10 @@ def bandpass_filter(
             Default is 1 Hz.
         high_freq (float, optional): The upper cutoff frequency of the bandpass filter.
             Default is 120 Hz.
+        block_size (int, optional): If given, filter block_size samples at a time with bounded memory,
+            e.g. for memory-mapped recordings. Default is None (whole array at once).
+        out (np.ndarray, optional): Array (e.g. a memmap) the filtered data is written into,
+            filtering block-wise. Default is None.
 
     Returns:
         np.ndarray: The filtered data with the same shape as the input data.
@@ -39,15 +48,14 @@ def bandpass_filter(
         >>> filtered_data = bandpass_filter(data, fs, low_freq, high_freq)
     """
 
-    sos = butter(
-        order,
-        [max(low_freq, 0.5), min(high_freq, fs // 2 - 1)],
-        btype="bandpass",
-        fs=fs,
-        output="sos",
-    )
+    sos = bandpass_sos(fs, low_freq, high_freq, order)
 
     # Apply filter to input signal
+    if block_size is not None or out is not None:
+        return filtfilt_blocks(
+            sos, data, out=out, block_size=block_size if block_size else 2**16
+        )
+
     y = sosfiltfilt(sos, data, axis=0)
 
     return y
@@ -2,8 +2,9 @@ from scipy.signal import welch
 from scipy.integrate import simpson
 import numpy as np
 from beartype import beartype
-from beartype.typing import Union, Iterable
+from beartype.typing import Union, Iterable, Optional, Tuple
 from numbers import Number
+from .sliding_windows import sliding_windows
 
 
 @beartype
@@ -26,8 +27,8 @@ def bandpower(
     band : list
         Lower and upper frequencies of the band of interest.
     win_size : float
-        Length of each window in seconds.
-        If None, win_size = (1 / min(band)) * 2
+        Length of each Welch segment in seconds.
+        If None, the scipy.signal.welch default of 256 samples.
     relative : boolean
         If True, return the relative power (= divided by the total power of the signal).
         If False (default), return the absolute power.
@@ -36,38 +37,82 @@ def bandpower(
     ------
     bp : np.ndarray
         Absolute or relative band power. channels by bands
+
+    Note
+    ----
+    For several bands, bandpower_windows computes the spectrum once and integrates all bands from it.
     """
     band = np.asarray(band)
     assert len(band) == 2, "CNTtools:invalidBandRange"
-    assert band[0] < band[1], "CNTtools:invalidBandRange"
     if np.ndim(data) == 1:
-        data = data[:,np.newaxis]
-    nchan = data.shape[1]
-    bp = np.nan * np.zeros(nchan)
-    low, high = band
+        data = data[:, np.newaxis]
+    power, rel_power, _ = bandpower_windows(data, fs, band[np.newaxis], segment=win_size)
+    return rel_power[0, :, 0] if relative else power[0, :, 0]
 
-    # Define window length
-    # if win_size is not None:
-    #     nperseg = int(win_size * fs)
-    # else:
-    #     nperseg = int((2 / low) * fs)
 
-    # Compute the modified periodogram (Welch)
-    freqs, psd = welch(data.T, fs)
+@beartype
+def bandpower_windows(
+    data: np.ndarray,
+    fs: Number,
+    bands: Union[np.ndarray, Iterable[Iterable[Number]]],
+    win_size: Optional[Number] = None,
+    step: Optional[Number] = None,
+    segment: Optional[Number] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Absolute and relative power of several frequency bands, optionally in sliding time windows.
 
-    # Frequency resolution
-    freq_res = freqs[1] - freqs[0]
+    The Welch spectrum of each window is computed once, for all windows and channels together, and
+    every band is integrated from it with Simpson's rule, as in bandpower. Windows are the same as
+    those of the connectivity measures, see sliding_windows.
+
+    Parameters
+    ----------
+    data : 2d-array
+        Input signal in the time-domain. (time by channels)
+    fs : float
+        Sampling frequency of the data.
+    bands : 2d-array
+        Lower and upper frequencies of each band, one [low, high] row per band.
+    win_size : float, optional
+        Length of each time window in seconds. If None or longer than the data, a single window of the whole data.
+    step : float, optional
+        Step between the starts of consecutive windows in seconds. Default is win_size (no overlap).
+    segment : float, optional
+        Length of each Welch segment in seconds. If None, the scipy.signal.welch default of 256 samples.
 
-    # Find closest indices of band in frequency vector
-    idx_band = np.logical_and(freqs >= low, freqs <= high)
+    Return
+    ------
+    power : np.ndarray
+        Absolute band power. windows by channels by bands
+    rel_power : np.ndarray
+        Band power relative to the total power of each window and channel. windows by channels by bands
+    times : np.ndarray
+        Start time of each window in seconds.
 
-    # Integral approximation of the spectrum using Simpson's rule.
-    if psd.ndim == 2:
-        bp = simpson(psd[:, idx_band], dx=freq_res)
-    elif psd.ndim == 1:
-        bp = simpson(psd[idx_band], dx=freq_res)
+    Example
+    -------
+    >>> power, rel_power, times = bandpower_windows(data, fs, [[1, 4], [4, 8], [8, 12]], win_size=2, step=1)
+    """
+    bands = np.asarray(bands, dtype=float)
+    assert bands.ndim == 2 and bands.shape[1] == 2, "CNTtools:invalidBandRange"
+    assert np.all(bands[:, 0] < bands[:, 1]), "CNTtools:invalidBandRange"
+    if np.ndim(data) == 1:
+        data = data[:, np.newaxis]
 
-    if relative:
-        bp /= simpson(psd, dx=freq_res)
+    # windows X samples X channels, as a view of data
+    windows, times = sliding_windows(data, fs, win_size, step)
+
+    nperseg = None if segment is None else min(int(segment * fs), windows.shape[1])
+    freqs, psd = welch(windows, fs, nperseg=nperseg, axis=1)
+    freq_res = freqs[1] - freqs[0]
 
-    return bp
+    power = np.stack(
+        [
+            simpson(psd[:, (freqs >= low) & (freqs <= high)], dx=freq_res, axis=1)
+            for low, high in bands
+        ],
+        axis=-1,
+    )
+    total = simpson(psd, dx=freq_res, axis=1)
+    return power, power / total[..., np.newaxis], times
@@ -1,9 +1,7 @@
 import numpy as np
-import pandas as pd
-import re
 from beartype import beartype
 from beartype.typing import Iterable, Tuple
-from .clean_labels import clean_labels
+from .montage import compile_montage
 
 
 @beartype
@@ -43,47 +41,6 @@ def bipolar(
         >>> bipolar_data, bipolar_labels = tools.bipolar(data, labels, soft_thres = 2)
     """
 
-    channels = clean_labels(labels)
-    nchan = len(channels)
-    bipolar_labels = []
-    out_values = np.nan * np.zeros(data.shape)
-    # naming to standard 4 character channel Name: (Letter)(Letter)[Letter](Number)(Number)
-    # channels = channel2std(channels)
-    for ch in range(nchan):
-        out = np.nan * np.zeros(data.shape[0])
-        ch1Ind = ch
-        ch1 = channels[ch1Ind]  # clean_label
-        label_num_search = re.search(r"\d", ch1)
-        if label_num_search is not None:
-            label_num_idx = label_num_search.start()
-            label_non_num = ch1[:label_num_idx]
-            label_num = int(ch1[label_num_idx:])
-            # find sequential index
-            # if label_num > 12:
-                # print("This might be a grid and so bipolar might be tricky")
-            if soft:
-                ch2_num = list(range(label_num + 1, label_num + soft_thres + 2))
-            else:
-                ch2_num = [label_num + 1]
-            for i in ch2_num:
-                ch2 = label_non_num + f"{i}"
-                ch2exists = np.where(channels == ch2)[0]
-                if len(ch2exists) > 0:
-                    ch2Ind = ch2exists[0]
-                    out = data[:, ch1Ind] - data[:, ch2Ind]
-                    bipolar_label = ch1 + "-" + ch2
-                    break
-                else:
-                    bipolar_label = "-"
-        elif ch1 == "FZ":
-            ch2exists = np.where(channels == "CZ")[0]
-            if len(ch2exists) > 0:
-                ch2Ind = ch2exists[0]
-                out = data[:, ch1Ind] - data[:, ch2Ind]
-                bipolar_label = ch1 + "-" + "CZ"
-        else:
-            bipolar_label = "-"
-        bipolar_labels.append(bipolar_label)
-        out_values[:, ch] = out
+    montage = compile_montage("bipolar", labels, soft=soft, soft_thres=soft_thres)
 
-    return out_values, np.array(bipolar_labels)
+    return montage.apply(data), montage.labels
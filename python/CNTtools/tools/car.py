@@ -1,6 +1,7 @@
 import numpy as np
 from beartype import beartype
 from beartype.typing import Iterable, Tuple
+from .montage import compile_montage
 
 
 @beartype
@@ -28,7 +29,6 @@ def car(data: np.ndarray, labels: Iterable[str]) -> Tuple[np.ndarray, np.ndarray
         >>> labels = ['C3', 'C4', 'FZ', 'P3', 'P4', 'O1', 'O2', 'T3', 'T4', 'T5', 'T6', 'F3', 'F4', 'F7', 'F8', 'CZ']
         >>> car_data, car_labels = car(data, labels)
     """
-    out_data = data - np.nanmean(data, 1)[:, np.newaxis]
-    car_labels = [label + "-CAR" for label in labels]
+    montage = compile_montage("car", labels)
 
-    return out_data, np.array(car_labels)
+    return montage.apply(data), montage.labels
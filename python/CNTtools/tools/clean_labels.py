@@ -1,7 +1,23 @@
 import re
 import numpy as np
+from functools import lru_cache
 from beartype import beartype
-from beartype.typing import Union, Iterable
+from beartype.typing import Iterable, Optional, Tuple, Union
+from .find_non_ieeg import find_non_ieeg
+
+_first_digit = re.compile(r"\d")
+# applied in order, each to the output of the previous one
+_replacements = [
+    ("EEG", ""),
+    ("Ref", ""),
+    (" ", ""),
+    ("-", ""),
+    ("CAR", ""),
+    ("HIPP", "DH"),
+    ("AMY", "DA"),
+    ("FP1", "Fp1"),
+    ("FP2", "Fp2"),
+]
 
 
 @beartype
@@ -18,29 +34,75 @@ def clean_labels(channel_li: Union[Iterable[str], str]) -> np.ndarray:
     Example:
     >>> clean_labels('LA 01')
     array(['LA1'])
+
+    Note:
+    Cleaned labels are memoized, so labels seen before are not parsed again.
     """
     if isinstance(channel_li, str):
         channel_li = [channel_li]
-    new_channels = []
-    for i in range(len(channel_li)):
-        # standardizes channel names
-        label_num_search = re.search(r"\d", channel_li[i])
-        if label_num_search is not None:
-            label_num_idx = label_num_search.start()
-            label_non_num = channel_li[i][:label_num_idx]
-            label_num = channel_li[i][label_num_idx:]
-            label_num = label_num.lstrip("0")
-            label = label_non_num + label_num
-        else:
-            label = channel_li[i]
-        label = label.replace("EEG", "")
-        label = label.replace("Ref", "")
-        label = label.replace(" ", "")
-        label = label.replace("-", "")
-        label = label.replace("CAR", "")
-        label = label.replace("HIPP", "DH")
-        label = label.replace("AMY", "DA")
-        label = label.replace("FP1", "Fp1")
-        label = label.replace("FP2", "Fp2")
-        new_channels.append(label)
-    return np.array(new_channels)
+    return np.array([_clean_label(label) for label in channel_li])
+
+
+@lru_cache(maxsize=2**16)
+def _clean_label(label: str) -> str:
+    # standardizes channel names
+    label_num_search = _first_digit.search(label)
+    if label_num_search is not None:
+        label_num_idx = label_num_search.start()
+        label_non_num = label[:label_num_idx]
+        label_num = label[label_num_idx:]
+        label_num = label_num.lstrip("0")
+        label = label_non_num + label_num
+    for old, new in _replacements:
+        label = label.replace(old, new)
+    return label
+
+
+@lru_cache(maxsize=2**16)
+def split_label(label: str) -> Tuple[str, Optional[int]]:
+    """
+    Split a label into its electrode name, before the first digit, and contact number.
+
+    Example:
+    >>> split_label('LA1')
+    ('LA', 1)
+    >>> split_label('EKG')
+    ('EKG', None)
+    """
+    label_num_search = _first_digit.search(label)
+    if label_num_search is None:
+        return label, None
+    label_num_idx = label_num_search.start()
+    label_num = label[label_num_idx:]
+    return label[:label_num_idx], int(label_num) if label_num.isdigit() else None
+
+
+@beartype
+def parse_labels(channel_li: Union[Iterable[str], str]) -> np.ndarray:
+    """
+    Clean channel labels and parse them into their components at once.
+
+    Parameters:
+    - channel_li (Union[Iterable[str], str]): Either a single channel label or an iterable of channel labels.
+
+    Returns:
+    - np.ndarray: Structured array with fields 'label' (cleaned label), 'elec' (electrode name),
+      'number' (contact number, -1 if none) and 'non_ieeg' (find_non_ieeg of the cleaned labels).
+
+    Example:
+    >>> parsed = parse_labels(['LA 01', 'EKG'])
+    >>> parsed['label'], parsed['number']
+    (array(['LA1', 'EKG'], dtype='<U3'), array([ 1, -1]))
+    """
+    labels = clean_labels(channel_li)
+    parts = [split_label(label) for label in labels]
+    width = max([1] + [len(label) for label in labels])
+    parsed = np.zeros(
+        len(labels),
+        dtype=[("label", f"U{width}"), ("elec", f"U{width}"), ("number", int), ("non_ieeg", bool)],
+    )
+    parsed["label"] = labels
+    parsed["elec"] = [elec for elec, _ in parts]
+    parsed["number"] = [-1 if num is None else num for _, num in parts]
+    parsed["non_ieeg"] = find_non_ieeg(list(labels))
+    return parsed
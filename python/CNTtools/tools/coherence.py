@@ -1,7 +1,11 @@
 import numpy as np
-from scipy.signal import coherence as coh
+from scipy.signal import get_window
+from numpy.lib.stride_tricks import sliding_window_view
 from .default_freqs import freqs
+from .sliding_windows import sliding_windows
+from .fill_nan import fill_nan
 from beartype import beartype
+from beartype.typing import Optional
 from numbers import Number
 
 
@@ -14,7 +18,9 @@ def coherence(
     segment: Number = 1,
     overlap: Number = 0.5,
     freqs: np.ndarray = freqs,
-) -> np.ndarray:
+    step: Optional[Number] = None,
+    timeseries: bool = False,
+):
     """
     Calculates coherence for iEEG data with multiple channels.
 
@@ -26,9 +32,13 @@ def coherence(
         freqs (numpy array, optional): Matrix where each row represents a frequency range. The first column is the lower bound, and the second column is the upper bound.
         segment (float, optional): Duration of each segment in seconds for multi-taper spectral estimation.
         overlap (float, optional): Overlap between segments for multi-taper spectral estimation, in seconds.
+        step (float, optional): Step between consecutive time windows in seconds. Default is win_size (no overlap).
+        timeseries (bool, optional): If True, return the coherence of each time window and the window start times
+            instead of their average.
 
     Returns:
         all_coherence (numpy array): Coherence matrix where each element (i, j, k) represents the coherence bewin_sizeeen channel i and channel j at frequency range k.
+            With timeseries, of shape windows X channels X channels X frequency ranges, followed by the window start times in seconds.
 
     Examples:
         all_coherence = coherence(values, fs)
@@ -36,79 +46,96 @@ def coherence(
         all_coherence = coherence(values, fs, win=False, freqs=default_freqs, segment=1, overlap=0.5)
     """
     # Parameters
-    nchs = values.shape[1]
-    nfreqs = freqs.shape[0]
     nperseg = int(fs * segment)
     noverlap = int(fs * overlap)
-    window = int(fs * win_size)
-
-    if window > values.shape[0]:
-        win = False
-
-    # Initialize output matrix
-    all_coherence = np.nan * np.zeros((nchs, nchs, nfreqs))
-
-    for ich in range(nchs):
-        curr_values = values[:, ich]
-        curr_values[np.isnan(curr_values)] = np.nanmean(curr_values)
-        values[:, ich] = curr_values
-
-    if win:
-        # Divide into time windows
-        window_start = np.arange(0, values.shape[0], window)
-
-        # Remove dangling window
-        if window_start[-1] + window > values.shape[0]:
-            window_start = window_start[:-1]
-
-        nw = len(window_start)
-
-        temp_coherence = np.nan * np.zeros((nchs, nchs, nfreqs, nw))
-        for t in range(nw):
-            for ich in range(nchs):
-                for jch in range(ich, nchs):
-                    f, cxy = coh(
-                        values[window_start[t] : window_start[t] + window, ich],
-                        values[window_start[t] : window_start[t] + window, jch],
-                        fs=fs,
-                        nperseg=nperseg,
-                        noverlap=noverlap,
-                    )
-                    f = np.squeeze(f)
-                    for i_f in range(nfreqs):
-                        temp_coherence[ich, jch, i_f, t] = np.nanmean(
-                            cxy[(f >= freqs[i_f, 0]) & (f <= freqs[i_f, 1])]
-                        )
-                        temp_coherence[jch, ich, i_f, t] = np.nanmean(
-                            cxy[(f >= freqs[i_f, 0]) & (f <= freqs[i_f, 1])]
-                        )
-
-        temp_coherence = np.nanmean(temp_coherence, axis=3)
-    else:
-        temp_coherence = np.nan * np.zeros((nchs, nchs, nfreqs))
-        for ich in range(nchs):
-            for jch in range(nchs):
-                # Do MS cohere on the full thing
-                f, cxy = coh(
-                    values[:, ich],
-                    values[:, jch],
-                    fs=fs,
-                    nperseg=nperseg,
-                    noverlap=noverlap,
-                )
-                f = np.squeeze(f)
 
-                # Average coherence in frequency bins of interest
-                for i_f in range(nfreqs):
-                    temp_coherence[ich, jch, i_f] = np.nanmean(
-                        cxy[(f >= freqs[i_f, 0]) & (f <= freqs[i_f, 1])]
-                    )
-                    temp_coherence[jch, ich, i_f] = np.nanmean(
-                        cxy[(f >= freqs[i_f, 0]) & (f <= freqs[i_f, 1])]
-                    )
+    # Fill NaN with the channel mean, leaving values unchanged
+    values = fill_nan(values)[0]
+
+    windows, times = sliding_windows(values, fs, win_size if win else None, step)
+    all_coherence = _coherence_windows(windows, fs, nperseg, noverlap, freqs, not timeseries)
+    if timeseries:
+        return all_coherence, times
+    return all_coherence
 
-    # Put the non-nans back
-    all_coherence = temp_coherence
-    # all_coherence[np.eye(nchs, dtype=bool)] = np.nan
+
+def _coherence_windows(
+    windows: np.ndarray,
+    fs: Number,
+    nperseg: int,
+    noverlap: int,
+    freqs: np.ndarray,
+    average: bool = True,
+) -> np.ndarray:
+    """
+    Coherence averaged over windows of shape (windows, samples, channels).
+    Returns an array of shape (channels, channels, bands), or (windows, channels, channels, bands) if not average.
+    """
+    nw, window, nchs = windows.shape
+    nfreqs = freqs.shape[0]
+
+    # Welch segments of each window, as in scipy.signal.coherence
+    nperseg = min(nperseg, window)
+    noverlap = noverlap if noverlap < nperseg else nperseg // 2
+    f = np.fft.rfftfreq(nperseg, 1 / fs)
+    band_mask = np.array(
+        [(f >= freqs[i_f, 0]) & (f <= freqs[i_f, 1]) for i_f in range(nfreqs)]
+    ).astype(float)
+
+    # Chunks of windows and frequencies, bounding the cross-spectral matrices to ~2**22 entries
+    nf_chunk = max(1, 2**22 // (nchs * nchs))
+    nw_chunk = max(1, nf_chunk // len(f))
+
+    coh_sum = np.zeros((nfreqs, nchs, nchs))
+    coh_count = np.zeros((nfreqs, nchs, nchs))
+    coh_windows = []
+    for t in range(0, nw, nw_chunk):
+        # Segment FFTs, once per channel: windows X freqs X segments X channels
+        X = _segment_fft(windows[t : t + nw_chunk], nperseg, noverlap)
+        pxx = np.sum(np.abs(X) ** 2, axis=2)
+
+        band_sum = np.zeros((X.shape[0], nfreqs, nchs * nchs))
+        band_count = np.zeros((X.shape[0], nfreqs, nchs * nchs))
+        for i in range(0, len(f), nf_chunk):
+            Xf = X[:, i : i + nf_chunk]
+            # Cross-spectral matrix of all channel pairs at once
+            pxy = np.conj(Xf).swapaxes(-1, -2) @ Xf
+            with np.errstate(invalid="ignore", divide="ignore"):
+                cxy = np.abs(pxy) ** 2 / (
+                    pxx[:, i : i + nf_chunk, :, np.newaxis]
+                    * pxx[:, i : i + nf_chunk, np.newaxis, :]
+                )
+            cxy = cxy.reshape(cxy.shape[0], cxy.shape[1], -1)
+            valid = ~np.isnan(cxy)
+            # Sum over the frequencies of each band
+            band_sum += band_mask[:, i : i + nf_chunk] @ np.where(valid, cxy, 0)
+            band_count += band_mask[:, i : i + nf_chunk] @ valid
+
+        # Average coherence in frequency bins of interest, then over windows
+        with np.errstate(invalid="ignore"):
+            band_coh = band_sum / band_count
+        if not average:
+            coh_windows.append(band_coh.reshape(-1, nfreqs, nchs, nchs).transpose(0, 2, 3, 1))
+            continue
+        valid = ~np.isnan(band_coh)
+        coh_sum += np.where(valid, band_coh, 0).sum(axis=0).reshape(nfreqs, nchs, nchs)
+        coh_count += valid.sum(axis=0).reshape(nfreqs, nchs, nchs)
+
+    if not average:
+        return np.concatenate(coh_windows)
+    with np.errstate(invalid="ignore"):
+        all_coherence = (coh_sum / coh_count).transpose(1, 2, 0)
 
     return all_coherence
+
+
+def _segment_fft(windows: np.ndarray, nperseg: int, noverlap: int) -> np.ndarray:
+    """
+    FFT of detrended, Hann-windowed segments of each window, as computed by scipy.signal.welch.
+    windows is of shape (windows, samples, channels), output of shape (windows, freqs, segments, channels).
+    """
+    step = nperseg - noverlap
+    segs = sliding_window_view(windows, nperseg, axis=1)[:, ::step]
+    segs = segs - np.mean(segs, axis=-1, keepdims=True)
+    X = np.fft.rfft(segs * get_window("hann", nperseg), axis=-1)
+    return X.transpose(0, 3, 1, 2)
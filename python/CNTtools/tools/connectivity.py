@@ -0,0 +1,291 @@
+import os
+import numpy as np
+from .default_freqs import freqs
+from .filter_bank import bandpass_stack
+from .pearson import pearson, _pearson_windows
+from .cross_correlation import MAX_LAG, cross_correlation, _lags, _xcorr_peak
+from .coherence import _coherence_windows
+from .plv import _plv_windows
+from .relative_entropy import _relative_entropy_windows
+from .sliding_windows import sliding_windows
+from .fill_nan import fill_nan
+from .accumulator import MatrixAccumulator
+from .dynamic_conn import DynamicConn
+from beartype import beartype
+from beartype.typing import Iterable, Optional
+from numbers import Number
+
+CONN_METHODS = ["pearson", "squared_pearson", "cross_corr", "coh", "plv", "rela_entropy"]
+
+
+@beartype
+def connectivity(
+    values: np.ndarray,
+    fs: Number,
+    methods: Iterable[str],
+    win: bool = True,
+    win_size: Number = 2,
+    segment: Number = 1,
+    overlap: Number = 0.5,
+    freqs: np.ndarray = freqs,
+    step: Optional[Number] = None,
+    timeseries: bool = False,
+    mask: Optional[np.ndarray] = None,
+    max_lag: Number = MAX_LAG,
+):
+    """
+    Compute several connectivity measures in a single pass, sharing intermediate results.
+
+    Each intermediate is computed once and only if a requested method needs it: the correlation
+    matrices (pearson, squared_pearson), the NaN-filled data (coh, plv, rela_entropy) and the
+    band-filtered data (plv, rela_entropy). Results are the same as calling each tool separately,
+    but the input is left unchanged.
+
+    Parameters:
+    - values (numpy array): iEEG data matrix where each column represents a channel.
+    - fs (numeric): Sampling frequency of the iEEG data.
+    - methods (Iterable[str]): Connectivity methods to compute, any of
+        ['pearson', 'squared_pearson', 'cross_corr', 'coh', 'plv', 'rela_entropy'].
+    - win (bool, optional): If True, average over time windows of win_size seconds. Default is True.
+    - win_size (numeric, optional): Time window size in seconds. Default is 2 seconds.
+    - segment (numeric, optional): Segment duration in seconds for coherence. Default is 1 second.
+    - overlap (numeric, optional): Segment overlap in seconds for coherence. Default is 0.5 seconds.
+    - freqs (numpy array, optional): Frequency bands of coh, plv and rela_entropy, one [low, high] row per band.
+    - step (numeric, optional): Step between consecutive time windows in seconds. Default is win_size (no overlap).
+    - timeseries (bool, optional): If True, keep the matrices of each time window, with the window axis first,
+        instead of their average. Default is False.
+    - mask (numpy array, optional): Boolean mask of missing samples, samples X channels, e.g. from fill_nan.
+        The entries of a channel are NaN in the windows where it has masked samples, and so ignored in the
+        average. Default is None.
+    - max_lag (numeric, optional): Maximum lag of cross_corr in milliseconds. Default is 200 ms.
+
+    Returns:
+    - conn (dict): Connectivity matrix of each method.
+    - conn_lag (dict): Lag matrix in seconds of methods with a lag, i.e. cross_corr.
+    - times (numpy array): Window start times in seconds, only with timeseries.
+
+    Example:
+    >>> conn, conn_lag = connectivity(values, fs, ["pearson", "plv", "rela_entropy"])
+
+    Note:
+    With timeseries, every window is kept in memory as a float64 matrix; dynamic_connectivity stores
+    the same series compactly, and optionally on disk.
+    """
+    methods = list(methods)
+    assert all(m in CONN_METHODS for m in methods), "CNTtools:invalidConnMethod"
+    if mask is not None:
+        # masked entries are dropped from the average, which needs the matrices of each window
+        conn, conn_lag, times = connectivity(
+            values,
+            fs,
+            methods,
+            win,
+            win_size,
+            segment,
+            overlap,
+            freqs,
+            step,
+            True,
+            max_lag=max_lag,
+        )
+        invalid = _invalid_windows(mask, fs, win_size if win else None, step)
+        for results in [conn, conn_lag]:
+            for m in results:
+                _mask_windows(results[m], invalid)
+                if not timeseries:
+                    results[m] = MatrixAccumulator().update(results[m]).mean
+        return (conn, conn_lag, times) if timeseries else (conn, conn_lag)
+    conn, conn_lag = {}, {}
+
+    # windows of the whole data if not win
+    size = win_size if win else None
+    times = sliding_windows(values, fs, size, step)[1]
+    result = (conn, conn_lag, times) if timeseries else (conn, conn_lag)
+
+    # Correlations, computed once for pearson and squared_pearson
+    if "pearson" in methods or "squared_pearson" in methods:
+        pc = pearson(values, fs, win, win_size, step, timeseries)
+        if timeseries:
+            pc = pc[0]
+        if "pearson" in methods:
+            conn["pearson"] = pc
+        if "squared_pearson" in methods:
+            conn["squared_pearson"] = pc**2
+
+    if "cross_corr" in methods:
+        xc = cross_correlation(
+            values,
+            fs,
+            win=win,
+            win_size=win_size,
+            max_lag=max_lag,
+            step=step,
+            timeseries=timeseries,
+        )
+        conn["cross_corr"], conn_lag["cross_corr"] = xc[:2]
+
+    if not any(m in methods for m in ["coh", "plv", "rela_entropy"]):
+        return result
+
+    # NaN-filled data, shared by the spectral methods
+    filled = fill_nan(values)[0]
+
+    if "coh" in methods:
+        conn["coh"] = _coherence_windows(
+            sliding_windows(filled, fs, size, step)[0],
+            fs,
+            int(fs * segment),
+            int(fs * overlap),
+            freqs,
+            not timeseries,
+        )
+
+    # Band-filtered data, shared by plv and rela_entropy
+    if "plv" in methods or "rela_entropy" in methods:
+        windows = sliding_windows(bandpass_stack(filled, fs, freqs), fs, size, step)[0]
+        if "plv" in methods:
+            conn["plv"] = _plv_windows(windows, average=not timeseries)
+        if "rela_entropy" in methods:
+            conn["rela_entropy"] = _relative_entropy_windows(windows, average=not timeseries)
+
+    return result
+
+
+@beartype
+def dynamic_connectivity(
+    values: np.ndarray,
+    fs: Number,
+    methods: Iterable[str],
+    win_size: Optional[Number] = 2,
+    segment: Number = 1,
+    overlap: Number = 0.5,
+    freqs: np.ndarray = freqs,
+    step: Optional[Number] = None,
+    folder: Optional[str] = None,
+    prefix: str = "",
+    chunk_size: Optional[int] = None,
+    mask: Optional[np.ndarray] = None,
+    max_lag: Number = MAX_LAG,
+):
+    """
+    Compute the connectivity of every time window, stored compactly as DynamicConn series.
+
+    Windows are processed in chunks, and the matrices of each chunk are written as float32 upper
+    triangles before the next chunk is computed, so the full series is never held as float64.
+    Intermediate results are shared between methods as in connectivity, and the values match
+    connectivity(..., timeseries=True) to float32 precision.
+
+    Parameters:
+    - values (numpy array): iEEG data matrix where each column represents a channel.
+    - fs (numeric): Sampling frequency of the iEEG data.
+    - methods (Iterable[str]): Connectivity methods to compute, any of
+        ['pearson', 'squared_pearson', 'cross_corr', 'coh', 'plv', 'rela_entropy'].
+    - win_size (numeric, optional): Time window size in seconds. If None, a single window of the whole data.
+        Default is 2 seconds.
+    - segment (numeric, optional): Segment duration in seconds for coherence. Default is 1 second.
+    - overlap (numeric, optional): Segment overlap in seconds for coherence. Default is 0.5 seconds.
+    - freqs (numpy array, optional): Frequency bands of coh, plv and rela_entropy, one [low, high] row per band.
+    - step (numeric, optional): Step between consecutive time windows in seconds. Default is win_size (no overlap).
+    - folder (str, optional): Folder of the memory-mapped series, one prefix + method + '.npy' file per
+        method. Default is None, keeping them in memory.
+    - prefix (str, optional): Prefix of the file names in folder.
+    - chunk_size (int, optional): Number of time windows computed at once. Default is None, sized to
+        about 2**24 values per chunk.
+    - mask (numpy array, optional): Boolean mask of missing samples, samples X channels, as in connectivity.
+    - max_lag (numeric, optional): Maximum lag of cross_corr in milliseconds. Default is 200 ms.
+
+    Returns:
+    - conn (dict): DynamicConn of each method.
+    - conn_lag (dict): DynamicConn of the lags in seconds of methods with a lag, i.e. cross_corr.
+
+    Example:
+    >>> conn, conn_lag = dynamic_connectivity(values, fs, ["pearson", "plv"], win_size=2, step=1, folder="conn")
+    >>> conn["plv"].between(60, 120, band="alpha")
+    """
+    methods = list(methods)
+    assert all(m in CONN_METHODS for m in methods), "CNTtools:invalidConnMethod"
+    if folder is not None and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    windows, times = sliding_windows(values, fs, win_size, step)
+    nw, iw, nchs = windows.shape
+    spectral = [m for m in methods if m in ["coh", "plv", "rela_entropy"]]
+    nbands = len(freqs) if spectral else 1
+    if chunk_size is None:
+        chunk_size = max(1, 2**24 // (nchs * max(nchs, iw) * nbands))
+
+    def series(name, bands=None):
+        path = None if folder is None else os.path.join(folder, prefix + name + ".npy")
+        return DynamicConn(times, nchs, bands, path)
+
+    conn = {m: series(m, freqs if m in spectral else None) for m in methods}
+    conn_lag = {"cross_corr": series("cross_corr_lag")} if "cross_corr" in methods else {}
+    invalid = None if mask is None else _invalid_windows(mask, fs, win_size, step)
+
+    def write(dyn, t, matrices):
+        if invalid is not None:
+            _mask_windows(matrices, invalid[t : t + len(matrices)])
+        dyn.write(t, matrices)
+
+    if "cross_corr" in methods:
+        lags = _lags(values.shape[0], iw, fs, max_lag)
+    if spectral:
+        # NaN-filled data, and band-filtered data for plv and rela_entropy, as in connectivity
+        filled = fill_nan(values)[0]
+        filled_windows = sliding_windows(filled, fs, win_size, step)[0]
+        if "plv" in methods or "rela_entropy" in methods:
+            band_windows = sliding_windows(bandpass_stack(filled, fs, freqs), fs, win_size, step)[0]
+
+    for t in range(0, nw, chunk_size):
+        chunk = slice(t, t + chunk_size)
+        if "pearson" in methods or "squared_pearson" in methods:
+            pc = _pearson_windows(windows[chunk])
+            if "pearson" in methods:
+                write(conn["pearson"], t, pc)
+            if "squared_pearson" in methods:
+                write(conn["squared_pearson"], t, pc**2)
+        if "cross_corr" in methods:
+            peaks = [_xcorr_peak(w, lags) for w in windows[chunk]]
+            write(conn["cross_corr"], t, np.stack([mb for mb, _ in peaks]))
+            write(conn_lag["cross_corr"], t, np.stack([lb for _, lb in peaks]) / fs)
+        if "coh" in methods:
+            write(
+                conn["coh"],
+                t,
+                _coherence_windows(
+                    filled_windows[chunk],
+                    fs,
+                    int(fs * segment),
+                    int(fs * overlap),
+                    freqs,
+                    average=False,
+                ),
+            )
+        if "plv" in methods:
+            write(conn["plv"], t, _plv_windows(band_windows[chunk], average=False))
+        if "rela_entropy" in methods:
+            write(
+                conn["rela_entropy"],
+                t,
+                _relative_entropy_windows(band_windows[chunk], average=False),
+            )
+
+    for dyn in list(conn.values()) + list(conn_lag.values()):
+        dyn.flush()
+    return conn, conn_lag
+
+
+def _invalid_windows(mask, fs, win_size, step):
+    """
+    Channels with masked samples in each time window, windows X channels.
+    """
+    return sliding_windows(mask, fs, win_size, step)[0].any(axis=1)
+
+
+def _mask_windows(matrices, invalid):
+    """
+    Set, in place, the rows and columns of the channels invalid in each window to NaN.
+    """
+    w, c = np.nonzero(invalid)
+    matrices[w, c] = np.nan
+    matrices[w, :, c] = np.nan
@@ -1,7 +1,11 @@
 import numpy as np
-from scipy.signal import correlate
+from scipy.fft import next_fast_len
 from beartype import beartype
+from beartype.typing import Optional
 from numbers import Number
+from .sliding_windows import sliding_windows
+
+MAX_LAG = 200  # default maximum lag in milliseconds
 
 
 @beartype
@@ -10,7 +14,10 @@ def cross_correlation(
     fs: Number,
     win: bool = False,
     win_size: Number = 2,
-    max_lag: Number = 200,
+    max_lag: Number = MAX_LAG,
+    batch_size: Optional[int] = None,
+    step: Optional[Number] = None,
+    timeseries: bool = False,
 ):
     """
     Compute cross-correlation matrices for iEEG data.
@@ -22,10 +29,16 @@ def cross_correlation(
                              compute a single cross-correlation (False). Default is False.
         win_size (float, optional): Time window size in seconds. Required if win is True. Default is 2 seconds.
         max_lag (float, optional): Specify the maximum lag in milliseconds. Default is 200 ms.
+        batch_size (int, optional): Number of channel pairs inverse-transformed at once. Default is None,
+                             sized to about 2**24 samples per batch.
+        step (float, optional): Step between consecutive windows in seconds. Default is win_size (no overlap).
+        timeseries (bool, optional): If True, return the matrices of each window, of shape windows x channels x channels,
+                             and the window start times in seconds, instead of their mean. Default is False.
 
     Returns:
         mb (np.ndarray): Mean cross-correlation matrix.
         lb (np.ndarray): Mean lag matrix (in seconds).
+        times (np.ndarray): Window start times in seconds, only with timeseries.
 
     Example:
         mb, lb = cross_correlation(values, fs, win=True, win_size=1, max_lag=300)
@@ -37,87 +50,60 @@ def cross_correlation(
       cross-correlation and lag matrices across all windows.
 
     """
-    ml_default = values.shape[0] - 1
-    ml = np.min([ml_default, int(max_lag * 1e-3 * fs)])  # max lag in num samples
-    lags = np.arange(-ml, ml + 1)
     nchan = values.shape[1]
     if win and (win_size > values.shape[0] / fs):
         win = False
 
-    if win:
-        # Divide into time windows
-        iw = int(win_size * fs)
-        window_start = np.arange(0, values.shape[0], iw)
-
-        # Remove dangling window
-        if window_start[-1] + iw > values.shape[0]:
-            window_start = window_start[:-1]
-
-        nw = len(window_start)
-
-        # Prep the variables
-        mb_all = np.ones((nchan, nchan, nw))
-        lb_all = np.zeros((nchan, nchan, nw))
-        lags_all = np.arange(-iw + 1, iw)
-        if lags_all[0] > lags[0]:
-            lags = lags_all
-            ind_range = [0, len(lags_all)]
-        else:
-            ind = np.where(lags_all == lags[0])[0][0]
-            ind_range = [ind, ind + 2 * ml + 1]
-        mid = np.where(lags == 0)[0][0]
-        cols = np.arange(0, nchan * nchan, nchan + 1)
-
-        for t in range(nw):
-            r_all = np.zeros([lags_all.shape[0], nchan * nchan])
-            for col1 in range(nchan):
-                for col2 in range(col1, nchan):
-                    n = nchan * (col1) + col2
-                    n_rev = nchan * (col2) + col1
-                    r = correlate(
-                        values[window_start[t] : window_start[t] + iw, col1],
-                        values[window_start[t] : window_start[t] + iw, col2],
-                    )
-                    r_all[:, n] = r
-                    r_all[:, n_rev] = r
-
-            r_all = r_all[ind_range[0] : ind_range[1], :]
-
-            trow = np.sqrt(r_all[mid, cols])
-            tmat = np.outer(trow, trow).reshape(-1)
-            r_all /= tmat
-            mb = np.max(r_all, axis=0).reshape(nchan, nchan)
-            lb = lags[np.argmax(r_all, axis=0)].reshape(nchan, nchan)
-            mb_all[:, :, t] = mb
-            lb_all[:, :, t] = lb
-
-        lb_all = lb_all / fs
-
-        mb = np.nanmean(mb_all, axis=2)
-        lb = np.nanmean(lb_all, axis=2)
-    else:
-        lags_all = np.arange(-values.shape[0] + 1, values.shape[0])
-        ind = np.where(lags_all == lags[0])[0][0]
-        ind_range = [ind, ind + 2 * ml + 1]
-        mid = np.where(lags == 0)[0][0]
-        cols = np.arange(0, nchan * nchan, nchan + 1)
-
-        r_all = np.zeros([lags_all.shape[0], nchan * nchan])
-        for col1 in range(nchan):
-            for col2 in range(col1, nchan):
-                n = nchan * (col1) + col2
-                n_rev = nchan * (col2) + col1
-                r = correlate(values[:, col1], values[:, col2])
-                r_all[:, n] = r
-                r_all[:, n_rev] = r
-
-        r_all = r_all[ind_range[0] : ind_range[1], :]
-
-        trow = np.sqrt(r_all[mid, cols])
-        tmat = np.outer(trow, trow).reshape(-1)
-        r_all /= tmat
-        mb = np.max(r_all, axis=0).reshape(nchan, nchan)
-        lb = lags[np.argmax(r_all, axis=0)].reshape(nchan, nchan)
-        lb = lb / fs
+    windows, times = sliding_windows(values, fs, win_size if win else None, step)
+    nw, iw = windows.shape[:2]
+    lags = _lags(values.shape[0], iw, fs, max_lag)
+
+    mb_all = np.ones((nw, nchan, nchan))
+    lb_all = np.zeros((nw, nchan, nchan))
+    for t in range(nw):
+        mb_all[t], lb_all[t] = _xcorr_peak(windows[t], lags, batch_size)
+    lb_all = lb_all / fs
+
+    if timeseries:
+        return mb_all, lb_all, times
+    if nw == 1:
+        return mb_all[0], lb_all[0]
+    return np.nanmean(mb_all, axis=0), np.nanmean(lb_all, axis=0)
+
+
+def _lags(nsamples: int, iw: int, fs: Number, max_lag: Number) -> np.ndarray:
+    """
+    Lags in samples up to max_lag milliseconds, within windows of iw samples out of nsamples.
+    """
+    ml = min(nsamples - 1, int(max_lag * 1e-3 * fs), iw - 1)
+    return np.arange(-ml, ml + 1)
+
+
+def _xcorr_peak(values: np.ndarray, lags: np.ndarray, batch_size=None):
+    """
+    Peak normalized cross-correlation, and its lag in samples, of all channel pairs within lags.
+    Channels are FFT-ed once; pairs are processed in batches, keeping only the lags of interest.
+    """
+    nchan = values.shape[1]
+    ml = lags[-1]
+    nfft = next_fast_len(values.shape[0] + ml)  # no circular wrap-around within max lag
+    X = np.fft.rfft(values, nfft, axis=0)
+    energy = np.sum(values**2, axis=0)
+    # circular indices of lags -ml..ml
+    ind = np.concatenate([np.arange(nfft - ml, nfft), np.arange(ml + 1)])
+
+    if batch_size is None:
+        batch_size = max(1, 2**24 // nfft)
+    pi, pj = np.triu_indices(nchan)
+    mb = np.ones((nchan, nchan))
+    lb = np.zeros((nchan, nchan))
+    for b in range(0, len(pi), batch_size):
+        i = pi[b : b + batch_size]
+        j = pj[b : b + batch_size]
+        r = np.fft.irfft(X[:, i] * np.conj(X[:, j]), nfft, axis=0)[ind, :]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            r /= np.sqrt(energy[i] * energy[j])
+        mb[i, j] = mb[j, i] = np.max(r, axis=0)
+        lb[i, j] = lb[j, i] = lags[np.argmax(r, axis=0)]
 
     return mb, lb
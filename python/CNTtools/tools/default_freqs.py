@@ -12,3 +12,6 @@ freqs : ndarray
     gamma, ripple, broadband.
 """
 freqs = np.array([[0.5, 4], [4, 8], [8, 12], [12, 30], [30, 80], [80, 250], [0.5, 250]])
+
+# Names of the rows of freqs
+band_names = ["delta", "theta", "alpha", "beta", "gamma", "ripple", "broad"]
@@ -0,0 +1,150 @@
+import numpy as np
+from beartype.typing import Optional, Union
+from numbers import Number
+from .accumulator import MatrixAccumulator
+from .default_freqs import freqs, band_names
+
+
+class DynamicConn:
+    """
+    Time-resolved connectivity: one symmetric channels X channels matrix per time window and band.
+
+    Only the upper triangle of each matrix, diagonal included, is stored, as float32, in an array of
+    shape windows X pairs X bands, which is memory-mapped to a .npy file if a path is given. Matrices
+    are rebuilt on access, and only for the windows and band asked for.
+
+    Attributes:
+        times (np.ndarray): Start time of each window in seconds.
+        nchs (int): Number of channels.
+        bands (np.ndarray): Frequency band of each band index, one [low, high] row per band, or None for
+            methods without bands.
+        path (str): .npy file holding values, or None if kept in memory.
+        values (np.ndarray): Upper triangles, windows X pairs X bands.
+
+    Example:
+    >>> dyn = DynamicConn(times, nchs, bands=freqs, path="plv.npy")
+    >>> dyn.write(0, plv_windows)  # windows X channels X channels X bands
+    >>> dyn.between(10, 20, band="alpha")  # windows starting in [10, 20) s
+    >>> dyn.mean()  # channels X channels X bands, as the windowed average
+    """
+
+    def __init__(
+        self,
+        times: np.ndarray,
+        nchs: int,
+        bands: Optional[np.ndarray] = None,
+        path: Optional[str] = None,
+        dtype=np.float32,
+    ):
+        self.times = np.asarray(times)
+        self.nchs = nchs
+        self.bands = bands
+        self.path = path
+        shape = (len(self.times), nchs * (nchs + 1) // 2, 1 if bands is None else len(bands))
+        if path is None:
+            self.values = np.full(shape, np.nan, dtype=dtype)
+        else:
+            self.values = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+        self._triu = np.triu_indices(nchs)
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def shape(self):
+        """Shape of the full series, windows X channels X channels (X bands)."""
+        shape = (len(self), self.nchs, self.nchs)
+        return shape if self.bands is None else shape + (len(self.bands),)
+
+    def write(self, start: int, matrices: np.ndarray):
+        """
+        Store the matrices of consecutive windows from window start, of shape windows X channels X
+        channels, with a trailing bands axis for methods with bands.
+        """
+        tri = matrices[:, self._triu[0], self._triu[1]]
+        self.values[start : start + len(tri)] = tri.reshape(len(tri), tri.shape[1], -1)
+
+    def flush(self):
+        if isinstance(self.values, np.memmap):
+            self.values.flush()
+
+    def band_index(self, band: Union[int, str]) -> int:
+        """
+        Index of a band, given as an index or, for the default frequency bands, by name.
+        """
+        assert self.bands is not None, "CNTtools:invalidBand"
+        if isinstance(band, str):
+            assert band in band_names and np.array_equal(
+                self.bands, freqs
+            ), "CNTtools:invalidBand"
+            band = band_names.index(band)
+        assert -len(self.bands) <= band < len(self.bands), "CNTtools:invalidBand"
+        return band
+
+    def matrices(
+        self, index=slice(None), band: Union[None, int, str] = None
+    ) -> np.ndarray:
+        """
+        Full matrices of the windows selected by index (an int, slice or index array).
+
+        Returns windows X channels X channels, with a trailing bands axis if the method has bands and
+        band is None, and without the windows axis if index is an int.
+        """
+        tri = self.values[index]
+        if band is not None:
+            tri = tri[..., [self.band_index(band)]]
+        single = tri.ndim == 2
+        if single:
+            tri = tri[np.newaxis]
+        out = np.empty((tri.shape[0], self.nchs, self.nchs, tri.shape[2]), dtype=tri.dtype)
+        out[:, self._triu[0], self._triu[1]] = tri
+        out[:, self._triu[1], self._triu[0]] = tri
+        if self.bands is None or band is not None:
+            out = out[..., 0]
+        return out[0] if single else out
+
+    __getitem__ = matrices
+
+    def between(
+        self,
+        start: Optional[Number] = None,
+        stop: Optional[Number] = None,
+        band: Union[None, int, str] = None,
+    ) -> np.ndarray:
+        """
+        Full matrices of the windows starting in [start, stop) seconds.
+        """
+        lo = 0 if start is None else np.searchsorted(self.times, start, side="left")
+        hi = len(self) if stop is None else np.searchsorted(self.times, stop, side="left")
+        return self.matrices(slice(lo, hi), band)
+
+    def mean(
+        self, band: Union[None, int, str] = None, chunk_size: int = 2**10
+    ) -> np.ndarray:
+        """
+        NaN-ignoring average over all windows, read from storage in chunks of windows.
+        """
+        acc = MatrixAccumulator()
+        for t in range(0, len(self), chunk_size):
+            acc.update(self.values[t : t + chunk_size])
+        out = np.empty((self.nchs, self.nchs, self.values.shape[2]))
+        out[self._triu[0], self._triu[1]] = acc.mean
+        out[self._triu[1], self._triu[0]] = acc.mean
+        if band is not None:
+            return out[..., self.band_index(band)]
+        return out[..., 0] if self.bands is None else out
+
+    def __getstate__(self):
+        # memory-mapped series are saved as their file, reopened on load
+        state = self.__dict__.copy()
+        state.pop("_triu")
+        if self.path is not None:
+            self.flush()
+            state["values"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.path is not None:
+            self.values = np.load(self.path, mmap_mode="r+")
+        self._triu = np.triu_indices(self.nchs)
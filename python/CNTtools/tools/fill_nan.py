@@ -0,0 +1,70 @@
+import numpy as np
+from beartype import beartype
+from beartype.typing import Optional, Tuple
+
+FILL_METHODS = ["mean", "linear", "mask"]
+
+
+@beartype
+def fill_nan(
+    data: np.ndarray, method: str = "mean", mask: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Replace missing (NaN) samples of each channel, for all channels at once, without modifying data.
+
+    Parameters:
+    - data (np.ndarray): Data of shape samples X channels.
+    - method (str, optional): How missing samples are replaced. Default is 'mean'.
+        'mean': the mean of the channel's other samples.
+        'linear': linear interpolation between the nearest samples of the channel, holding the first and
+            last ones at the edges.
+        'mask': as 'mean', for analyses that then ignore the missing samples through the returned mask,
+            e.g. connectivity(..., mask=mask) drops the time windows where a channel had missing samples.
+    - mask (np.ndarray, optional): Boolean mask of the missing samples, if already known. Default is None,
+        computed from data.
+
+    Returns:
+    - np.ndarray: Filled data, a new array if any sample was missing, otherwise a read-only view of data.
+        Channels without any sample stay NaN.
+    - np.ndarray: Boolean mask of the missing samples, samples X channels.
+
+    Example:
+    >>> filled, mask = fill_nan(values, "linear")
+    """
+    assert method in FILL_METHODS, "CNTtools:invalidFillMethod"
+    if mask is None:
+        mask = np.isnan(data)
+    assert mask.shape == data.shape, "CNTtools:invalidMask"
+    cols = np.flatnonzero(mask.any(axis=0))
+    if len(cols) == 0:
+        view = data.view()
+        view.flags.writeable = False
+        return view, mask
+
+    filled = np.array(data, dtype=np.result_type(data.dtype, float))
+    missing = mask[:, cols]
+    values = filled[:, cols]
+    if method == "linear":
+        # nearest non-missing sample before and after each sample, for all channels at once
+        nsamples = len(values)
+        ind = np.arange(nsamples)[:, np.newaxis]
+        prev = np.maximum.accumulate(np.where(missing, -1, ind), axis=0)
+        nxt = np.minimum.accumulate(np.where(missing, nsamples, ind)[::-1], axis=0)[::-1]
+        prev_ok, nxt_ok = prev >= 0, nxt < nsamples
+        prev = np.where(prev_ok, prev, nxt)
+        nxt = np.where(nxt_ok, nxt, prev)
+        y0 = np.take_along_axis(values, np.clip(prev, 0, nsamples - 1), axis=0)
+        y1 = np.take_along_axis(values, np.clip(nxt, 0, nsamples - 1), axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            w = np.where(nxt > prev, (ind - prev) / (nxt - prev), 0)
+        fill = y0 + w * (y1 - y0)
+        # channels without any sample
+        fill[:, ~(prev_ok | nxt_ok).any(axis=0)] = np.nan
+    else:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fill = np.broadcast_to(
+                np.where(missing, 0, values).sum(axis=0) / (~missing).sum(axis=0),
+                values.shape,
+            )
+    filled[:, cols] = np.where(missing, fill, values)
+    return filled, mask
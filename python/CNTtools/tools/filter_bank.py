@@ -0,0 +1,128 @@
+import numpy as np
+from functools import lru_cache
+from scipy.signal import butter, sosfiltfilt
+from beartype import beartype
+from beartype.typing import Iterable, Optional
+from numbers import Number
+from .filtfilt_blocks import filtfilt_blocks
+
+
+@lru_cache(maxsize=256)
+def _butter_sos(fs, band, order, btype):
+    return butter(order, list(band), btype=btype, fs=fs, output="sos")
+
+
+def design_sos(
+    fs: Number, band: Iterable[Number], order: int = 2, btype: str = "bandpass"
+) -> np.ndarray:
+    """
+    Design a Butterworth filter in second-order sections, memoized by (fs, band, order, type).
+
+    Args:
+        fs (Number): Sampling frequency in Hz.
+        band (Iterable[Number]): Cutoff frequencies in Hz.
+        order (int, optional): Filter order. Default is 2.
+        btype (str, optional): Filter type, e.g. 'bandpass' or 'bandstop'. Default is 'bandpass'.
+
+    Returns:
+        np.ndarray: Second-order sections of the filter.
+    """
+    band = tuple(float(f) for f in np.atleast_1d(band))
+    # copy, so callers cannot alter the cached design
+    return _butter_sos(float(fs), band, int(order), btype).copy()
+
+
+def bandpass_sos(fs: Number, low_freq: Number, high_freq: Number, order: int = 2):
+    """Bandpass filter used by bandpass_filter, cutoffs clipped to [0.5, fs/2 - 1] Hz."""
+    return design_sos(
+        fs, [max(low_freq, 0.5), min(high_freq, fs // 2 - 1)], order, "bandpass"
+    )
+
+
+def notch_sos(fs: Number, notch_freq: Number, order: int = 4):
+    """Bandstop filter used by notch_filter, 2 Hz wide around notch_freq."""
+    return design_sos(fs, [notch_freq - 1, notch_freq + 1], order, "bandstop")
+
+
+@beartype
+def bandpass_notch_filter(
+    data: np.ndarray,
+    fs: Number,
+    low_freq: Number = 1,
+    high_freq: Number = 120,
+    notch_freq: Optional[Number] = 60,
+    order: int = 2,
+    notch_order: int = 4,
+    dtype: Optional[type] = None,
+    block_size: Optional[int] = None,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Apply bandpass and notch filters in a single zero-phase pass, by cascading their second-order sections.
+
+    The output differs from bandpass_filter followed by notch_filter near the edges only, as the single
+    pass is padded and initialized differently. At the edges the difference can reach tens of percent of
+    the signal peak for signals with strong low-frequency content, and it decays with the time constant
+    of the low_freq cutoff: at 1 Hz, to about 1e-3 of the peak 1.5 s from the edges, 1e-6 after 4 s and
+    1e-12 after 10 s.
+
+    Args:
+        data (np.ndarray): The input data to be filtered with shape (samples, channels).
+        fs (Number): The sampling frequency of the input data in Hz.
+        low_freq (Number, optional): Lower cutoff frequency of the bandpass filter. Default is 1 Hz.
+        high_freq (Number, optional): Upper cutoff frequency of the bandpass filter. Default is 120 Hz.
+        notch_freq (Number, optional): Notch filtering frequency, None to skip notch filtering. Default is 60 Hz.
+        order (int, optional): Order of the bandpass filter. Default is 2.
+        notch_order (int, optional): Order of the notch filter. Default is 4.
+        dtype (type, optional): np.float32 for a single precision output, halving its memory use. The
+            filter coefficients and arithmetic stay in double precision, block by block, so the output
+            only differs from double precision filtering by float32 rounding, about 1e-7 of the signal peak.
+            Default is None (double precision).
+        block_size (int, optional): If given, filter block_size samples at a time with bounded memory.
+        out (np.ndarray, optional): Array (e.g. a memmap) the filtered data is written into, filtering block-wise.
+
+    Returns:
+        np.ndarray: The filtered data with the same shape as the input data.
+
+    Examples:
+        >>> filtered = bandpass_notch_filter(data, fs)
+        >>> filtered = bandpass_notch_filter(data, fs, 1, 120, 60, dtype=np.float32)
+    """
+    sos = bandpass_sos(fs, low_freq, high_freq, order)
+    if notch_freq is not None:
+        sos = np.vstack([sos, notch_sos(fs, notch_freq, notch_order)])
+    if dtype is not None:
+        assert dtype in [np.float32, np.float64], "CNTtools:invalidDtype"
+        if dtype == np.float64:
+            data = data.astype(dtype, copy=False)
+        elif out is None:
+            # filter block-wise in double precision, into a single precision output
+            out = np.empty(data.shape, dtype=dtype)
+
+    if block_size is not None or out is not None:
+        return filtfilt_blocks(
+            sos, data, out=out, block_size=block_size if block_size else 2**16
+        )
+
+    return sosfiltfilt(sos, data, axis=0)
+
+
+@beartype
+def bandpass_stack(data: np.ndarray, fs: Number, freqs: np.ndarray) -> np.ndarray:
+    """
+    Bandpass filter data into each frequency band, as bandpass_filter does.
+
+    Args:
+        data (np.ndarray): The input data with shape (samples, channels).
+        fs (Number): The sampling frequency of the input data in Hz.
+        freqs (np.ndarray): Matrix where each row is a frequency band, as [low, high] in Hz.
+
+    Returns:
+        np.ndarray: The filtered data with shape (samples, channels, bands).
+    """
+    filtered = np.zeros(data.shape + (freqs.shape[0],))
+    for f in range(freqs.shape[0]):
+        filtered[..., f] = sosfiltfilt(
+            bandpass_sos(fs, freqs[f, 0], freqs[f, 1]), data, axis=0
+        )
+    return filtered
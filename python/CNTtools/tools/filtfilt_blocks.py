@@ -0,0 +1,122 @@
+import numpy as np
+from scipy.signal import sosfilt, sosfiltfilt
+from beartype import beartype
+from beartype.typing import Iterable, Iterator, Optional, Union
+
+
+def settle_len(sos: np.ndarray, tol: float = 1e-10, max_len: int = 2**24) -> int:
+    """
+    Number of samples for the impulse response of a filter to decay below tol relative to its peak.
+
+    Args:
+        sos (np.ndarray): Filter in second-order sections format.
+        tol (float, optional): Relative amplitude considered settled. Default is 1e-10.
+        max_len (int, optional): Upper bound of the returned length. Default is 2**24.
+
+    Returns:
+        int: Settling length in samples.
+    """
+    n = 1024
+    while True:
+        impulse = np.zeros(n)
+        impulse[0] = 1
+        h = np.abs(sosfilt(sos, impulse))
+        last = np.nonzero(h > tol * np.max(h))[0][-1]
+        if last < n // 2 or n >= max_len:
+            return int(min(last + 1, max_len))
+        n *= 2
+
+
+def _iter_blocks(source, block_size):
+    if isinstance(source, np.ndarray):
+        for i in range(0, source.shape[0], block_size):
+            yield source[i : i + block_size]
+    else:
+        yield from source
+
+
+def _filtfilt_stream(sos, source, block_size, context):
+    """
+    Yield zero-phase filtered blocks of block_size samples.
+
+    Each block is filtered together with context samples on both sides, which absorb the
+    start-up transients of the forward and backward passes. Blocks touching the start or end
+    of the recording are padded by sosfiltfilt exactly as the whole recording would be.
+    """
+    chunks = _iter_blocks(source, block_size)
+    buf = None  # buffered samples, starting at global index buf_start
+    buf_start = 0
+    out_pos = 0  # global index of the next output sample
+    exhausted = False
+    while True:
+        # read until the next block and its right context are buffered
+        while not exhausted and (
+            buf is None or buf_start + buf.shape[0] < out_pos + block_size + context
+        ):
+            try:
+                chunk = np.asarray(next(chunks))
+            except StopIteration:
+                exhausted = True
+                break
+            buf = chunk if buf is None else np.concatenate([buf, chunk], axis=0)
+        if buf is None:
+            return
+        buf_end = buf_start + buf.shape[0]
+        if out_pos >= buf_end:
+            return
+
+        # drop samples no longer needed as left context
+        drop = max(0, out_pos - context - buf_start)
+        buf = buf[drop:]
+        buf_start += drop
+
+        seg_end = buf_end if exhausted else out_pos + block_size + context
+        y = sosfiltfilt(sos, buf[: seg_end - buf_start], axis=0)
+        n = min(block_size, buf_end - out_pos)
+        yield y[out_pos - buf_start : out_pos - buf_start + n]
+        out_pos += n
+
+
+@beartype
+def filtfilt_blocks(
+    sos: np.ndarray,
+    source: Union[np.ndarray, Iterable[np.ndarray]],
+    out: Optional[np.ndarray] = None,
+    block_size: int = 2**16,
+    context: Optional[int] = None,
+) -> Union[np.ndarray, Iterator[np.ndarray]]:
+    """
+    Block-wise zero-phase filtering with bounded memory, equivalent to sosfiltfilt on the whole recording.
+
+    Args:
+        sos (np.ndarray): Filter in second-order sections format.
+        source (np.ndarray or Iterable[np.ndarray]): Data of shape (samples, channels), e.g. a memmap,
+            or an iterable of consecutive blocks of shape (samples, channels).
+        out (np.ndarray, optional): Array (e.g. a memmap) the filtered data is written into.
+        block_size (int, optional): Number of samples filtered at once. Default is 2**16.
+        context (int, optional): Number of samples on each side of a block used to absorb filter transients.
+            Default is the settling length of the filter impulse response.
+
+    Returns:
+        np.ndarray: The filtered data, if out is given or source is an array.
+        Iterator[np.ndarray]: Filtered blocks of block_size samples, if source is an iterable and out is None.
+
+    Example:
+        >>> sos = butter(2, [1, 120], btype="bandpass", fs=fs, output="sos")
+        >>> src = np.load("recording.npy", mmap_mode="r")
+        >>> out = np.lib.format.open_memmap("filtered.npy", mode="w+", shape=src.shape)
+        >>> filtfilt_blocks(sos, src, out=out)
+    """
+    assert block_size > 0, "CNTtools:invalidBlockSize"
+    if context is None:
+        context = settle_len(sos)
+    blocks = _filtfilt_stream(sos, source, block_size, context)
+    if out is None and not isinstance(source, np.ndarray):
+        return blocks
+    if out is None:
+        out = np.zeros(source.shape, dtype=np.result_type(source.dtype, sos.dtype))
+    pos = 0
+    for y in blocks:
+        out[pos : pos + y.shape[0]] = y
+        pos += y.shape[0]
+    return out
@@ -3,9 +3,13 @@
 """
 import re
 import numpy as np
+from collections import Counter
+from functools import lru_cache
 from beartype import beartype
 from beartype.typing import Union, Iterable
 
+_first_digit = re.compile(r"\d")
+
 non_ieeg = [
     "EKG",
     "O",
@@ -37,24 +41,24 @@ def find_non_ieeg(channel_li: Union[Iterable[str], str]) -> np.ndarray:
     """
     if isinstance(channel_li, str):
         channel_li = [channel_li]
-    is_non_ieeg = np.zeros(len(channel_li), dtype=bool)
-    for ind, i in enumerate(channel_li):
-        # Gets letter part of channel
-        label_num_search = re.search(r"\d", i)
-        if label_num_search is not None:
-            label_num_idx = label_num_search.start()
-            label_non_num = i[:label_num_idx]
-        else:
-            label_non_num = i
-        # finds non-iEEG channels, make a separate function
-        if label_non_num.upper() in non_ieeg:
-            is_non_ieeg[ind] = True
-        if i == "O1" or i == "O2":
-            if (
-                channel_li.count("O3") == 1 or channel_li.count("O4") == 1
-            ):  # if intracranial, should have these too
-                is_non_ieeg[ind] = 0
-            else:
-                is_non_ieeg[ind] = 1
+    channel_li = list(channel_li)
+    is_non_ieeg = np.array([_non_ieeg_label(i) for i in channel_li], dtype=bool)
+    occipital = [ind for ind, i in enumerate(channel_li) if i == "O1" or i == "O2"]
+    if occipital:
+        counts = Counter(channel_li)
+        # if intracranial, should have these too
+        intracranial = counts["O3"] == 1 or counts["O4"] == 1
+        is_non_ieeg[occipital] = not intracranial
 
     return is_non_ieeg
+
+
+@lru_cache(maxsize=2**16)
+def _non_ieeg_label(label: str) -> bool:
+    # Gets letter part of channel
+    label_num_search = _first_digit.search(label)
+    if label_num_search is not None:
+        label_non_num = label[: label_num_search.start()]
+    else:
+        label_non_num = label
+    return label_non_num.upper() in non_ieeg
@@ -1,8 +1,142 @@
+import os
 import pandas as pd
 import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
 from .clean_labels import clean_labels
 from beartype import beartype
-from beartype.typing import Iterable, Union
+from beartype.typing import Iterable, Optional, Union
+from numbers import Number
+
+# stores loaded by load_elec_locs, keyed by file path, with the modification time they were loaded at
+_stores = {}
+
+
+class ElecLocStore:
+    """
+    Electrode locations of all patients in a location file, indexed by patient ID and cleaned label.
+
+    The file, with rows | patientID | electrodeName | x | y | z |, is parsed once. Lookups of a
+    whole label array are dictionary lookups, and a KD-tree of each patient's contacts is built on
+    first use for radius neighbor queries, such as the neighbors of laplacian re-referencing.
+
+    Attributes:
+        patients (dict): For each patient ID, a tuple of (cleaned labels, locations of shape contacts X 3,
+            index of the first contact of each cleaned label).
+
+    Example:
+    >>> store = load_elec_locs("elec_locs.csv")
+    >>> locs = store.lookup("HUP172_phaseII", ch_names)
+    >>> close = store.neighbors("HUP172_phaseII", ch_names, 20)
+    """
+
+    def __init__(self, elec_locs: np.ndarray):
+        self.patients = {}
+        self._trees = {}
+        self._adjacency = {}
+        self._resolved = {}
+        # group rows by patient with a single sort
+        patients, inv = np.unique(elec_locs[:, 0].astype(str), return_inverse=True)
+        order = np.argsort(inv, kind="stable")
+        bounds = np.searchsorted(inv[order], np.arange(len(patients) + 1))
+        all_labels = clean_labels([str(i) for i in elec_locs[order, 1]])
+        all_locs = elec_locs[order, 2:].astype(float)
+        for p, patient in enumerate(patients):
+            labels = all_labels[bounds[p] : bounds[p + 1]]
+            index = {}
+            for i, label in enumerate(labels):
+                index.setdefault(label, i)
+            self.patients[patient] = (labels, all_locs[bounds[p] : bounds[p + 1]], index)
+
+    @classmethod
+    def from_csv(cls, filename: str):
+        """Parse a location file without header."""
+        return cls(pd.read_csv(filename, header=None).dropna().to_numpy())
+
+    def patient(self, fileID: str) -> Optional[str]:
+        """
+        Patient ID contained in fileID, e.g. HUP172 for HUP172_phaseII, None if there is no single match.
+        """
+        if fileID not in self._resolved:
+            match = [p for p in self.patients if str(p) in fileID]
+            self._resolved[fileID] = match[0] if len(match) == 1 else None
+        return self._resolved[fileID]
+
+    def lookup(self, fileID: str, chLabels: Union[Iterable[str], str]) -> np.ndarray:
+        """
+        Locations of channels of shape channels X 3, nan for channels without location.
+        """
+        if isinstance(chLabels, str):
+            chLabels = [chLabels]
+        chLabels = clean_labels(chLabels)
+        out_locs = np.nan * np.zeros([len(chLabels), 3])
+        patient = self.patient(fileID)
+        if patient is None:
+            return out_locs
+        _, locs, index = self.patients[patient]
+        ind = np.array([index.get(label, -1) for label in chLabels], dtype=int)
+        out_locs[ind >= 0] = locs[ind[ind >= 0]]
+        return out_locs
+
+    def tree(self, fileID: str) -> Optional[cKDTree]:
+        """
+        KD-tree of all located contacts of a patient, None if the patient is not found.
+        """
+        patient = self.patient(fileID)
+        if patient is None:
+            return None
+        if patient not in self._trees:
+            self._trees[patient] = cKDTree(self.patients[patient][1])
+        return self._trees[patient]
+
+    def neighbors(
+        self, fileID: str, chLabels: Iterable[str], radius: Number
+    ) -> sparse.csc_matrix:
+        """
+        Sparse indicator of shape channels X channels of the located channels strictly within radius of
+        each other, from the patient's KD-tree. The contact pairs within radius are found once per
+        patient and radius, and each clip only selects its channels.
+        """
+        chLabels = clean_labels(list(chLabels))
+        nchs = len(chLabels)
+        patient = self.patient(fileID)
+        if patient is None:
+            return sparse.csc_matrix((nchs, nchs))
+        _, locs, index = self.patients[patient]
+        ncontacts = len(locs)
+        if (patient, radius) not in self._adjacency:
+            pairs = self.tree(fileID).query_pairs(np.nextafter(radius, 0), output_type="ndarray")
+            pairs = pairs.reshape(-1, 2)
+            # contacts are their own neighbors, for channels sharing a contact
+            self._adjacency[(patient, radius)] = (
+                sparse.coo_matrix(
+                    (
+                        np.ones(2 * len(pairs)),
+                        (np.r_[pairs[:, 0], pairs[:, 1]], np.r_[pairs[:, 1], pairs[:, 0]]),
+                    ),
+                    shape=(ncontacts, ncontacts),
+                )
+                + sparse.identity(ncontacts)
+            ).tocsr()
+        ind = np.array([index.get(label, -1) for label in chLabels], dtype=int)
+        located = np.flatnonzero(ind >= 0)
+        select = sparse.csr_matrix(
+            (np.ones(len(located)), (located, ind[located])), shape=(nchs, ncontacts)
+        )
+        close = select @ self._adjacency[(patient, radius)] @ select.T
+        close = close - sparse.diags(close.diagonal())
+        close.eliminate_zeros()
+        return close.tocsc()
+
+
+def load_elec_locs(filename: str) -> ElecLocStore:
+    """
+    Electrode location store of a file, parsed once and reloaded only if the file changes.
+    """
+    path, mtime = os.path.abspath(filename), os.path.getmtime(filename)
+    if path not in _stores or _stores[path][0] != mtime:
+        _stores[path] = (mtime, ElecLocStore.from_csv(filename))
+    return _stores[path][1]
 
 
 @beartype
@@ -22,32 +156,8 @@ def get_elec_locs(fileID: str, chLabels: Union[Iterable[str], str], filename: st
     chLabels = ['Fp1', 'Fp2', 'C3', 'C4']
     filename = 'electrode_locations.csv'
     output = get_elec_locs(chLabels, filename)
-    """
 
-    # Convert single string to list
-    if isinstance(chLabels, str):
-        chLabels = [chLabels]
-
-    # Load electrode locations from the specified file
-    elec_locs = pd.read_csv(filename, header=None).dropna()
-    elec_locs = elec_locs.to_numpy()
-
-    # 
-    available_pts = np.unique(elec_locs[:,0])
-    match = [i in fileID for i in available_pts]
-    fullFileID = available_pts[match]
-    elec_locs = elec_locs[np.where(elec_locs[:,0]==fullFileID)[0],:]
-
-    # Clean labels from both sources
-    labels = clean_labels(elec_locs[:,1])
-    chLabels = clean_labels(chLabels)
-
-    # Find common labels and their corresponding indices
-    common = np.isin(chLabels, labels)
-    out_locs = np.nan * np.zeros([len(chLabels), 3])
-    for i in range(len(chLabels)):
-        if common[i]:
-            ind = np.where(labels == chLabels[i])[0]
-            out_locs[i, :] = elec_locs[ind, 2:]
-
-    return out_locs
+    Note:
+    The file is parsed once into an ElecLocStore, see load_elec_locs.
+    """
+    return load_elec_locs(filename).lookup(fileID, chLabels)
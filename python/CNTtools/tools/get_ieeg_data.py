@@ -7,12 +7,14 @@ from CNTtools import settings
 # from pull_patient_localization import pull_patient_localization
 import numpy as np
 import time, os, warnings, pickle
+from concurrent.futures import ThreadPoolExecutor
 
 from beartype import beartype
 from beartype.typing import Union, Optional, Tuple
 from numbers import Number
 
 from .clean_labels import clean_labels
+from .segment_cache import SegmentCache
 
 
 def _pull_iEEG(
@@ -35,6 +37,74 @@ def _pull_iEEG(
                 raise e
 
 
+def _pull_chunks(
+    ds: ieeg.dataset.Dataset,
+    start_usec: Number,
+    stop_usec: Number,
+    channel_ids: list,
+    fs: Number,
+    clip_size: Number = 60,
+    n_workers: int = 4,
+    verbose: bool = False,
+    return_filled: bool = False,
+) -> Tuple[np.ndarray, ...]:
+    """
+    Pull data in fixed-size clips concurrently, writing each clip into a preallocated output.
+
+    Parameters:
+    - ds (ieeg.dataset.Dataset): Opened iEEG.org dataset.
+    - start_usec (Number): Start time in microseconds.
+    - stop_usec (Number): Stop time in microseconds.
+    - channel_ids (list): Channel indices to pull.
+    - fs (Number): Sampling frequency of the dataset.
+    - clip_size (Number, optional): Clip duration in seconds. Default is 60.
+    - n_workers (int, optional): Number of clips fetched in parallel. Default is 4.
+    - verbose (bool, optional): Print timing of each clip as it completes. Default is False.
+    - return_filled (bool, optional): Also return a boolean mask of the samples written by a clip,
+        False where a clip came back short and the output kept its NaN prefill. Default is False.
+
+    Returns:
+    - Tuple[np.ndarray, np.ndarray]: Data of shape samples X channels, and fetch time (s) of each clip,
+        followed by the mask of written samples if return_filled.
+    """
+    assert clip_size > 0, "CNTtools:invalidClipSize"
+    assert n_workers > 0, "CNTtools:invalidWorkerNumber"
+    clip_usec = int(clip_size * 1e6)
+    clip_starts = np.arange(start_usec, stop_usec, clip_usec)
+    clip_duras = np.minimum(clip_starts + clip_usec, stop_usec) - clip_starts
+    # sample offset of each clip in the output
+    offsets = np.round((clip_starts - start_usec) * 1e-6 * fs).astype(int)
+    nsamples = int(np.round((stop_usec - start_usec) * 1e-6 * fs))
+
+    data = np.nan * np.zeros((nsamples, len(channel_ids)))
+    timing = np.zeros(len(clip_starts))
+    filled = np.zeros(nsamples, dtype=bool)
+
+    def fetch(i):
+        tic = time.perf_counter()
+        clip = _pull_iEEG(ds, int(clip_starts[i]), int(clip_duras[i]), channel_ids)
+        n = min(clip.shape[0], nsamples - offsets[i])
+        data[offsets[i] : offsets[i] + n, :] = clip[:n, :]
+        filled[offsets[i] : offsets[i] + n] = True
+        timing[i] = time.perf_counter() - tic
+        return i
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        for i in executor.map(fetch, range(len(clip_starts))):
+            if verbose:
+                print(
+                    "Clip {}/{} ({:.1f}-{:.1f} s) pulled in {:.2f} s".format(
+                        i + 1,
+                        len(clip_starts),
+                        clip_starts[i] * 1e-6,
+                        (clip_starts[i] + clip_duras[i]) * 1e-6,
+                        timing[i],
+                    )
+                )
+
+    return (data, timing, filled) if return_filled else (data, timing)
+
+
 @beartype
 def get_ieeg_data(
     username: str,
@@ -45,6 +115,10 @@ def get_ieeg_data(
     select_elecs: Optional[list[Union[str, int]]] = None,
     ignore_elecs: Optional[list[Union[str, int]]] = None,
     outputfile: str = None,
+    clip_size: Number = 60,
+    n_workers: int = 4,
+    verbose: bool = False,
+    cache_dir: Optional[str] = None,
 ) -> Tuple[np.ndarray, float, np.ndarray]:
     """
     Retrieve iEEG data from iEEG.org.
@@ -58,6 +132,12 @@ def get_ieeg_data(
     - select_elecs (Optional[List[Union[str, int]]]): List of selected electrodes (channels) names/indices.
     - ignore_elecs (Optional[List[Union[str, int]]]): List of electrodes (channels) names/indices to ignore.
     - outputfile (Optional, str): path to save data. Default is None.
+    - clip_size (Number, optional): Clip duration in seconds used when the segment is too large
+        to pull at once. Default is 60.
+    - n_workers (int, optional): Number of clips pulled in parallel for large segments. Default is 4.
+    - verbose (bool, optional): Print timing of each pulled clip. Default is False.
+    - cache_dir (Optional, str): Folder of a local segment cache. If given, cached blocks are reused
+        and only missing gaps are pulled from iEEG.org. Default is None (no caching).
 
     Returns:
     - Tuple[np.ndarray, float, np.ndarray]: A tuple containing iEEG data, sampling frequency, and channel names.
@@ -172,28 +252,51 @@ def get_ieeg_data(
         channel_ids = np.arange(len(all_channel_labels))
         channel_names = all_channel_labels
 
-    try:
-        data = ds.get_data(start_time_usec, duration, channel_ids)
-    except Exception as e:
-        # clip is probably too big, pull chunks and concatenate
-        clip_size = 60 * 1e6
-        clip_start = start_time_usec
-        data = None
-        while clip_start + clip_size < stop_time_usec:
-            if data is None:
-                # data = ds.get_data(clip_start, clip_size, channel_ids)
-                data = _pull_iEEG(ds, clip_start, clip_size, channel_ids)
-            else:
-                # data = np.concatenate(([data, ds.get_data(clip_start, clip_size, channel_ids)]), axis=0)
-                data = np.concatenate(
-                    ([data, _pull_iEEG(ds, clip_start, clip_size, channel_ids)]), axis=0
-                )
-            clip_start = clip_start + clip_size
-        # data = np.concatenate(([data, ds.get_data(clip_start, stop_time_usec - clip_start, channel_ids)]), axis=0)
-
-    # df = pd.DataFrame(data, columns=channel_names)
     fs = ds.get_time_series_details(ds.ch_labels[0]).sample_rate  # get sample rate
 
+    if cache_dir is not None:
+        cache = SegmentCache(cache_dir)
+
+        def pull(start, stop):
+            # samples of clips that came back short are flagged, so their blocks are not cached
+            data, _, filled = _pull_chunks(
+                ds,
+                start,
+                stop,
+                channel_ids,
+                fs,
+                clip_size=cache.block_size,
+                n_workers=n_workers,
+                verbose=verbose,
+                return_filled=True,
+            )
+            return data, filled
+
+        data = cache.fetch(
+            iEEG_filename,
+            channel_names,
+            fs,
+            start_time_usec,
+            stop_time_usec,
+            pull,
+            end_usec=end_sec,
+        )
+    else:
+        try:
+            data = ds.get_data(start_time_usec, duration, channel_ids)
+        except Exception as e:
+            # clip is probably too big, pull chunks concurrently
+            data, _ = _pull_chunks(
+                ds,
+                start_time_usec,
+                stop_time_usec,
+                channel_ids,
+                fs,
+                clip_size=clip_size,
+                n_workers=n_workers,
+                verbose=verbose,
+            )
+
     if outputfile:
         with open(outputfile, "wb") as f:
             pickle.dump([data, channel_names, fs], f)
@@ -1,7 +1,12 @@
+import warnings
+from collections import deque
 import numpy as np
 from beartype import beartype
 from numbers import Number
-from beartype.typing import Tuple
+from beartype.typing import Iterable, Optional, Tuple, Union
+from .filtfilt_blocks import _iter_blocks
+
+BAD_CRITERIA = ["noisy", "nans", "zeros", "var", "higher_std", "high_voltage"]
 
 
 def prctile(x, p):
@@ -9,17 +14,21 @@ def prctile(x, p):
     n = len(x)
     p = (p - 50) * n / (n - 1) + 50
     p = np.clip(p, 0, 100)
-    return np.percentile(x, p)
+    return np.percentile(x, p, axis=0)
 
 
 @beartype
-def identify_bad_chs(data: np.ndarray, fs: Number) -> Tuple[np.ndarray, dict]:
+def identify_bad_chs(
+    data: np.ndarray, fs: Number, batch_size: Optional[int] = None
+) -> Tuple[np.ndarray, dict]:
     """
     Identify bad channels based on various criteria.
 
     Args:
         values (np.ndarray): Matrix representing iEEG data, of shape samples X channels.
         fs (Number): Sampling frequency of the iEEG data.
+        batch_size (int, optional): Number of channels processed at once, to bound memory use.
+            Default is None, sized to about 2**24 samples per batch.
 
     Returns:
         Tuple[np.ndarray, dict]: A tuple containing a boolean array indicating bad channels and a dictionary
@@ -38,6 +47,97 @@ def identify_bad_chs(data: np.ndarray, fs: Number) -> Tuple[np.ndarray, dict]:
     fs = 250
     bad, details = identify_bad_chs(values, fs)
     """
+    flag = _bad_ch_flags(data, fs, batch_size)
+    bad = flag != ""
+    details = {c: np.nonzero(flag == c)[0].tolist() for c in BAD_CRITERIA}
+
+    return bad, details
+
+
+@beartype
+def identify_bad_chs_windowed(
+    source: Union[np.ndarray, Iterable[np.ndarray]],
+    fs: Number,
+    win_size: Number = 10,
+    bad_frac: Number = 0.5,
+    batch_size: Optional[int] = None,
+    baseline_windows: int = 30,
+) -> Tuple[np.ndarray, dict]:
+    """
+    Identify bad channels in each time window, with the criteria of identify_bad_chs.
+
+    Windows are evaluated one at a time as data arrive, so a long recording can be passed as an
+    iterable of consecutive blocks (e.g. read from disk) without being loaded at once. The dangling
+    window at the end is dropped.
+
+    The std-ratio criterion (higher_std) compares each channel with a running baseline: the median
+    over channels of each channel's running median std over the last baseline_windows windows, so a
+    window where all channels jump together is flagged as well. The other criteria look for
+    transients within a window, and are evaluated on each window alone, as in identify_bad_chs.
+
+    Args:
+        source (np.ndarray or Iterable[np.ndarray]): iEEG data of shape samples X channels, or an iterable
+            of consecutive blocks of shape samples X channels.
+        fs (Number): Sampling frequency of the iEEG data.
+        win_size (Number, optional): Time window size in seconds. Default is 10 seconds.
+        bad_frac (Number, optional): Fraction of bad windows above which a channel is bad for the whole clip.
+            Default is 0.5.
+        batch_size (int, optional): Number of channels processed at once within a window.
+        baseline_windows (int, optional): Number of windows, up to the current one, of the running
+            std baseline. Default is 30.
+
+    Returns:
+        Tuple[np.ndarray, dict]: A boolean badness mask of shape windows X channels, and a clip-level summary:
+            'bad' (channels bad in more than bad_frac of windows), 'fraction' (fraction of bad windows per channel)
+            and, for each criterion of identify_bad_chs, the number of windows each channel is flagged by it.
+
+    Example:
+    mask, summary = identify_bad_chs_windowed(values, fs, win_size=10)
+    values = values[np.repeat(~mask.any(axis=1), round(10 * fs))]  # drop affected epochs
+    """
+    iw = round(win_size * fs)
+    assert iw > 0, "CNTtools:invalidWindowSize"
+    assert baseline_windows > 0, "CNTtools:invalidBaselineWindows"
+
+    # channel stds of the last baseline_windows windows
+    stds = deque(maxlen=baseline_windows)
+    masks = []
+    counts = {}
+    buf = None
+    for chunk in _iter_blocks(source, iw):
+        chunk = np.asarray(chunk)
+        buf = chunk if buf is None else np.concatenate([buf, chunk], axis=0)
+        # evaluate each full window, keeping the remainder for the next block
+        nw = buf.shape[0] // iw
+        for w in range(nw):
+            window = buf[w * iw : (w + 1) * iw]
+            with warnings.catch_warnings():
+                # channels without any sample
+                warnings.simplefilter("ignore", RuntimeWarning)
+                stds.append(np.nanstd(window, 0))
+                median_std = np.nanmedian(np.nanmedian(np.array(stds), 0))
+            flag = _bad_ch_flags(window, fs, batch_size, median_std)
+            masks.append(flag != "")
+            for c in BAD_CRITERIA:
+                counts[c] = counts.get(c, 0) + (flag == c)
+        buf = buf[nw * iw :]
+
+    nchs = buf.shape[1] if buf is not None else 0
+    mask = np.array(masks).reshape(len(masks), nchs)
+    with np.errstate(invalid="ignore"):
+        fraction = mask.mean(axis=0) if len(masks) > 0 else np.full(nchs, np.nan)
+    summary = {"bad": fraction > bad_frac, "fraction": fraction}
+    summary.update({c: counts.get(c, np.zeros(nchs, dtype=int)) for c in BAD_CRITERIA})
+
+    return mask, summary
+
+
+def _bad_ch_flags(data, fs, batch_size=None, median_std=None):
+    """
+    Criterion each channel of data (samples X channels) is rejected by, '' if it is not rejected.
+    Each channel is flagged by the first criterion it meets. The std-ratio criterion compares channel
+    stds with median_std, by default the median of the channel stds of data.
+    """
     # Parameters to reject super high variance
     tile = 99
     mult = 10
@@ -50,89 +150,60 @@ def identify_bad_chs(data: np.ndarray, fs: Number) -> Tuple[np.ndarray, dict]:
     # Parameter to reject electrodes with much higher std than most electrodes
     mult_std = 10
 
-    nchs = data.shape[1]
-    bad = []
-    high_ch = []
-    nan_ch = []
-    zero_ch = []
-    high_var_ch = []
-    noisy_ch = []
-    all_std = np.nanstd(data, 0)
-    all_bl = np.nanmedian(data, 0)
-
-    for ich in range(nchs):
-
-        eeg = data[:, ich]
+    nsamples, nchs = data.shape
+    all_std = np.zeros(nchs)
+    all_bl = np.zeros(nchs)
+
+    # Frequencies of the first half of the spectrum
+    freqs = np.linspace(0, fs, nsamples + 1)[:-1]
+    half = int(np.ceil(nsamples / 2))
+    freqs = freqs[:half]
+    band_60Hz = (freqs > 58) & (freqs < 62)
+
+    flag = np.full(nchs, "", dtype=object)
+    if batch_size is None:
+        batch_size = max(1, 2**24 // nsamples)
+    for i in range(0, nchs, batch_size):
+        # channel-major copy, so that per-channel sorts and reductions are contiguous
+        eeg = np.ascontiguousarray(data[:, i : i + batch_size].T).T
+        all_std[i : i + batch_size] = np.nanstd(eeg, 0)
+        # np.nanmedian works one channel at a time, only needed for channels with nans
+        has_nan = np.any(np.isnan(eeg), 0)
+        bl = np.median(eeg, 0)
+        bl[has_nan] = np.nanmedian(eeg[:, has_nan], 0)
+        all_bl[i : i + batch_size] = bl
+        ch_flag = np.full(eeg.shape[1], "", dtype=object)
 
         # Remove channels with nans in more than half
-        if np.sum(np.isnan(eeg)) > 0.5 * len(eeg):
-            bad.append(ich)
-            nan_ch.append(ich)
-            continue
+        ch_flag[np.sum(np.isnan(eeg), 0) > 0.5 * nsamples] = "nans"
 
         # Remove channels with zeros in more than half
-        if np.sum(eeg == 0) > 0.5 * len(eeg):
-            bad.append(ich)
-            zero_ch.append(ich)
-            continue
+        ch_flag[(ch_flag == "") & (np.sum(eeg == 0, 0) > 0.5 * nsamples)] = "zeros"
 
         # Remove channels with too many above absolute thresh
-        if np.sum(np.abs(eeg - all_bl[ich]) > abs_thresh) > 10:
-            bad.append(ich)
-            high_ch.append(ich)
-            continue
+        high = np.sum(np.abs(eeg - bl) > abs_thresh, 0) > 10
+        ch_flag[(ch_flag == "") & high] = "high_voltage"
 
         # Remove channels if there are rare cases of super high variance above baseline (disconnection, moving, popping)
         pct = prctile(eeg, [100 - tile, tile])
-        thresh = [
-            all_bl[ich] - mult * (all_bl[ich] - pct[0]),
-            all_bl[ich] + mult * (pct[1] - all_bl[ich]),
-        ]
-        sum_outside = np.sum(eeg > thresh[1]) + np.sum(eeg < thresh[0])
-        if sum_outside >= num_above:
-            bad.append(ich)
-            high_var_ch.append(ich)
-            continue
-
-        # Remove channels with a lot of 60 Hz noise, suggesting poor impedance
-
-        # Calculate fft
-        # orig_eeg = orig_data(:,ich);
-        # Y = fft(orig_eeg-mean(orig_eeg));
-        Y = np.fft.fft(eeg - np.nanmean(eeg))
-
-        # Get power
-        P = np.abs(Y) ** 2
-        freqs = np.linspace(0, fs, len(P) + 1)
-        freqs = freqs[:-1]
-
-        # Take first half
-        P = P[: int(np.ceil(len(P) / 2))]
-        freqs = freqs[: int(np.ceil(len(freqs) / 2))]
-
-        P_60Hz = np.sum(P[(freqs > 58) & (freqs < 62)]) / np.sum(P)
-        if P_60Hz > percent_60_hz:
-            bad.append(ich)
-            noisy_ch.append(ich)
-            continue
+        thresh = [bl - mult * (bl - pct[0]), bl + mult * (pct[1] - bl)]
+        sum_outside = np.sum(eeg > thresh[1], 0) + np.sum(eeg < thresh[0], 0)
+        ch_flag[(ch_flag == "") & (sum_outside >= num_above)] = "var"
+
+        # Remove channels with a lot of 60 Hz noise, suggesting poor impedance,
+        # only computing spectra of channels not flagged yet
+        left = np.nonzero(ch_flag == "")[0]
+        if len(left) > 0:
+            Y = np.fft.rfft(eeg[:, left] - np.nanmean(eeg[:, left], 0), axis=0)
+            P = np.abs(Y[:half]) ** 2
+            P_60Hz = np.sum(P[band_60Hz], 0) / np.sum(P, 0)
+            ch_flag[left[P_60Hz > percent_60_hz]] = "noisy"
+
+        flag[i : i + batch_size] = ch_flag
 
     # Remove channels for whom the std is much larger than the baseline
-    median_std = np.nanmedian(all_std)
-    chs = np.arange(nchs)
-    higher_std = chs[all_std > mult_std * median_std]
-    bad_std = higher_std
-    bad_std = [i for i in bad_std if ~np.isin(i, bad)]
-    bad = bad + bad_std
-    bad_bin = np.zeros(nchs)
-    bad_bin[bad] = 1
-    # bad = logical(bad_bin)
-
-    details = {}
-    details["noisy"] = noisy_ch
-    details["nans"] = nan_ch
-    details["zeros"] = zero_ch
-    details["var"] = high_var_ch
-    details["higher_std"] = bad_std
-    details["high_voltage"] = high_ch
-
-    return bad_bin.astype(bool), details
+    if median_std is None:
+        median_std = np.nanmedian(all_std)
+    flag[(flag == "") & (all_std > mult_std * median_std)] = "higher_std"
+
+    return flag
@@ -1,7 +1,6 @@
 import numpy as np
-from scipy.spatial.distance import cdist
 from beartype import beartype
-from .pseudo_laplacian import pseudo_laplacian
+from .montage import compile_montage
 from numbers import Number
 
 
@@ -20,33 +19,6 @@ def laplacian(data: np.ndarray, labels: np.ndarray, locs: np.ndarray, radius: Nu
         np.ndarray: Laplacian-referenced EEG data matrix.
         np.ndarray: Channel labels for the Laplacian-referenced data.
     """
-    out_values = np.nan * np.zeros(data.shape)
-    nchs = data.shape[1]
-    laplacian_labels = []
+    montage = compile_montage("laplacian", labels, locs, radius)
 
-    nan_elecs = np.any(np.isnan(locs), axis=1)
-    pseudo_values, pseudo_labels = pseudo_laplacian(data, labels)
-
-    # Calculate pairwise distances between X and Y
-    D = cdist(locs, locs)
-
-    close = D < radius
-    close[np.eye(close.shape[0]).astype(bool)] = 0
-
-    # close_chs = []
-
-    for i in range(nchs):
-        if not nan_elecs[i]:
-            close_elecs = np.nonzero(close[i, :])[0]
-            if len(close_elecs) > 0:
-                out_values[:, i] = data[:, i] - np.nanmean(data[:, close_elecs], 1)
-                laplacian_labels.append(labels[i])
-                # close_chs.append(close_elecs)
-            else:
-                out_values[:, i] = pseudo_values[:, i]
-                laplacian_labels.append(pseudo_labels[i])
-        else:
-            out_values[:, i] = pseudo_values[:, i]
-            laplacian_labels.append(pseudo_labels[i])
-
-    return out_values, laplacian_labels
+    return montage.apply(data), list(montage.labels)
@@ -0,0 +1,315 @@
+import os
+import hashlib
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+from beartype import beartype
+from beartype.typing import Iterable, Iterator, Optional, Union
+from numbers import Number
+from .clean_labels import clean_labels, split_label
+from .get_elec_locs import get_elec_locs, load_elec_locs
+
+MONTAGES = ["car", "bipolar", "pseudo_laplacian", "laplacian"]
+
+
+class Montage:
+    """
+    Re-referencing montage compiled into sparse matrices, built once and applied to any clip with the same channels.
+
+    Output channel j is data @ matrix[:, j], minus the NaN-ignoring mean of the channels in
+    neighbors[:, groups[j]] if groups[j] >= 0 (CAR and Laplacian). Output channels labelled '-' have
+    no valid reference and are NaN. Montages are linear, so they can be applied before or after
+    filtering, including to a stream of filtered blocks.
+
+    Attributes:
+        matrix (scipy.sparse.csc_matrix): Linear reference matrix of shape (in channels, out channels).
+        labels (np.ndarray): Labels of the output channels, '-' for channels without reference.
+        in_labels (np.ndarray): Parsed labels of the input channels (cleaned for bipolar).
+        neighbors (scipy.sparse.csc_matrix): Indicator of shape (in channels, groups) of channels averaged per group, or None.
+        groups (np.ndarray): Group of each output channel whose mean is subtracted, -1 for none.
+
+    Example:
+    >>> montage = compile_montage("bipolar", labels)
+    >>> out = montage.apply(data)
+    >>> blocks = montage.apply(filtfilt_blocks(sos, blocks))
+    """
+
+    def __init__(self, matrix, labels, neighbors=None, groups=None, in_labels=None):
+        self.matrix = sparse.csc_matrix(matrix, dtype=float)
+        self.labels = np.asarray(labels)
+        self.in_labels = None if in_labels is None else np.asarray(in_labels)
+        self.neighbors = None if neighbors is None else sparse.csc_matrix(neighbors, dtype=float)
+        self.groups = None if groups is None else np.asarray(groups, dtype=int)
+        assert len(self.labels) == self.matrix.shape[1], "CNTtools:invalidMontage"
+        # identity matrices (CAR) are applied as a copy
+        self._identity = self.matrix.shape[0] == self.matrix.shape[1] and (
+            (self.matrix - sparse.identity(self.matrix.shape[0])).count_nonzero() == 0
+        )
+
+    @property
+    def shape(self):
+        """(in channels, out channels)."""
+        return self.matrix.shape
+
+    def apply(
+        self, data: Union[np.ndarray, Iterable[np.ndarray]]
+    ) -> Union[np.ndarray, Iterator[np.ndarray]]:
+        """
+        Re-reference data of shape samples X channels, or each block of an iterable of blocks.
+        """
+        if isinstance(data, np.ndarray):
+            return self._apply(data)
+        return (self._apply(np.asarray(block)) for block in data)
+
+    def _apply(self, data):
+        assert data.shape[1] == self.matrix.shape[0], "CNTtools:invalidMontage"
+        if self._identity:
+            out = data.astype(np.result_type(data.dtype, float))
+        else:
+            out = np.asarray(data @ self.matrix)
+        if self.neighbors is not None:
+            valid = ~np.isnan(data)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                if np.all(valid):
+                    count = np.asarray(self.neighbors.sum(axis=0))
+                    means = (data @ self.neighbors) / count
+                else:
+                    means = (np.where(valid, data, 0) @ self.neighbors) / (
+                        valid.astype(float) @ self.neighbors
+                    )
+            sel = self.groups >= 0
+            if np.all(sel):
+                # avoid fancy indexing, e.g. CAR subtracts a single mean from all channels
+                out -= means if means.shape[1] == 1 else np.take(means, self.groups, axis=1)
+            else:
+                out[:, sel] -= np.take(means, self.groups[sel], axis=1)
+        out[:, self.labels == "-"] = np.nan
+        return out
+
+
+@beartype
+def compile_montage(
+    method: str,
+    labels: Iterable[str],
+    locs: Optional[np.ndarray] = None,
+    radius: Number = 20,
+    soft: bool = True,
+    soft_thres: int = 1,
+    neighbors: Optional[sparse.spmatrix] = None,
+) -> Montage:
+    """
+    Compile the re-referencing montage of a set of channels.
+
+    Parameters:
+        method (str): Re-referencing method, one of 'car', 'bipolar', 'pseudo_laplacian', 'laplacian'.
+        labels (Iterable[str]): Channel labels, in the order of the data columns.
+        locs (np.ndarray, optional): Electrode locations of shape channels X 3, required for 'laplacian'.
+        radius (Number, optional): Neighborhood radius for 'laplacian'. Default is 20.
+        soft (bool, optional): Allow for soft bipolar referencing, considering multiple next-numbered contacts. Default is True.
+        soft_thres (int, optional): Number of next-numbered contacts to consider in soft referencing. Default is 1.
+        neighbors (scipy.sparse matrix, optional): Channels X channels indicator of the channels within radius of each
+            other for 'laplacian', e.g. from ElecLocStore.neighbors, instead of finding them from locs.
+
+    Returns:
+        Montage: The compiled montage, with the same output as tools.car, tools.bipolar,
+            tools.pseudo_laplacian or tools.laplacian.
+    """
+    assert method in MONTAGES, "CNTtools:invalidRerefMethod"
+    labels = np.array(list(labels))
+    if method == "car":
+        nchs = len(labels)
+        return Montage(
+            sparse.identity(nchs),
+            np.array([label + "-CAR" for label in labels]),
+            np.ones((nchs, 1)),
+            np.zeros(nchs),
+            labels,
+        )
+    if method == "bipolar":
+        return _bipolar_montage(labels, soft, soft_thres)
+    if method == "pseudo_laplacian":
+        return _pseudo_laplacian_montage(labels, soft, soft_thres)
+    assert locs is not None or neighbors is not None, "CNTtools:invalidLocs"
+    return _laplacian_montage(labels, locs, radius, neighbors)
+
+
+def _first_index(labels):
+    """Index of the first occurrence of each label."""
+    index = {}
+    for i, label in enumerate(labels):
+        index.setdefault(label, i)
+    return index
+
+
+def _bipolar_montage(labels, soft, soft_thres):
+    channels = clean_labels(labels)
+    index = _first_index(channels)
+    nchs = len(channels)
+    matrix = sparse.lil_matrix((nchs, nchs))
+    bipolar_labels = []
+    for ch, ch1 in enumerate(channels):
+        label_non_num, label_num = split_label(ch1)
+        if label_num is not None:
+            last = label_num + soft_thres + 1 if soft else label_num + 1
+            candidates = [label_non_num + f"{i}" for i in range(label_num + 1, last + 1)]
+        elif ch1 == "FZ":
+            candidates = ["CZ"]
+        else:
+            candidates = []
+        ch2 = next((c for c in candidates if c in index), None)
+        if ch2 is None:
+            bipolar_labels.append("-")
+            continue
+        matrix[ch, ch] = 1
+        matrix[index[ch2], ch] = -1
+        bipolar_labels.append(ch1 + "-" + ch2)
+    return Montage(matrix, np.array(bipolar_labels), in_labels=channels)
+
+
+def _pseudo_laplacian_columns(labels, soft, soft_thres):
+    """Rows, columns and values of the pseudo-laplacian matrix, and output labels."""
+    index = _first_index(labels)
+    rows, cols, vals = [], [], []
+    out_labels = list(labels)
+    for ch, label in enumerate(labels):
+        label_non_num, label_num = split_label(label)
+        if label_num is None:
+            out_labels[ch] = "-"
+            continue
+        if soft:
+            nums_high = range(label_num + 1, label_num + soft_thres + 2)
+            nums_low = range(label_num - 1, label_num - soft_thres - 2, -1)
+        else:
+            nums_high, nums_low = [label_num + 1], [label_num - 1]
+        # closest existing contacts above and below
+        neighbors = [
+            next((index[c] for c in (label_non_num + str(i) for i in nums) if c in index), None)
+            for nums in [nums_high, nums_low]
+        ]
+        neighbors = [i for i in neighbors if i is not None]
+        if not neighbors:
+            out_labels[ch] = "-"
+            continue
+        rows += [ch] + neighbors
+        cols += [ch] * (len(neighbors) + 1)
+        vals += [1] + [-1 / len(neighbors)] * len(neighbors)
+    return rows, cols, vals, out_labels
+
+
+def _pseudo_laplacian_montage(labels, soft, soft_thres):
+    nchs = len(labels)
+    rows, cols, vals, out_labels = _pseudo_laplacian_columns(labels, soft, soft_thres)
+    matrix = sparse.coo_matrix((vals, (rows, cols)), shape=(nchs, nchs))
+    return Montage(matrix, np.array(out_labels), in_labels=labels)
+
+
+def _laplacian_montage(labels, locs, radius, close=None):
+    nchs = len(labels)
+    rows, cols, vals, out_labels = _pseudo_laplacian_columns(labels, True, 1)
+
+    # Channels with located neighbors within radius subtract their mean, others fall back to pseudo-laplacian
+    if close is None:
+        # radius neighbors of located channels from a KD-tree, as a sparse matrix
+        assert locs.shape[0] == nchs, "CNTtools:invalidLocs"
+        located = np.nonzero(~np.any(np.isnan(locs), axis=1))[0]
+        pairs = cKDTree(locs[located]).query_pairs(np.nextafter(radius, 0), output_type="ndarray")
+        pairs = located[pairs.reshape(-1, 2)]
+        close = sparse.coo_matrix(
+            (np.ones(2 * len(pairs)), (np.r_[pairs[:, 0], pairs[:, 1]], np.r_[pairs[:, 1], pairs[:, 0]])),
+            shape=(nchs, nchs),
+        )
+    close = sparse.csc_matrix(close)
+    assert close.shape == (nchs, nchs), "CNTtools:invalidLocs"
+    has_close = np.diff(close.indptr) > 0
+
+    keep = ~has_close[np.asarray(cols, dtype=int)]
+    rows = list(np.asarray(rows, dtype=int)[keep]) + list(np.nonzero(has_close)[0])
+    vals = list(np.asarray(vals, dtype=float)[keep]) + [1] * int(np.sum(has_close))
+    cols = list(np.asarray(cols, dtype=int)[keep]) + list(np.nonzero(has_close)[0])
+    matrix = sparse.coo_matrix((vals, (rows, cols)), shape=(nchs, nchs))
+    for i in np.nonzero(has_close)[0]:
+        out_labels[i] = labels[i]
+    groups = np.where(has_close, np.arange(nchs), -1)
+    return Montage(matrix, np.array(out_labels), close.T, groups, labels)
+
+
+class MontageCache:
+    """
+    Compiled montages and electrode locations of a session, shared by clips of the same patient.
+
+    Montages are keyed by (patient, channel labels, method, radius, location file version or digest of
+    the locations used by laplacian) and electrode locations by (patient, channel labels, location file), so re-referencing
+    many clips with the same channels parses labels, reads locations and finds neighbors once, and
+    locations from another file compile a new laplacian montage. Cached locations are only stale if a
+    location file is edited, in which case the patient should be cleared.
+
+    Example:
+    >>> cache = MontageCache()
+    >>> montage = cache.montage("HUP172_phaseII", labels, "bipolar")
+    >>> locs = cache.elec_locs("HUP172_phaseII", labels, loc_file)
+    >>> cache.clear("HUP172_phaseII")
+    """
+
+    def __init__(self):
+        self.montages = {}
+        self.locs = {}
+
+    def __len__(self):
+        return len(self.montages) + len(self.locs)
+
+    def montage(
+        self,
+        patient: str,
+        labels: Iterable[str],
+        method: str,
+        locs: Optional[np.ndarray] = None,
+        radius: Number = 20,
+        loc_file: Optional[str] = None,
+    ) -> Montage:
+        """
+        Compiled montage of a patient's channels, see compile_montage. Laplacian montages take their
+        neighbors from the KD-tree of the patient in loc_file if given, see ElecLocStore.neighbors,
+        otherwise from locs.
+        """
+        labels = tuple(str(i) for i in labels)
+        if method != "laplacian":
+            key = (patient, labels, method, None, None)
+        elif loc_file is not None:
+            key = (patient, labels, method, radius, _file_version(loc_file))
+        else:
+            key = (patient, labels, method, radius, _digest(locs))
+        if key not in self.montages:
+            neighbors = None
+            if method == "laplacian" and loc_file is not None:
+                neighbors = load_elec_locs(loc_file).neighbors(patient, labels, radius)
+            self.montages[key] = compile_montage(method, labels, locs, radius, neighbors=neighbors)
+        return self.montages[key]
+
+    def elec_locs(self, patient: str, labels: Iterable[str], loc_file: str) -> np.ndarray:
+        """
+        Electrode locations of a patient's channels, see get_elec_locs.
+        """
+        labels = tuple(str(i) for i in labels)
+        key = (patient, labels, loc_file)
+        if key not in self.locs:
+            self.locs[key] = get_elec_locs(patient, list(labels), loc_file)
+        return self.locs[key].copy()
+
+    def clear(self, patient: Optional[str] = None):
+        """
+        Remove cached montages and locations, of a single patient if specified, otherwise all.
+        """
+        for cache in [self.montages, self.locs]:
+            for key in list(cache):
+                if patient is None or key[0] == patient:
+                    del cache[key]
+
+
+def _digest(locs):
+    if locs is None:
+        return None
+    return hashlib.sha1(np.ascontiguousarray(locs, dtype=float).tobytes()).hexdigest()
+
+
+def _file_version(filename):
+    return os.path.abspath(filename), os.path.getmtime(filename)
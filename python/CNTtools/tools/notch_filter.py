@@ -1,12 +1,20 @@
-from scipy.signal import iirnotch, sosfiltfilt, butter
+from scipy.signal import sosfiltfilt
 import numpy as np
 from beartype import beartype
+from beartype.typing import Optional
 from numbers import Number
+from .filtfilt_blocks import filtfilt_blocks
+from .filter_bank import notch_sos
 
 
 @beartype
 def notch_filter(
-    data: np.ndarray, fs: Number, notch_freq: Number = 60, order: int = 4
+    data: np.ndarray,
+    fs: Number,
+    notch_freq: Number = 60,
+    order: int = 4,
+    block_size: Optional[int] = None,
+    out: Optional[np.ndarray] = None,
 ) -> np.ndarray:
     """Apply notch filter to remove interference at a specified frequency.
 
@@ -15,6 +23,8 @@ def notch_filter(
         fs (float): Sampling frequency of the EEG data.
         notch_freq (float, optional): Frequency to notch filter (default is 60 Hz).
         order (int, optional): Order of the notch filter (default is 4).
+        block_size (int, optional): If given, filter block_size samples at a time with bounded memory (default is None).
+        out (np.ndarray, optional): Array (e.g. a memmap) the filtered data is written into, filtering block-wise (default is None).
 
     Returns:
         np.ndarray: Matrix with notch-filtered EEG data.
@@ -26,9 +36,12 @@ def notch_filter(
     notch_filtered_values = notch_filter(values, fs, notch_freq=120, order=8)
     """
     # b, a = iirnotch(notch_freq, notch_freq / 2, fs=fs)
-    sos = butter(
-        order, [notch_freq - 1, notch_freq + 1], "bandstop", fs=fs, output="sos"
-    )
+    sos = notch_sos(fs, notch_freq, order)
+
+    if block_size is not None or out is not None:
+        return filtfilt_blocks(
+            sos, data, out=out, block_size=block_size if block_size else 2**16
+        )
 
     y = sosfiltfilt(sos, data, axis=0)
 
@@ -1,10 +1,22 @@
 import numpy as np
 from beartype import beartype
+from beartype.typing import Optional
 from numbers import Number
+from .sliding_windows import sliding_windows
+from .accumulator import MatrixAccumulator
 
 
 @beartype
-def pearson(values: np.ndarray, fs: Number, win: bool, win_size: Number) -> np.ndarray:
+def pearson(
+    values: np.ndarray,
+    fs: Number,
+    win: bool,
+    win_size: Number,
+    step: Optional[Number] = None,
+    timeseries: bool = False,
+    variance: bool = False,
+    chunk_size: Optional[int] = None,
+):
     """
     Calculate the Pearson correlation coefficients between channels in iEEG data.
 
@@ -13,9 +25,22 @@ def pearson(values: np.ndarray, fs: Number, win: bool, win_size: Number) -> np.n
     - fs (float): Sampling frequency of the EEG data.
     - win (bool): If True, calculate windowed correlations; if False, calculate overall correlations.
     - win_size (float): Size of the time window in seconds for windowed correlation calculation.
+    - step (float, optional): Step between consecutive windows in seconds. Default is win_size (no overlap).
+    - timeseries (bool, optional): If True, return the correlations of each window and the window start times
+      instead of their average. Default is False.
+    - variance (bool, optional): If True, also return the variance of the correlations over windows. Default is False.
+    - chunk_size (int, optional): Number of windows correlated at once. Default is None, sized to about
+      2**18 samples per chunk, which fit in cache.
 
     Returns:
     - np.ndarray: Pearson correlation coefficients between channels. If windowed, returns an average over time windows.
+      With timeseries, an array of shape windows X channels X channels and the window start times in seconds.
+    - np.ndarray: Variance of the correlations over windows, only with variance.
+
+    Note:
+    Windows are correlated in chunks, all windows of a chunk with a single batched matrix product, and
+    averaged with a streaming MatrixAccumulator, so the correlations of all windows are never stored
+    unless timeseries is True.
 
     Examples:
     >>> values = np.random.rand(100, 5)
@@ -25,37 +50,38 @@ def pearson(values: np.ndarray, fs: Number, win: bool, win_size: Number) -> np.n
     >>> correlations = pearson(values, fs, win, win_size)
     """
 
-    nchs = values.shape[1]
-
-    if not win:
-        avg_pc = np.corrcoef(values, rowvar=False)
-    else:
-        # Define time windows
-        iw = round(win_size * fs)
-        window_start = np.arange(0, values.shape[0], iw)
-
-        # Remove dangling window
-        if window_start[-1] + iw > values.shape[0]:
-            window_start = window_start[:-1]
-
-        nw = len(window_start)
+    if not win and not timeseries and not variance:
+        return np.corrcoef(values, rowvar=False)
 
-        # Initialize output array
-        all_pc = np.empty((nchs, nchs, nw))
-        all_pc[:] = np.nan
+    windows, times = sliding_windows(values, fs, win_size if win else None, step)
+    nw, iw, nchs = windows.shape
+    if chunk_size is None:
+        chunk_size = max(1, 2**18 // (iw * nchs))
 
-        # Calculate pc for each window
-        for i, start in enumerate(window_start):
-            # Define the time clip
-            clip = values[start : start + iw, :]
+    all_pc = []
+    acc = MatrixAccumulator(variance)
+    for t in range(0, nw, chunk_size):
+        pc = _pearson_windows(windows[t : t + chunk_size])
+        if timeseries:
+            all_pc.append(pc)
+        else:
+            acc.update(pc)
+    if timeseries:
+        return np.concatenate(all_pc), times
 
-            pc = np.corrcoef(clip, rowvar=False)
-            # np.fill_diagonal(pc, 0)
+    # Average the network over all time windows
+    if variance:
+        return acc.mean, acc.var
+    return acc.mean
 
-            # Unwrap the pc matrix into a one-dimensional vector for storage
-            all_pc[:, :, i] = pc
 
-        # Average the network over all time windows
-        avg_pc = np.nanmean(all_pc, axis=2)
-
-    return avg_pc
+def _pearson_windows(windows: np.ndarray) -> np.ndarray:
+    """
+    Correlation matrices, as np.corrcoef, of windows of shape (windows, samples, channels).
+    Returns an array of shape (windows, channels, channels).
+    """
+    # z-score all windows at once, then a batched matrix product
+    z = windows - windows.mean(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z /= np.sqrt(np.einsum("wij,wij->wj", z, z))[:, np.newaxis, :]
+    return np.clip(z.swapaxes(1, 2) @ z, -1, 1)
@@ -0,0 +1,243 @@
+import numpy as np
+from scipy import sparse
+from beartype import beartype
+from beartype.typing import Iterable, Optional, Tuple
+from numbers import Number
+from .clean_labels import clean_labels
+from .find_non_ieeg import find_non_ieeg
+from .identify_bad_chs import identify_bad_chs
+from .filter_bank import bandpass_sos, notch_sos
+from .filtfilt_blocks import filtfilt_blocks, _iter_blocks
+from .montage import Montage, MontageCache
+from .pre_whiten import pre_whiten
+
+
+class Pipeline:
+    """
+    Declarative preprocessing pipeline, recorded lazily and executed in chunks of time.
+
+    Steps are recorded by chaining methods named as the iEEGData ones, and run on a clip with run().
+    At execution, consecutive channel selections and montages are fused into a single sparse matrix,
+    and the whole chain of montages and filters is streamed over blocks of block_size samples, each
+    filter consuming the blocks of the previous stage, so no full-size intermediate copy is made and
+    results match running the steps one by one. Only steps
+    that need the whole data at that point (reject_artifact, pre_whiten) materialize it. Montages and
+    filter designs are compiled once and reused for every clip the pipeline is run on.
+
+    Attributes:
+        steps (list): Recorded steps, as (name, parameters).
+        block_size (int): Number of samples processed at once.
+
+    Example:
+    >>> pipe = Pipeline().clean_labels().reject_nonieeg().reject_artifact().filter(1, 120, 60).reref("car")
+    >>> data, ch_names, ref_chnames, info = pipe.run(values, fs, ch_names)
+    >>> for clip in session.datasets.values():
+    ...     clip.apply(pipe)
+    """
+
+    def __init__(self, block_size: int = 2**16):
+        assert block_size > 0, "CNTtools:invalidBlockSize"
+        self.steps = []
+        self.block_size = block_size
+        self._montages = MontageCache()
+
+    def _add(self, name, **params):
+        self.steps.append((name, params))
+        return self
+
+    def copy(self):
+        """
+        Copy of the pipeline, whose steps are unaffected by steps later added to this one.
+        Compiled montages are shared.
+        """
+        pipe = Pipeline(self.block_size)
+        pipe.steps = [(name, dict(params)) for name, params in self.steps]
+        pipe._montages = self._montages
+        return pipe
+
+    def clean_labels(self):
+        """Convert channel names to standardized format."""
+        return self._add("clean_labels")
+
+    def reject_nonieeg(self):
+        """Remove non-iEEG channels."""
+        return self._add("reject_nonieeg")
+
+    def reject_artifact(self):
+        """Remove bad channels, see identify_bad_chs."""
+        return self._add("reject_artifact")
+
+    def bandpass_filter(self, low_freq: Number = 1, high_freq: Number = 120):
+        """Bandpass filter, as bandpass_filter."""
+        return self._add("bandpass_filter", low_freq=low_freq, high_freq=high_freq)
+
+    def notch_filter(self, notch_freq: Number = 60):
+        """Notch filter, as notch_filter."""
+        return self._add("notch_filter", notch_freq=notch_freq)
+
+    def filter(self, low_freq: Number = 1, high_freq: Number = 120, notch_freq: Optional[Number] = 60):
+        """Bandpass and notch filter, as bandpass_notch_filter."""
+        return self._add("filter", low_freq=low_freq, high_freq=high_freq, notch_freq=notch_freq)
+
+    def reref(self, ref: str, loc_file: Optional[str] = None, radius: Number = 20):
+        """
+        Re-reference with 'car', 'bipolar' or 'laplacian', dropping channels without a valid reference.
+        Laplacian re-referencing reads electrode locations from loc_file.
+        """
+        assert ref in ["car", "bipolar", "laplacian"], "CNTtools:invalidRerefMethod"
+        assert ref != "laplacian" or loc_file is not None, "CNTtools:invalidLocFile"
+        return self._add("reref", ref=ref, loc_file=loc_file, radius=radius)
+
+    def pre_whiten(self, order: int = 1):
+        """Pre-whiten each channel, see pre_whiten."""
+        return self._add("pre_whiten", order=order)
+
+    @beartype
+    def run(
+        self,
+        data: np.ndarray,
+        fs: Number,
+        ch_names: Iterable[str],
+        filename: str = "",
+        out: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, dict]:
+        """
+        Run the pipeline on a clip. The input data are never modified.
+
+        Parameters:
+        - data (np.ndarray): iEEG data of shape samples X channels.
+        - fs (Number): Sampling frequency.
+        - ch_names (Iterable[str]): Channel labels.
+        - filename (str, optional): Dataset or patient ID, used to look up electrode locations and cache montages.
+        - out (np.ndarray, optional): Array (e.g. a memmap) the output is written into, if its shape is known.
+
+        Returns:
+        - np.ndarray: Processed data of shape samples X output channels.
+        - np.ndarray: Output channel labels.
+        - np.ndarray: Reference labels of the output channels, empty if not re-referenced.
+        - dict: Results of intermediate steps, 'nonieeg' (mask over channels at reject_nonieeg),
+          'bad' and 'reject_details' (identify_bad_chs output at reject_artifact).
+        """
+        ch_names = np.asarray(list(ch_names))
+        ref_chnames = np.array([])
+        info = {}
+        source = data
+        ops = []  # pending block-wise operations: Montage or second-order sections
+        for name, params in self.steps:
+            if name == "clean_labels":
+                ch_names = clean_labels(ch_names)
+            elif name in ["reject_nonieeg", "reject_artifact"]:
+                if name == "reject_nonieeg":
+                    drop = find_non_ieeg(list(ch_names))
+                    info["nonieeg"] = drop
+                else:
+                    source = self._execute(source, ops)
+                    ops = []
+                    drop, info["reject_details"] = identify_bad_chs(source, fs)
+                    info["bad"] = drop
+                ops = _push_montage(ops, _selection(~drop, ch_names[~drop]))
+                ch_names = ch_names[~drop]
+                if len(ref_chnames) > 0:
+                    ref_chnames = ref_chnames[~drop]
+            elif name in ["bandpass_filter", "notch_filter", "filter"]:
+                sos = []
+                if name != "notch_filter":
+                    sos.append(bandpass_sos(fs, params["low_freq"], params["high_freq"]))
+                if params.get("notch_freq") is not None:
+                    sos.append(notch_sos(fs, params["notch_freq"]))
+                ops.append(np.vstack(sos))
+            elif name == "reref":
+                montage = self._montages.montage(
+                    filename,
+                    ch_names,
+                    params["ref"],
+                    radius=params["radius"],
+                    loc_file=params["loc_file"],
+                )
+                keep = montage.labels != "-"
+                ops = _push_montage(ops, _select_columns(montage, keep))
+                ch_names = ch_names[keep]
+                ref_chnames = montage.labels[keep]
+            elif name == "pre_whiten":
+                # in place on data materialized by the pipeline, never on the input
+                materialized = source is not data or len(ops) > 0
+                source = self._execute(source, ops)
+                ops = []
+                source = pre_whiten(source, params["order"], inplace=materialized)
+        return self._execute(source, ops, out), ch_names, ref_chnames, info
+
+    def _execute(self, source, ops, out=None):
+        """
+        Stream source through the pending operations block by block, into out or a new array.
+        """
+        if not ops and out is None:
+            return source
+        blocks = _iter_blocks(source, self.block_size)
+        nchs = source.shape[1]
+        for op in ops:
+            if isinstance(op, Montage):
+                blocks = op.apply(blocks)
+                nchs = op.shape[1]
+            else:
+                blocks = filtfilt_blocks(op, blocks, block_size=self.block_size)
+        if out is None:
+            out = np.zeros((source.shape[0], nchs))
+        assert out.shape == (source.shape[0], nchs), "CNTtools:invalidOutputShape"
+        pos = 0
+        for block in blocks:
+            out[pos : pos + block.shape[0]] = block
+            pos += block.shape[0]
+        return out
+
+
+def _selection(keep, labels):
+    """Montage selecting the channels in keep."""
+    cols = np.nonzero(keep)[0]
+    matrix = sparse.coo_matrix(
+        (np.ones(len(cols)), (cols, np.arange(len(cols)))), shape=(len(keep), len(cols))
+    )
+    return Montage(matrix, labels)
+
+
+def _select_columns(montage, keep):
+    """Montage with only the output channels in keep."""
+    return Montage(
+        montage.matrix[:, np.nonzero(keep)[0]],
+        montage.labels[keep],
+        montage.neighbors,
+        None if montage.groups is None else montage.groups[keep],
+        montage.in_labels,
+    )
+
+
+def _is_selection(montage):
+    """Whether each output channel is a copy of one input channel."""
+    m = montage.matrix
+    return (
+        montage.neighbors is None
+        and np.all(np.diff(m.indptr) == 1)
+        and np.all(m.data == 1)
+        and not np.any(montage.labels == "-")
+    )
+
+
+def _push_montage(ops, montage):
+    """
+    Append a montage to the pending operations, fused with a preceding montage when exact: a selection
+    followed by any montage, or two montages without neighbor means.
+    """
+    if not ops or not isinstance(ops[-1], Montage):
+        return ops + [montage]
+    prev = ops[-1]
+    if _is_selection(prev):
+        fused = Montage(
+            prev.matrix @ montage.matrix,
+            montage.labels,
+            None if montage.neighbors is None else prev.matrix @ montage.neighbors,
+            montage.groups,
+        )
+    elif prev.neighbors is None and montage.neighbors is None and not np.any(prev.labels == "-"):
+        fused = Montage(prev.matrix @ montage.matrix, montage.labels)
+    else:
+        return ops + [montage]
+    return ops[:-1] + [fused]
@@ -1,8 +1,11 @@
 import numpy as np
 from scipy.signal import hilbert
 from .default_freqs import freqs
-from .bandpass_filter import bandpass_filter
+from .filter_bank import bandpass_stack
+from .sliding_windows import sliding_windows
+from .fill_nan import fill_nan
 from beartype import beartype
+from beartype.typing import Optional
 from numbers import Number
 
 
@@ -13,7 +16,10 @@ def plv(
     win: bool = False,
     win_size: Number = 2,
     freqs: np.ndarray = freqs,
-) -> np.ndarray:
+    chunk_size: Optional[int] = None,
+    step: Optional[Number] = None,
+    timeseries: bool = False,
+):
     """
     Computes phase-locking value (PLV) for iEEG data.
 
@@ -24,82 +30,80 @@ def plv(
         win_size (numeric, optional): Time window size in seconds.
         freqs (numpy array, optional): Matrix where each row represents a frequency range.
                                       The first column is the lower bound, and the second column is the upper bound.
+        chunk_size (int, optional): Number of time windows processed at once, to bound memory use.
+                                      Default is None, sized to about 2**24 samples per chunk.
+        step (numeric, optional): Step between consecutive time windows in seconds. Default is win_size (no overlap).
+        timeseries (bool, optional): If True, return the PLV of each time window and the window start times
+                                      instead of their average.
 
     Returns:
         all_plv (numpy array): PLV matrix where each element (i, j, k) represents the PLV bewin_sizeeen channel i and channel j at frequency range k.
+                               With timeseries, of shape windows X channels X channels X frequency ranges,
+                               followed by the window start times in seconds.
 
     Example:
         all_plv = plv(values, fs)
         all_plv = plv(values, fs, win=True, win_size=2, freqs=np.array([[4, 8], [8, 12]]))
     """
-    # Parameters
-    nchs = values.shape[1]
-    nfreqs = freqs.shape[0]
 
     if win and (win_size > values.shape[0] / fs):
         win = False
 
-    # Initialize output matrix
-    all_plv = np.ones((nchs, nchs, nfreqs))
-
-    # Preprocess values
-    for ich in range(nchs):
-        curr_values = values[:, ich]
-        curr_values[np.isnan(curr_values)] = np.nanmean(curr_values)
-        values[:, ich] = curr_values
+    # Fill NaN with the channel mean, leaving values unchanged
+    values = fill_nan(values)[0]
 
     # Get filtered signal
-    filtered_data = np.zeros((values.shape[0], values.shape[1], nfreqs))
-    for f in range(nfreqs):
-        filtered_data[:, :, f] = bandpass_filter(values, fs, freqs[f, 0], freqs[f, 1])
-
-    if win:
-        # Divide into time windows
-        iw = int(win_size * fs)
-        window_start = np.arange(0, values.shape[0], iw)
-
-        # Remove dangling window
-        if window_start[-1] + iw > values.shape[0]:
-            window_start = window_start[:-1]
-
-        nw = len(window_start)
-
-        all_plv = np.ones((nchs, nchs, nfreqs, nw))
-        for t in range(nw):
-            for f in range(nfreqs):
-                tmp_data = filtered_data[window_start[t] : window_start[t] + iw, :, f]
-
-                # Get phase of each signal
-                phase = np.angle(hilbert(tmp_data))
-
-                # Get PLV
-                plv = np.ones((nchs, nchs))
-                for ich in range(nchs):
-                    for jch in range(ich + 1, nchs):
-                        e = np.exp(1j * (phase[:, ich] - phase[:, jch]))
-                        plv[ich, jch] = np.abs(np.sum(e, axis=0)) / phase.shape[0]
-                        plv[jch, ich] = plv[ich, jch]
-
-                all_plv[:, :, f, t] = plv
-
-        all_plv = np.nanmean(all_plv, axis=3)
-    else:
-        all_plv = np.ones((nchs, nchs, nfreqs))
-        # Do PLV for each frequency
-        for f in range(nfreqs):
-            tmp_data = filtered_data[:, :, f]
-
-            # Get phase of each signal
-            phase = np.angle(hilbert(tmp_data))
-
-            # Get PLV
-            plv = np.ones((nchs, nchs))
-            for ich in range(nchs):
-                for jch in range(ich + 1, nchs):
-                    e = np.exp(1j * (phase[:, ich] - phase[:, jch]))
-                    plv[ich, jch] = np.abs(np.sum(e, axis=0)) / phase.shape[0]
-                    plv[jch, ich] = plv[ich, jch]
-
-            all_plv[:, :, f] = plv
+    filtered_data = bandpass_stack(values, fs, freqs)
+
+    windows, times = sliding_windows(filtered_data, fs, win_size if win else None, step)
+    all_plv = _plv_windows(windows, chunk_size, not timeseries)
+    if timeseries:
+        return all_plv, times
+    return all_plv
+
+
+def _plv_windows(
+    windows: np.ndarray, chunk_size: Optional[int] = None, average: bool = True
+) -> np.ndarray:
+    """
+    PLV averaged over band-filtered windows of shape (windows, samples, channels, bands).
+    Returns an array of shape (channels, channels, bands), or (windows, channels, channels, bands) if not average.
+    """
+    nw, iw, nchs, nfreqs = windows.shape
+    if chunk_size is None:
+        chunk_size = max(1, 2**24 // (iw * nchs * nfreqs))
+
+    # Accumulate PLV over windows, in chunks of windows to bound memory
+    plv_sum = np.zeros((nfreqs, nchs, nchs))
+    plv_count = np.zeros((nfreqs, nchs, nchs))
+    plv_windows = []
+    for t in range(0, nw, chunk_size):
+        plv = _plv_matrix(windows[t : t + chunk_size])
+        if not average:
+            plv[..., np.arange(nchs), np.arange(nchs)] = 1
+            plv_windows.append(plv.transpose(0, 2, 3, 1))
+            continue
+        valid = ~np.isnan(plv)
+        plv_sum += np.where(valid, plv, 0).sum(axis=0)
+        plv_count += valid.sum(axis=0)
+
+    if not average:
+        return np.concatenate(plv_windows)
+    with np.errstate(invalid="ignore"):
+        all_plv = (plv_sum / plv_count).transpose(1, 2, 0)
+    all_plv[np.arange(nchs), np.arange(nchs), :] = 1
 
     return all_plv
+
+
+def _plv_matrix(windows: np.ndarray) -> np.ndarray:
+    """
+    PLV of all channel pairs, from band-filtered windows of shape (windows, samples, channels, bands).
+    Returns an array of shape (windows, bands, channels, channels).
+    """
+    # Unit phasor of each channel, computed once
+    phase = np.angle(hilbert(windows, axis=1))
+    z = np.exp(1j * phase).transpose(0, 3, 1, 2)  # windows X bands X samples X channels
+
+    # All pairs at once: |Z^H Z| / N
+    return np.abs(np.conj(z).swapaxes(-1, -2) @ z) / z.shape[2]
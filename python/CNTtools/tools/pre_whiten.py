@@ -1,26 +1,103 @@
-from sklearn.linear_model import LinearRegression
 import numpy as np
 from beartype import beartype
 
 
+def _ar1_coefs(data):
+    """
+    Least-squares fit of x[t+1] = a * x[t] + b for all channels, from NaN-aware closed-form sums.
+    """
+    x, y = data[:-1], data[1:]
+    valid = ~(np.isnan(x) | np.isnan(y))
+    n = valid.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if np.all(valid):
+            mx, my = x.mean(axis=0), y.mean(axis=0)
+            xc = x - mx
+            sxx = np.einsum("ij,ij->j", xc, xc)
+            sxy = np.einsum("ij,ij->j", xc, y - my)
+        else:
+            mx = np.where(valid, x, 0).sum(axis=0) / n
+            my = np.where(valid, y, 0).sum(axis=0) / n
+            xc = np.where(valid, x - mx, 0)
+            sxx = np.einsum("ij,ij->j", xc, xc)
+            sxy = np.einsum("ij,ij->j", xc, np.where(valid, y - my, 0))
+        # constant channels are predicted by their mean
+        a = np.where(sxx > 0, sxy / sxx, 0)
+    return a[np.newaxis], my - a * mx
+
+
+def _yule_walker_coefs(data, order):
+    """
+    AR coefficients of x[t+1] = c + sum_k phi[k-1] * x[t+1-k] for all channels, solving the
+    Yule-Walker equations of NaN-aware autocovariances as a batch of order X order systems.
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mu = np.nanmean(data, axis=0)
+        valid = ~np.isnan(data)
+        xc = np.where(valid, data - mu, 0)
+        r = np.stack(
+            [
+                np.einsum("ij,ij->j", xc[: len(xc) - k], xc[k:])
+                / (valid[: len(xc) - k] & valid[k:]).sum(axis=0)
+                for k in range(order + 1)
+            ]
+        )
+    lags = np.abs(np.subtract.outer(np.arange(order), np.arange(order)))
+    toeplitz = np.moveaxis(r[lags], -1, 0)  # channels X order X order
+    phi = np.full((order, data.shape[1]), np.nan)
+    ok = np.all(np.isfinite(toeplitz), axis=(1, 2)) & (np.linalg.matrix_rank(toeplitz) == order)
+    if np.any(ok):
+        phi[:, ok] = np.linalg.solve(toeplitz[ok], r[1:, ok].T[..., np.newaxis])[..., 0].T
+    return phi, mu * (1 - phi.sum(axis=0))
+
+
 @beartype
-def pre_whiten(data: np.ndarray) -> np.ndarray:
+def pre_whiten(
+    data: np.ndarray, order: int = 1, inplace: bool = False, block_size: int = 2**16
+) -> np.ndarray:
     """Pre-whiten the input data using linear regression.
 
+    Each channel is fit by an autoregressive model, and the prediction error is returned: row t holds
+    the prediction of x[t+1] minus x[t+1], and rows without a prediction are NaN (the last one, and the
+    first order - 1 ones). All channels are fit at once; samples with NaN are ignored in the fit.
+
     Args:
         data (np.ndarray): Matrix representing data. Each column is a channel, and each row is a time point.
+        order (int, optional): Order of the autoregressive model. Order 1 is the least-squares fit of x[t+1]
+            on x[t], higher orders are fit with the Yule-Walker equations. Default is 1.
+        inplace (bool, optional): Write the result into data instead of a new array. Default is False.
+        block_size (int, optional): Number of rows whose residuals are computed at once. Default is 2**16.
 
     Returns:
         np.ndarray: Pre-whitened data matrix.
     """
-    for i in range(data.shape[1]):
-        vals = data[:, i].reshape(-1, 1)
-        if np.sum(~np.isnan(vals)) == 0:
-            continue
-        model = LinearRegression().fit(vals[:-1, :], vals[1:, :])
-        E = model.predict(vals[:-1, :]) - vals[1:, :]
-        if len(E) < len(vals):
-            E = np.concatenate([E, np.nan * np.zeros([len(vals) - len(E), 1])])
-        data[:, i] = E.reshape(-1)
-
-    return data
+    assert order > 0, "CNTtools:invalidOrder"
+    assert block_size > 0, "CNTtools:invalidBlockSize"
+    if inplace:
+        assert np.issubdtype(data.dtype, np.floating), "CNTtools:invalidDtype"
+        out = data
+    else:
+        out = np.empty(data.shape, dtype=np.result_type(data.dtype, float))
+    if data.shape[0] <= order:
+        out[:] = np.nan
+        return out
+    if order == 1:
+        phi, c = _ar1_coefs(data)
+    else:
+        phi, c = _yule_walker_coefs(data, order)
+
+    # residuals in blocks of rows, in increasing order, keeping the original rows still needed once
+    # overwritten in place
+    nrows = data.shape[0]
+    history = np.array(data[: order - 1], dtype=out.dtype)
+    for start in range(order - 1, nrows - 1, block_size):
+        stop = min(start + block_size, nrows - 1)
+        window = np.concatenate([history, data[start : stop + 1]])
+        resid = c - window[order:]
+        for k in range(1, order + 1):
+            resid += phi[k - 1] * window[order - k : len(window) - k]
+        history = window[len(window) - order : len(window) - 1].copy()
+        out[start:stop] = resid
+    out[: order - 1] = np.nan
+    out[-1] = np.nan
+    return out
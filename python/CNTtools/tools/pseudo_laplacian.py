@@ -1,6 +1,7 @@
 import numpy as np
 import re
 from beartype.typing import Iterable, Tuple
+from .montage import compile_montage
 
 
 def pseudo_laplacian(
@@ -20,71 +21,9 @@ def pseudo_laplacian(
         np.ndarray: Channel labels for the pseudo-laplacian-referenced data.
     """
 
-    nchs = values.shape[1]
-    old_values = values.copy()
+    montage = compile_montage("pseudo_laplacian", chLabels, soft=soft, soft_thres=softThres)
 
-    # Decompose chLabels
-    elecs, numbers = decompose(chLabels)
-    out_labels = chLabels.copy()
-
-    # Pseudo-laplacian montage
-    for ch in range(nchs):
-        # Initialize it as nans
-        out = np.nan * np.zeros(values.shape[0])
-        bipolar_label = "-"
-
-        # Get the clean label
-        label = chLabels[ch]
-
-        # get the non numerical portion of the electrode contact
-        label_non_num = elecs[ch]
-
-        # get numerical portion
-        label_num = numbers[ch]
-
-        if not np.isnan(label_num):
-            # see if there exists one higher
-            label_nums_high = (
-                list(range(label_num + 1, label_num + softThres + 2))
-                if soft
-                else [label_num + 1]
-            )
-            label_nums_low = (
-                list(range(label_num - softThres - 1, label_num))[::-1]
-                if soft
-                else [label_num - 1]
-            )
-            higher_ch = np.nan
-            lower_ch = np.nan
-
-            for label_num_i in label_nums_high:
-                higher_label = label_non_num + str(label_num_i)
-                if higher_label in chLabels:
-                    higher_ch = np.where(chLabels == higher_label)[0][0]
-                    break
-
-            for label_num_i in label_nums_low:
-                lower_label = label_non_num + str(label_num_i)
-                if lower_label in chLabels:
-                    lower_ch = np.where(chLabels == lower_label)[0][0]
-                    break
-
-            if (not np.isnan(higher_ch)) and (not np.isnan(lower_ch)):
-                out = (
-                    old_values[:, ch]
-                    - (old_values[:, higher_ch] + old_values[:, lower_ch]) / 2
-                )
-            elif not np.isnan(higher_ch):
-                out = old_values[:, ch] - old_values[:, higher_ch]
-            elif not np.isnan(lower_ch):
-                out = old_values[:, ch] - old_values[:, lower_ch]
-            else:
-                out_labels[ch] = bipolar_label
-        else:
-            out_labels[ch] = bipolar_label
-        values[:, ch] = out
-
-    return values, np.array(out_labels)
+    return montage.apply(values), montage.labels
 
 
 def decompose(labels: Iterable[str]) -> Tuple[list, list]:
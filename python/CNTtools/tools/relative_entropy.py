@@ -1,7 +1,10 @@
 import numpy as np
 from .default_freqs import freqs
-from .bandpass_filter import bandpass_filter
+from .filter_bank import bandpass_stack
+from .sliding_windows import sliding_windows
+from .fill_nan import fill_nan
 from beartype import beartype
+from beartype.typing import Optional
 from numbers import Number
 
 
@@ -12,6 +15,10 @@ def relative_entropy(
     win: bool = False,
     win_size: Number = 2,
     freqs: np.ndarray = freqs,
+    bins: int = 10,
+    binning: str = "channel",
+    step: Optional[Number] = None,
+    timeseries: bool = False,
 ):
     """
     Calculates relative entropy for iEEG data.
@@ -22,73 +29,98 @@ def relative_entropy(
     - win (bool, optional): Boolean indicating whether to use time windows (True) or compute a single relative entropy (False). Default is False.
     - win_size (numeric, optional): Time window size in seconds. Default is 2 seconds.
     - freqs (numpy array, optional): Matrix where each row represents a frequency range. The first column is the lower bound, and the second column is the upper bound.
+    - bins (int, optional): Number of histogram bins. Default is 10.
+    - binning (str, optional): 'channel' bins each channel over its own range, 'shared' bins all channels over their common range. Default is 'channel'.
+    - step (numeric, optional): Step between consecutive time windows in seconds. Default is win_size (no overlap).
+    - timeseries (bool, optional): If True, return the relative entropy of each time window and the window start times instead of their average. Default is False.
 
     Returns:
     - re (numpy array): Relative entropy matrix where each element (i, j, k) represents the relative entropy bewin_sizeeen channel i and channel j at frequency range k.
+      With timeseries, of shape windows X channels X channels X frequency ranges, followed by the window start times in seconds.
     """
 
-    nchs = values.shape[1]
-    nfreqs = freqs.shape[0]
+    assert binning in ["channel", "shared"], "CNTtools:invalidBinning"
 
     if win and (win_size > values.shape[0] / fs):
         win = False
 
-    for ich in range(nchs):
-        curr_values = values[:, ich]
-        curr_values[np.isnan(curr_values)] = np.nanmean(curr_values)
-        values[:, ich] = curr_values
-
-    filtered_data = np.zeros((values.shape[0], values.shape[1], nfreqs))
-
-    for f in range(nfreqs):
-        filtered_data[:, :, f] = bandpass_filter(values, fs, freqs[f, 0], freqs[f, 1])
-
-    if win:
-        iw = round(win_size * fs)
-        window_start = np.arange(0, values.shape[0], iw)
-
-        # remove dangling window
-        if window_start[-1] + iw > values.shape[0]:
-            window_start = window_start[:-1]
-
-        nw = len(window_start)
-        re = np.nan * np.zeros((nchs, nchs, nfreqs, nw))
-
-        for t in range(nw):
-            for f in range(nfreqs):
-                tmp_data = filtered_data[window_start[t] : window_start[t] + iw, :, f]
-
-                for ich in range(nchs):
-                    for jch in range(ich, nchs):
-                        h1 = np.histogram(tmp_data[:, ich], bins=10)[0]  # faster
-                        h2 = np.histogram(tmp_data[:, jch], bins=10)[0]
-                        smooth = 1e-10
-                        h1 = h1 + smooth
-                        h2 = h2 + smooth
-                        h1 = h1 / np.sum(h1)
-                        h2 = h2 / np.sum(h2)
-                        S1 = np.sum(h1 * np.log(h1 / h2))
-                        S2 = np.sum(h2 * np.log(h2 / h1))
-                        re[ich, jch, f, t] = max([S1, S2])
-                        re[jch, ich, f, t] = re[ich, jch, f, t]
-
-        re = np.nanmean(re, axis=3)
-
-    else:
-        re = np.nan * np.zeros((nchs, nchs, nfreqs))
-
-        for f in range(nfreqs):
-            tmp_data = filtered_data[:, :, f]
-
-            for ich in range(nchs):
-                for jch in range(ich, nchs):
-                    h1 = np.histogram(tmp_data[:, ich], bins=10)[0]
-                    h2 = np.histogram(tmp_data[:, jch], bins=10)[0]
-                    h1 = h1 / np.sum(h1)
-                    h2 = h2 / np.sum(h2)
-                    S1 = np.sum(h1 * np.log(h1 / h2))
-                    S2 = np.sum(h2 * np.log(h2 / h1))
-                    re[ich, jch, f] = max([S1, S2])
-                    re[jch, ich, f] = re[ich, jch, f]
+    # Fill NaN with the channel mean, leaving values unchanged
+    values = fill_nan(values)[0]
 
+    filtered_data = bandpass_stack(values, fs, freqs)
+
+    windows, times = sliding_windows(filtered_data, fs, win_size if win else None, step)
+    re = _relative_entropy_windows(windows, bins, binning, not timeseries)
+    if timeseries:
+        return re, times
     return re
+
+
+def _relative_entropy_windows(
+    windows: np.ndarray, bins: int = 10, binning: str = "channel", average: bool = True
+) -> np.ndarray:
+    """
+    Relative entropy averaged over band-filtered windows of shape (windows, samples, channels, bands).
+    Returns an array of shape (channels, channels, bands), or (windows, channels, channels, bands) if not average.
+    """
+    nw, iw, nchs, nfreqs = windows.shape
+
+    # Chunks of windows, bounding bin indices to ~2**24 samples
+    nw_chunk = max(1, 2**24 // (iw * nchs * nfreqs))
+    re_sum = np.zeros((nfreqs, nchs, nchs))
+    re_count = np.zeros((nfreqs, nchs, nchs))
+    re_windows = []
+    for t in range(0, nw, nw_chunk):
+        # Histograms of all channels, once per band and window
+        h = _histograms(windows[t : t + nw_chunk], bins, binning)
+        h = h + 1e-10  # smooth
+        h = h / np.sum(h, axis=-1, keepdims=True)
+        logh = np.log(h)
+
+        # Symmetric KL divergence of all pairs: S1[i, j] = sum(h_i * log(h_i / h_j))
+        S1 = np.sum(h * logh, axis=-1)[..., np.newaxis] - h @ logh.swapaxes(-1, -2)
+        re = np.maximum(S1, S1.swapaxes(-1, -2))
+        re[..., np.arange(nchs), np.arange(nchs)] = 0
+        if not average:
+            re_windows.append(re.transpose(0, 2, 3, 1))
+            continue
+        valid = ~np.isnan(re)
+        re_sum += np.where(valid, re, 0).sum(axis=0)
+        re_count += valid.sum(axis=0)
+
+    if not average:
+        return np.concatenate(re_windows)
+    with np.errstate(invalid="ignore"):
+        re = (re_sum / re_count).transpose(1, 2, 0)
+
+    return re
+
+
+def _histograms(windows: np.ndarray, bins: int, binning: str) -> np.ndarray:
+    """
+    Histogram counts, binned as np.histogram, of windows of shape (windows, samples, channels, bands).
+    Returns counts of shape (windows, bands, channels, bins).
+    """
+    windows = windows.transpose(0, 3, 2, 1)  # windows X bands X channels X samples
+    lo = np.min(windows, axis=-1, keepdims=True)
+    hi = np.max(windows, axis=-1, keepdims=True)
+    if binning == "shared":
+        lo = np.min(lo, axis=-2, keepdims=True)
+        hi = np.max(hi, axis=-2, keepdims=True)
+    # constant signals are binned around their value
+    same = lo == hi
+    lo = np.where(same, lo - 0.5, lo)
+    hi = np.where(same, hi + 0.5, hi)
+
+    # bin indices, with the same edge corrections as np.histogram
+    edges = lo + np.arange(bins + 1) * ((hi - lo) / bins)
+    edges[..., -1:] = hi
+    ind = ((windows - lo) * (bins / (hi - lo))).astype(np.intp)
+    ind[ind == bins] -= 1
+    ind -= windows < np.take_along_axis(edges, ind, axis=-1)
+    ind += (windows >= np.take_along_axis(edges, ind + 1, axis=-1)) & (ind != bins - 1)
+
+    # count all histograms at once
+    offsets = np.arange(int(np.prod(ind.shape[:-1]))).reshape(ind.shape[:-1]) * bins
+    counts = np.bincount((ind + offsets[..., np.newaxis]).ravel(), minlength=offsets.size * bins)
+    return counts.reshape(ind.shape[:-1] + (bins,)).astype(float)
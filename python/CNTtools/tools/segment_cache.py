@@ -0,0 +1,196 @@
+import numpy as np
+import os, json, time, hashlib
+from beartype import beartype
+from beartype.typing import Callable, Iterable, Optional
+from numbers import Number
+from CNTtools import settings
+
+
+class SegmentCache:
+    """
+    Local on-disk cache of data pulled from iEEG.org.
+
+    Data are stored as blocks of fixed duration aligned to multiples of block_size from the start of
+    the recording, one .npy file per (dataset, channels, block). A request is served from the cached
+    blocks, and only the missing gaps are pulled. An index file keeps track of block sizes and last
+    access times, and the least recently used blocks are evicted once the total size exceeds max_size.
+
+    Attributes:
+        cache_dir (str): Folder holding the blocks and the index file.
+        block_size (Number): Duration of each block in seconds.
+        max_size (Number): Maximum total size of cached blocks in bytes.
+
+    Example:
+    >>> cache = SegmentCache(settings.CACHE_DIR)
+    >>> data = cache.fetch("HUP172_phaseII", ch_names, fs, start_usec, stop_usec, pull)
+    >>> cache.clear("HUP172_phaseII")
+    """
+
+    index_file = "index.json"
+
+    @beartype
+    def __init__(
+        self,
+        cache_dir: str = settings.CACHE_DIR,
+        block_size: Number = settings.CACHE_BLOCK,
+        max_size: Number = settings.CACHE_SIZE,
+    ):
+        assert block_size > 0, "CNTtools:invalidBlockSize"
+        self.cache_dir = cache_dir
+        self.block_size = block_size
+        self.max_size = max_size
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self._load_index()
+
+    def _load_index(self):
+        path = os.path.join(self.cache_dir, self.index_file)
+        self.index = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.index = json.load(f)
+        # drop entries whose block file was removed outside the cache
+        self.index = {
+            k: v for k, v in self.index.items() if os.path.exists(self._block_file(k))
+        }
+
+    def _save_index(self):
+        path = os.path.join(self.cache_dir, self.index_file)
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.index, f)
+        os.replace(path + ".tmp", path)
+
+    def _block_file(self, key):
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def _key(self, dataset, channels, fs, block):
+        content = "|".join(
+            [dataset, ",".join(channels), str(fs), str(self.block_size), str(block)]
+        )
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def _sample(self, usec, fs):
+        """Global sample index of a time point, shared by all blocks."""
+        return int(np.round(usec * 1e-6 * fs))
+
+    @property
+    def size(self) -> int:
+        """Total size of cached blocks in bytes."""
+        return int(sum(v["size"] for v in self.index.values()))
+
+    def _store(self, key, dataset, block, data):
+        np.save(self._block_file(key), data)
+        self.index[key] = {
+            "dataset": dataset,
+            "block": int(block),
+            "size": int(data.nbytes),
+            "atime": time.time(),
+        }
+
+    def _evict(self, keep=()):
+        """Remove least recently used blocks until the cache fits in max_size."""
+        total = self.size
+        for key in sorted(self.index, key=lambda k: self.index[k]["atime"]):
+            if total <= self.max_size:
+                break
+            if key in keep:
+                continue
+            total -= self.index[key]["size"]
+            os.remove(self._block_file(key))
+            del self.index[key]
+
+    def fetch(
+        self,
+        dataset: str,
+        channels: Iterable[str],
+        fs: Number,
+        start_usec: Number,
+        stop_usec: Number,
+        pull: Callable,
+        end_usec: Optional[Number] = None,
+    ) -> np.ndarray:
+        """
+        Return data between start_usec and stop_usec, pulling only the blocks that are not cached.
+
+        Parameters:
+        - dataset (str): Name of the iEEG dataset.
+        - channels (Iterable[str]): Channel names of the requested data, part of the cache key.
+        - fs (Number): Sampling frequency of the dataset.
+        - start_usec (Number): Start time in microseconds.
+        - stop_usec (Number): Stop time in microseconds.
+        - pull (Callable): pull(start_usec, stop_usec) returning data of shape samples X channels, or a
+            tuple of the data and a boolean mask of the samples actually pulled. Blocks that came back
+            incomplete are returned but not cached, and pulled again by the next request.
+        - end_usec (Number, optional): End of the recording, the last block is truncated to it.
+
+        Returns:
+        - np.ndarray: Data of shape samples X channels.
+        """
+        assert start_usec < stop_usec, "CNTtools:invalidTimeRange"
+        channels = [str(i) for i in channels]
+        block_usec = int(self.block_size * 1e6)
+        blocks = np.arange(start_usec // block_usec, -(-stop_usec // block_usec))
+        blocks = blocks.astype(int)
+        keys = [self._key(dataset, channels, fs, b) for b in blocks]
+
+        # pull contiguous runs of missing blocks at once
+        incomplete = {}
+        missing = [b for b, k in zip(blocks, keys) if k not in self.index]
+        runs = []
+        for b in missing:
+            if runs and runs[-1][1] == b:
+                runs[-1][1] = b + 1
+            else:
+                runs.append([b, b + 1])
+        for b0, b1 in runs:
+            run_start = b0 * block_usec
+            run_stop = b1 * block_usec
+            if end_usec is not None:
+                run_stop = min(run_stop, end_usec)
+            run_data, filled = pull(run_start, run_stop), None
+            if isinstance(run_data, tuple):
+                run_data, filled = run_data
+            offset = self._sample(run_start, fs)
+            for b in range(b0, b1):
+                s0 = self._sample(b * block_usec, fs) - offset
+                s1 = self._sample(min((b + 1) * block_usec, run_stop), fs) - offset
+                key = self._key(dataset, channels, fs, b)
+                block = np.ascontiguousarray(run_data[s0:s1, :])
+                complete = block.shape[0] == s1 - s0
+                if filled is not None:
+                    complete = complete and bool(np.all(filled[s0:s1]))
+                if complete:
+                    self._store(key, dataset, b, block)
+                else:
+                    incomplete[key] = block
+
+        # assemble the requested range from blocks
+        s_start = self._sample(start_usec, fs)
+        s_stop = self._sample(stop_usec, fs)
+        data = np.nan * np.zeros((s_stop - s_start, len(channels)))
+        now = time.time()
+        for b, key in zip(blocks, keys):
+            if key in incomplete:
+                block = incomplete[key]
+            else:
+                block = np.load(self._block_file(key), mmap_mode="r")
+                self.index[key]["atime"] = now
+            b0 = self._sample(b * block_usec, fs)
+            lo = max(s_start, b0)
+            hi = min(s_stop, b0 + block.shape[0])
+            if hi > lo:
+                data[lo - s_start : hi - s_start, :] = block[lo - b0 : hi - b0, :]
+
+        self._evict(keep=set(keys))
+        self._save_index()
+        return data
+
+    def clear(self, dataset: Optional[str] = None):
+        """
+        Remove cached blocks, of a single dataset if specified, otherwise all.
+        """
+        for key in list(self.index):
+            if dataset is None or self.index[key]["dataset"] == dataset:
+                os.remove(self._block_file(key))
+                del self.index[key]
+        self._save_index()
@@ -0,0 +1,54 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from beartype import beartype
+from beartype.typing import Optional, Tuple
+from numbers import Number
+
+WINDOW_PADDING = ["drop", "nan", "zero"]
+
+
+@beartype
+def sliding_windows(
+    data: np.ndarray,
+    fs: Number,
+    win_size: Optional[Number] = None,
+    step: Optional[Number] = None,
+    pad: str = "drop",
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Split data into (possibly overlapping) time windows, as a zero-copy strided view.
+
+    Parameters:
+    - data (np.ndarray): Data of shape samples X ..., e.g. samples X channels or samples X channels X bands.
+    - fs (Number): Sampling frequency.
+    - win_size (Number, optional): Window length in seconds. If None or longer than the data, a single
+      window of the whole data.
+    - step (Number, optional): Step between the starts of consecutive windows in seconds.
+      Default is win_size (no overlap).
+    - pad (str, optional): Handling of the samples after the last full window. 'drop' discards them,
+      'nan' and 'zero' pad a last window with NaN or zeros, which copies the data. Default is 'drop'.
+
+    Returns:
+    - np.ndarray: Windows of shape windows X samples X ..., a read-only view of data unless padded.
+    - np.ndarray: Start time of each window in seconds.
+
+    Example:
+    >>> windows, times = sliding_windows(values, fs, win_size=2, step=1)
+    >>> power = np.mean(windows**2, axis=1)  # windows X channels
+    """
+    assert pad in WINDOW_PADDING, "CNTtools:invalidPadding"
+    nsamples = data.shape[0]
+    iw = nsamples if win_size is None else round(win_size * fs)
+    if iw >= nsamples or iw <= 0:
+        view = data[np.newaxis]
+        view.flags.writeable = False
+        return view, np.zeros(1)
+    istep = iw if step is None else round(step * fs)
+    assert istep > 0, "CNTtools:invalidStep"
+
+    dangling = (nsamples - iw) % istep
+    if pad != "drop" and dangling > 0:
+        fill = np.full((istep - dangling,) + data.shape[1:], np.nan if pad == "nan" else 0)
+        data = np.concatenate([data, fill.astype(np.result_type(data.dtype, fill.dtype))])
+    windows = np.moveaxis(sliding_window_view(data, iw, axis=0)[::istep], -1, 1)
+    return windows, np.arange(windows.shape[0]) * istep / fs
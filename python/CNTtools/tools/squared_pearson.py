@@ -1,13 +1,19 @@
 import numpy as np
 from .pearson import pearson
 from beartype import beartype
+from beartype.typing import Optional
 from numbers import Number
 
 
 @beartype
 def squared_pearson(
-    values: np.ndarray, fs: Number, win: bool = False, win_size: Number = 2
-) -> np.ndarray:
+    values: np.ndarray,
+    fs: Number,
+    win: bool = False,
+    win_size: Number = 2,
+    step: Optional[Number] = None,
+    timeseries: bool = False,
+):
     """
     Calculate the Squared Pearson correlation coefficients bewin_sizeeen channels in iEEG data.
 
@@ -16,6 +22,8 @@ def squared_pearson(
     - fs (float): Sampling frequency of the iEEG data.
     - win (bool, optional): If True, calculate windowed correlations; if False, calculate overall correlations. Default is false.
     - win_size (float, optional): Size of the time window in seconds for windowed correlation calculation. Default is 2 seconds
+    - step (float, optional): Step between consecutive windows in seconds. Default is win_size (no overlap).
+    - timeseries (bool, optional): If True, return the values of each window and the window start times, see pearson.
 
     Returns:
     - avg_pc (numpy array): Pearson correlation coefficients bewin_sizeeen channels. If windowed, returns an average over time windows.
@@ -28,6 +36,10 @@ def squared_pearson(
     correlations = squared_pearson(values, fs, win=True, win_size=3)
     """
 
-    corr = pearson(values, fs, win=win, win_size=win_size)
+    if timeseries:
+        corr, times = pearson(values, fs, win, win_size, step, timeseries=True)
+        return corr**2, times
+
+    corr = pearson(values, fs, win=win, win_size=win_size, step=step)
 
     return corr**2